@@ -13,6 +13,13 @@ Usage Instructions:
         In fx, you may specify parameter translateTo ('xsampa' or 'ipa')
             default = 'xsampa'
     When prompted, enter directory of text files to translate.
+    
+    Non-interactive: execute translateDirectory(inDir, outDir) to translate 
+    a directory tree in parallel, skipping files already translated.
+    
+    For data already loaded in pandas, execute 
+    translateDataFrame(df, columns, transTo, suffix) to translate only the 
+    unique values of the given columns.
 
 """
 
@@ -226,12 +233,86 @@ _ipa2xsampa = { v:k for (k,v) in _xsampa_and_diac2ipa.items() }
 
 
 
+# Compiled tries of translation dicts, keyed by id(d): (d, trie)
+_tries = {}
+
+def compile_trie(d):
+    '''trie=compile_trie(d):
+    Build a character trie of the keys of dict, d.
+    Each node is a dict from next character to child node;
+    node[None] = d[key] if a key ends at that node.
+    Empty keys are ignored, as in translate_string.
+'''
+    trie = {}
+    for (k,v) in d.items():
+        if not k:
+            continue
+        node = trie
+        for c in k:
+            node = node.setdefault(c,{})
+        node[None] = v
+    return(trie)
+
+def get_trie(d):
+    '''Return the compiled trie of dict, d, building it on first use.'''
+    if id(d) not in _tries or _tries[id(d)][0] is not d:
+        _tries[id(d)] = (d, compile_trie(d))
+    return(_tries[id(d)][1])
+
 def translate_string(s, d):
     '''(tl,ttf)=translate_string(s,d):
     Translate the string, s, using symbols from dict, d, as:
     1. Min # untranslatable symbols, then 2. Min # symbols.
     tl = list of translated or untranslated symbols.
     ttf[n] = True if tl[n] was translated, else ttf[n]=False.
+    Same segmentation as translate_string_lattice, found by walking
+    the compiled trie of d forward from each position of s.
+'''
+    N = len(s)
+    symcost = 1    # path cost per translated symbol
+    oovcost = 10   # path cost per untranslatable symbol
+    trie = get_trie(d)
+    # cost[n] = pathcost to s[:n]; back[n] = start of last symbol;
+    # sym[n] = its translation; ttf[n] = True/False
+    cost = [0] + [None]*N
+    back = [0]*(N+1)
+    sym = ['']*(N+1)
+    ttf = [True]*(N+1)
+    for i in range(N):
+        # Relax every translatable sequence s[i:j]. On equal cost the
+        # latest start (shortest symbol) wins, as in the lattice.
+        node = trie
+        j = i
+        while j < N:
+            node = node.get(s[j])
+            if node is None:
+                break
+            j += 1
+            if None in node:
+                c = cost[i]+symcost
+                if cost[j] is None or c <= cost[j]:
+                    (cost[j],back[j],sym[j],ttf[j]) = (c,i,node[None],True)
+        # s[i] untranslatable; wins ties, as in the lattice
+        c = cost[i]+oovcost
+        if cost[i+1] is None or c <= cost[i+1]:
+            (cost[i+1],back[i+1],sym[i+1],ttf[i+1]) = (c,i,s[i],False)
+    # Back-trace
+    tl = []
+    translated = []
+    n = N
+    while n > 0:
+        tl.append(sym[n])
+        translated.append(ttf[n])
+        n = back[n]
+    return((tl[::-1], translated[::-1]))
+
+def translate_string_lattice(s, d):
+    '''(tl,ttf)=translate_string_lattice(s,d):
+    Translate the string, s, using symbols from dict, d, as:
+    1. Min # untranslatable symbols, then 2. Min # symbols.
+    tl = list of translated or untranslated symbols.
+    ttf[n] = True if tl[n] was translated, else ttf[n]=False.
+    Original lattice implementation, kept as reference for benchmarkTranslate.
 '''
     N = len(s)
     symcost = 1    # path cost per translated symbol
@@ -273,7 +354,11 @@ def xsampa2ipa(x,language):
 
 import io
 import os
+import tempfile
+import timeit
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
+from functools import lru_cache
 
 @contextmanager
 def change_dir(newdir):
@@ -284,6 +369,7 @@ def change_dir(newdir):
         os.chdir(prevdir)
 
 
+keyFileName = 'IPA_XSAMPA_key.txt'
 
 
 def translateFiles(permittedExts=['.txt', '.csv'], 
@@ -292,56 +378,230 @@ def translateFiles(permittedExts=['.txt', '.csv'],
     """
     From a directory containing text files, translate symbols in 
     each text file to/from IPA/X-SAMPA and save as new txt
-    file (filename appended with _REV).
+    file (filename appended with new symbol type). Interactive version of 
+    translateDirectory(), writing translations next to the originals.
     """
     
     dirPath = input("Enter directory of text files to translate: ")
+    translateDirectory(dirPath, dirPath, permittedExts, transTo)
+
+
+def writeKeyFile(outDir):
+    
+    """
+    Write the IPA/X-SAMPA key to outDir/IPA_XSAMPA_key.txt. The key is 
+    written to a temporary file first and then moved into place, so the key 
+    file is never left incomplete.
+    """
+    
+    keyPath = os.path.join(outDir, keyFileName)
+    fd, tmpPath = tempfile.mkstemp(dir=outDir, suffix='.tmp')
+    try:
+        with io.open(fd, 'w', encoding='utf-8') as outfile:
+            for transPair in _ipa2xsampa.items():
+                outfile.write(f"{transPair[0]},{transPair[1]}\n")
+        os.replace(tmpPath, keyPath)
+    except BaseException:
+        os.remove(tmpPath)
+        raise
+    return keyPath
+
+
+def translateDirectory(inDir, outDir, permittedExts=['.txt', '.csv'], 
+                       transTo='xsampa', processes=None, force=False):
+    
+    """
+    Translate symbols in every text file in inDir and its subdirectories 
+    to/from IPA/X-SAMPA, in a pool of processes. Translations are saved 
+    under outDir with the same relative path, filename appended with new 
+    symbol type. The IPA/X-SAMPA key is written once to outDir.
+    
+    inDir: str. Root directory of text files to translate
+    outDir: str. Root directory for translated files. May be inDir.
+    permittedExts: list of extensions to include. default ['.txt', '.csv']
+    transTo: 'xsampa' (default) or 'ipa'
+    processes: int. default None (number of CPUs). Number of processes.
+    force: bool. default False. If False, files whose translation is newer 
+        than the original are skipped.
+    
+    Returns list of translated file paths
+    """
     
     if transTo == 'xsampa':
         transType = '_ipa2xsampa'
+        outSuffix = '_XSAMPA'
     if transTo == 'ipa':
         transType = '_xsampa_and_diac2ipa'
+        outSuffix = '_IPA'
     
-    # Translate each file with permitted extension in directory
-    with change_dir(dirPath):
-        for fname in os.listdir(os.getcwd()):
-            if fname.endswith(tuple(permittedExts)):
-                translateFile(os.path.abspath(fname), transType)
-        
-        # generate IPA/XSAMPA key
-        with io.open(dirPath+'\\IPA_XSAMPA_key.txt', 'a', encoding='utf-8') as outfile:
-            for transPair in _ipa2xsampa.items():
-                outfile.write(f"{transPair[0]},{transPair[1]}\n")
+    inPaths = []
+    outPaths = []
+    skipped = 0
+    for root, dirs, files in os.walk(inDir):
+        for fname in sorted(files):
+            fnameNoExt, fext = os.path.splitext(fname)
+            if not fname.endswith(tuple(permittedExts)) \
+                    or fname == keyFileName \
+                    or fnameNoExt.endswith(('_XSAMPA', '_IPA')):
+                continue
+            inPath = os.path.join(root, fname)
+            outPath = os.path.normpath(os.path.join(
+                    outDir, os.path.relpath(root, inDir), 
+                    fnameNoExt + outSuffix + fext))
+            if not force and os.path.isfile(outPath) \
+                    and os.path.getmtime(outPath) >= os.path.getmtime(inPath):
+                skipped += 1
+                continue
+            os.makedirs(os.path.dirname(outPath), exist_ok=True)
+            inPaths.append(inPath)
+            outPaths.append(outPath)
+    
+    print(f"Translating {len(inPaths)} files ({skipped} up to date)...")
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        list(executor.map(translateFile, inPaths, 
+                          [transType]*len(inPaths), outPaths, chunksize=8))
+    
+    # generate IPA/XSAMPA key
+    os.makedirs(outDir, exist_ok=True)
+    writeKeyFile(outDir)
+    print("Translation complete")
+    return outPaths
                 
     
-def translateFile(fpath, transType):
+@lru_cache(maxsize=2**16)
+def translateToken(token, transType):
+    
+    """
+    Translate a single field or token to/from IPA/X-SAMPA. Results are kept 
+    in an LRU memo (see translateToken.cache_info()), since transcriptions 
+    repeat heavily.
+    """
+    
+    if transType == '_ipa2xsampa':
+        return ipa2xsampa(token, transType)
+    if transType == '_xsampa_and_diac2ipa':
+        return xsampa2ipa(token, transType)
+
+
+def translateLine(line, transType):
+    
+    """
+    Translate a line of text field by field. No translation symbol contains 
+    ',' or a line break, so this gives the same result as translating the 
+    whole text at once.
+    """
+    
+    body = line.rstrip('\r\n')
+    return ','.join(translateToken(field, transType) 
+                    for field in body.split(',')) + line[len(body):]
+
+    
+def translateFile(fpath, transType, outPath=None):
     
     """
     Translate symbols in a text file to/from IPA/X-SAMPA and save as new txt
-    file (filename appended with new symbol type).
+    file (filename appended with new symbol type). The file is read, 
+    translated and written line by line, so memory use does not grow with 
+    file size.
+    
+    outPath: str. default None. Output file path. Default is fpath with 
+        '_XSAMPA' or '_IPA' appended to the file name.
     """
     
-    with io.open(fpath, 'r', encoding = 'utf-8') as infile:
-        fstr = infile.read()
-        fext= fpath.split('.')[-1]
-        fname = fpath.split('.')[-2].split('\\')[-1]
-        fpathNoExt = '\\'.join(fpath.split('.')[-2].split('\\'))
-        
+    if outPath is None:
+        fpathNoExt, fext = os.path.splitext(fpath)
         if transType == '_ipa2xsampa':
-            fstr_REV = ipa2xsampa(fstr, transType)
+            outPath = fpathNoExt + '_XSAMPA' + fext
         if transType == '_xsampa_and_diac2ipa':
-            fstr_REV = xsampa2ipa(fstr, transType)
+            outPath = fpathNoExt + '_IPA' + fext
     
-    if transType == '_ipa2xsampa':    
-        with io.open(fpathNoExt + '_XSAMPA.' + fext, 'w', encoding = 'utf-8') as outfile:
-            outfile.write(fstr_REV)
-    if transType == '_xsampa_and_diac2ipa':
-        with io.open(fpathNoExt + '_IPA.' + fext, 'w', encoding = 'utf-8') as outfile:
-            outfile.write(fstr_REV)
+    with io.open(fpath, 'r', encoding = 'utf-8') as infile, \
+         io.open(outPath, 'w', encoding = 'utf-8') as outfile:
+        for line in infile:
+            outfile.write(translateLine(line, transType))
             
             
 def translateStr(string, transTo):
     if transTo == 'ipa':
-        return xsampa2ipa(string, '_xsampa_and_diac2ipa')
+        return translateToken(string, '_xsampa_and_diac2ipa')
     if transTo == 'xsampa':
-        return ipa2xsampa(string, '_ipa2xsampa')
+        return translateToken(string, '_ipa2xsampa')
+
+
+def translateSeries(series, transTo='xsampa'):
+    
+    """
+    Translate a pandas Series of strings to/from IPA/X-SAMPA. Only unique 
+    values are translated; the results are mapped back onto the Series.
+    Values that are not strings (e.g. NaN) are left unchanged.
+    
+    transTo: 'xsampa' or 'ipa'
+    
+    Returns translated Series
+    """
+    
+    translations = {v:translateStr(v, transTo) for v in series.unique() 
+                    if isinstance(v, str)}
+    return series.map(translations).where(series.isin(list(translations)), 
+                                          series)
+
+
+def translateDataFrame(df, columns=['IPA Target', 'IPA Actual'], 
+                       transTo='xsampa', suffix=None):
+    
+    """
+    Translate columns of a pandas DataFrame to/from IPA/X-SAMPA with 
+    translateSeries().
+    
+    columns: list of column names to translate. 
+        default ['IPA Target', 'IPA Actual']
+    transTo: 'xsampa' or 'ipa'
+    suffix: str. default None. If given (e.g. ' XSAMPA'), translations are 
+        added as new columns named column + suffix, placed next to the 
+        original column. Otherwise the original columns are replaced.
+    
+    Returns translated copy of df
+    """
+    
+    df = df.copy()
+    for col in columns:
+        translated = translateSeries(df[col], transTo)
+        if suffix is None:
+            df[col] = translated
+        elif col + suffix in df.columns:
+            df[col + suffix] = translated
+        else:
+            df.insert(df.columns.get_loc(col) + 1, col + suffix, translated)
+    return df
+
+
+def benchmarkTranslate(fpaths, transTo='xsampa', number=1):
+    
+    """
+    Time translate_string against translate_string_lattice on the full text
+    of each file (as translated by translateFile), and check that both give
+    the same translation.
+    
+    fpaths: list of paths to UTF-8 text files (e.g. large merged csv files)
+    transTo: 'xsampa' or 'ipa'
+    number: int. Number of timed runs per file
+    
+    Returns list of (fpath, characters, lattice seconds, trie seconds)
+    """
+    
+    d = _ipa2xsampa if transTo == 'xsampa' else _xsampa_and_diac2ipa
+    get_trie(d)
+    results = []
+    for fpath in fpaths:
+        with io.open(fpath, 'r', encoding = 'utf-8') as infile:
+            fstr = infile.read()
+        assert translate_string(fstr, d) == translate_string_lattice(fstr, d), \
+            f"Translations differ for {fpath}"
+        latticeTime = timeit.timeit(lambda: translate_string_lattice(fstr, d), 
+                                    number=number) / number
+        trieTime = timeit.timeit(lambda: translate_string(fstr, d), 
+                                 number=number) / number
+        print(f"{fpath}: {len(fstr)} characters, lattice {latticeTime:.3f} s, "
+              f"trie {trieTime:.3f} s ({latticeTime/trieTime:.1f}x)")
+        results.append((fpath, len(fstr), latticeTime, trieTime))
+    return results
@@ -18,7 +18,11 @@ from six.moves import input
 # import csv
 import unicodecsv as csv
 import io
+import xml.etree.ElementTree as etree
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from IPAtranslate import translateDataFrame
 
 # Establish origin directory and context navigation
 os.chdir(os.path.dirname(sys.argv[0])) 
@@ -56,7 +60,150 @@ excludeListSpaces = ['       (clock)', '      (eat it)', ' (pole)',
 removeList = excludeList + ["(incomplete transcription)", "ɴʀ", "NR", "\[\]", 
                             "", "ᵗ", "□", "tuntun", "goʊːt", "ʃiz"]
 
-def accessExcelDict(xlsDirName):
+def readExcelCached(fpath, cacheDir = None):
+    
+    """
+    Reads every sheet of an Excel file as a dictionary of pandas DataFrames. 
+    If cacheDir is given, the parsed workbook is pickled there and reused 
+    while the Excel file's modification time and size are unchanged.
+    
+    Parameters:
+        fpath : str path to xls file
+        cacheDir : str. default None. Directory of parsed-workbook cache
+    
+    Returns data_xls : a dict {sheet : DataFrame}
+    """
+    
+    if cacheDir is None:
+        return pd.read_excel(fpath, None)
+    st = os.stat(fpath)
+    cachePath = os.path.join(cacheDir, os.path.basename(fpath) + '.pkl')
+    if os.path.isfile(cachePath):
+        cached = pd.read_pickle(cachePath)
+        if (cached['mtime'], cached['size']) == (st.st_mtime, st.st_size):
+            return cached['sheets']
+    data_xls = pd.read_excel(fpath, None)
+    os.makedirs(cacheDir, exist_ok=True)
+    pd.to_pickle({'mtime': st.st_mtime, 'size': st.st_size, 
+                  'sheets': data_xls}, cachePath)
+    return data_xls
+
+
+# Sheets of a DPA xls file that are not probes, and probe sheet columns that
+# are not sessions
+nonProbeSheets = ['Copyright', 'Probe Schedule']
+nonSessionColumns = ['Word', 'Target']
+
+
+def participantID(fname):
+
+    """
+    Returns participant number of a '####_PHON.xls' or
+    '####_probe_session.csv' file name.
+    """
+
+    fname = os.path.basename(fname)
+    return fname[:fname.find('_')]
+
+
+def selectFiles(fnames, participants = None):
+
+    """
+    Returns fnames (in order) of the participants selected.
+
+    Parameters:
+        fnames : list of '####_PHON.xls' or '####_probe_session.csv' names
+        participants : list of participant numbers, or None for all
+    """
+
+    if participants is None:
+        return list(fnames)
+    participants = set(str(participant) for participant in participants)
+    return [fname for fname in fnames if participantID(fname) in participants]
+
+
+def selectSheet(sheet, probes = None):
+
+    """
+    Returns True if a probe sheet name is among probes (None for all).
+    """
+
+    return probes is None or sheet in probes
+
+
+def selectSession(col, sessions = None):
+
+    """
+    Returns True if a session column name (e.g. 'GFTA Pre') matches any of
+    the regex patterns in sessions (e.g. ['Pre', 'Post$']), or sessions is
+    None.
+    """
+
+    return sessions is None or any(re.search(pattern, str(col))
+                                   for pattern in sessions)
+
+
+def selectCSV(fname, participants = None, probes = None, sessions = None):
+
+    """
+    Returns True if a csv file named '####_probe_session.csv' by
+    dpa_script.py is of a selected participant, probe and session.
+    """
+
+    parts = os.path.splitext(os.path.basename(fname))[0].split('_', 2)
+    if len(parts) < 3:
+        return participants is None and probes is None and sessions is None
+    participant, probe, session = parts
+    return (participants is None or
+            participant in set(str(p) for p in participants)) and \
+        selectSheet(probe, probes) and selectSession(session, sessions)
+
+
+def readExcelSelection(fpath, probes = None, sessions = None,
+                       cacheDir = None):
+
+    """
+    Reads the sheets of a DPA xls file as a dictionary of pandas DataFrames,
+    parsing only the probe sheets in probes and, in them, the 'Word' and
+    'Target' columns and the session columns matching sessions (see
+    selectSession()). The 'Copyright' and 'Probe Schedule' sheets are always
+    read. Without a selection, reads every sheet as readExcelCached().
+
+    Parameters:
+        fpath : str path to xls file
+        probes : list of probe sheet names, e.g. ['GFTA', 'PKP'], or None
+        sessions : list of session column patterns, e.g. ['Pre'], or None
+        cacheDir : str. default None. Parsed-workbook cache, see
+            readExcelCached(). A fresh cached workbook is filtered instead
+            of parsing the selection
+
+    Returns data_xls : a dict {sheet : DataFrame}
+    """
+
+    if probes is None and sessions is None:
+        return readExcelCached(fpath, cacheDir)
+
+    def usecols(col):
+        return col in nonSessionColumns or selectSession(col, sessions)
+
+    if cacheDir is not None:
+        data_xls = readExcelCached(fpath, cacheDir)
+        return {sheet: dfSheet if sheet in nonProbeSheets else
+                dfSheet[[col for col in dfSheet.columns if usecols(col)]]
+                for sheet, dfSheet in data_xls.items()
+                if sheet in nonProbeSheets or selectSheet(sheet, probes)}
+    data_xls = {}
+    with pd.ExcelFile(fpath) as xls:
+        for sheet in xls.sheet_names:
+            if sheet in nonProbeSheets:
+                data_xls[sheet] = xls.parse(sheet)
+            elif selectSheet(sheet, probes):
+                data_xls[sheet] = xls.parse(sheet, usecols = usecols)
+    return data_xls
+
+
+def accessExcelDict(xlsDirName, participants = None, probes = None, 
+                    sessions = None):
     
     """
     From a directory of xls files in the current working directory, returns 
@@ -65,6 +212,9 @@ def accessExcelDict(xlsDirName):
     
     Parameters:
         xlsDirName : a directory name of xls files named '####_PHON.xls'
+        participants, probes, sessions : default None (all). Selection read, 
+            see selectFiles() and readExcelSelection(). Files of other 
+            participants are not opened
     
     Returns:
         data_xls : a dict {#### : dict{sheet : DataFrame}}
@@ -74,10 +224,10 @@ def accessExcelDict(xlsDirName):
     with enter_dir(xlsDirName):
         print('Reading xls files to pandas DataFrames...')
         # for each file in list of files in directory xls_dir...
-        for file in os.listdir():
+        for file in selectFiles(os.listdir(), participants):
             # Read Excel file as dictionary of Pandas DataFrames (data_xls) Key = sheet name
             try:
-                data_xls = pd.read_excel(file, None)
+                data_xls = readExcelSelection(file, probes, sessions)
             except:
                 print(sys.exc_info()[1])
                 print('Unable to read {}'.format(file))
@@ -241,6 +391,93 @@ def participantTranscriptConv():
     return dfNotes
 
 
+def loadPhonLegalChars(ipaPath = os.path.join('files', 'ipa.xml')):
+    
+    """
+    Extracts the characters legal in Phon from ipa.xml in the Phon source 
+    code.
+    
+    Parameters:
+        ipaPath : str path to ipa.xml. Default 'files/ipa.xml'
+    
+    Returns frozenset of legal characters
+    """
+    
+    tree = etree.parse(ipaPath)
+    # For each element in ipa.xml, extract the unicode value
+    return frozenset(list(char.attrib.values())[0] 
+                     for char in tree.getroot())
+
+
+def findIllegalChars(text, legalChars):
+    
+    """
+    Finds characters in a transcription that are not legal in Phon. 
+    Whitespace separating words and multiple productions is ignored.
+    
+    Parameters:
+        text : str
+        legalChars : frozenset of legal characters from loadPhonLegalChars()
+    
+    Returns str of illegal characters in order of first occurrence
+    """
+    
+    illegal = []
+    for char in text:
+        if char not in legalChars and not char.isspace() \
+                and char not in illegal:
+            illegal.append(char)
+    return ''.join(illegal)
+
+
+def guardedReplace(series, key, value, timeout, quarantine, context = ()):
+
+    """
+    Counts and replaces a dictionary key in a Series of transcriptions, as
+    Series.str.count(key).sum() and Series.str.replace(key, value,
+    re.UNICODE) do in dpa_script.py, but with a time limit per cell. A cell
+    that cannot be searched within the time limit is left unchanged and
+    quarantined, so one pathological cell cannot stall the whole run.
+    
+    Patterns are run with the regex module (imported as re here), which 
+    supports a timeout, rather than the re module used by pandas. Its syntax 
+    is a superset of re's (e.g. POSIX classes, nested sets) and its 
+    backtracking differs, so results match pandas only for patterns both 
+    engines read alike, as those of 'dicts' are. See dpa_script.regex_timeout.
+
+    Parameters:
+        series : Series of str, indexed by Word
+        key : str regex (single characters are matched literally, as pandas)
+        value : str replacement
+        timeout : float. Seconds allowed per cell
+        quarantine : list. Gets [*context, Word, key, cell] per quarantined
+            cell
+        context : list of values identifying the series, e.g.
+            [Speaker, Probe, Session]
+
+    Returns tuple(int number of matches, Series of replaced transcriptions)
+    """
+
+    pattern = re.compile(re.escape(key) if len(key) == 1 else key)
+    count = 0
+    replaced = []
+    for word, cell in series.items():
+        if not isinstance(cell, str):
+            replaced.append(float('nan'))
+            continue
+        try:
+            count += len(pattern.findall(cell, timeout = timeout))
+            # re.UNICODE (32) is the maximum number of replacements per cell
+            # in dpa_script.py
+            replaced.append(pattern.sub(value, cell, count = re.UNICODE,
+                                        timeout = timeout))
+        except TimeoutError:
+            quarantine.append(list(context) + [word, key, cell])
+            replaced.append(cell)
+    return count, pd.Series(replaced, index = series.index, name = series.name,
+                            dtype = object)
+
+
 def combiningStrip(text):
     
     """
@@ -297,7 +534,8 @@ def reDiac():
     return pattern
 
 
-def extractSegments(segmentType):
+def extractSegments(segmentType, participants = None, probes = None, 
+                    sessions = None):
     
     """
     Given user-specified segmentType, searches all transcriptions  separated 
@@ -309,6 +547,8 @@ def extractSegments(segmentType):
             'phones' for all unitary and multi-component phones with diacritics
             'compounds' for compound phones only
             'characters' for all characters
+        participants, probes, sessions : default None (all). Only these are 
+            read and searched, see accessExcelDict()
     
     Requires accessExcelDict(), combiningStrip()
     
@@ -322,7 +562,7 @@ def extractSegments(segmentType):
         'full_compounds' for compound phones with diacritics
         'characters' for all characters"""
         
-    xlsDict = accessExcelDict('excel')
+    xlsDict = accessExcelDict('excel', participants, probes, sessions)
     result = set() 
     for xls in xlsDict:
         for sheet in xlsDict[xls]:
@@ -381,39 +621,101 @@ def extractSegments(segmentType):
     print(f"'{segmentType}.csv' created in 'info' directory.")
     return result
 
-def multProdsCount(csvDir = 'csv'):
+def _multProdsFile(fpath, keepRows=True):
     
     """
-    Searches a directory of csv files and adds the number of "multiple
-    productions"
+    Helper for multProdsCount() and extractMultProds(). Streams a csv file 
+    row by row, parsing the NumProductions column by name.
     
     Parameters:
-        csvDir : str indicating csv directory to search. Default 'csv'
+        fpath : str path to csv file
+        keepRows : bool. default True. If False, only counts, and the list 
+            of rows is returned empty
     
-    Returns multiple productions count as float and prints to console.
+    Returns tuple(header, total NumProductions as float, list of rows with 
+    NumProductions)
     """
-   #Check that edit worked
-    pattern = re.compile =r',.*,.*,.*,.*,.*,(\d.\d),'
+    
     mpCount = 0
-        
-    with enter_dir(csvDir):   
-        # Create list of csv files in subdirectories
-        csv_files = os.listdir(os.getcwd())
-        # Loop through files in directory
-        print('Searching all csv files in directory...')
-        for cur_csv in csv_files:
-            # open CSV file in read mode with UTF-8 encoding
-            with io.open(cur_csv, mode='r', encoding='utf-8') as current_csv:
-                # Create string variable from CSV
-                csv_str = current_csv.read()
-                result = re.findall(pattern, csv_str)
-                for numStr in result:
-                    mpCount += float(numStr)
-        print(mpCount)
-        return mpCount
-    
-
-def extractMultProds(csvDir = 'csv'):
+    matchRows = []
+    with io.open(fpath, mode='rb') as current_csv:
+        reader = csv.reader(current_csv, encoding='utf-8')
+        header = next(reader, [])
+        if 'NumProductions' not in header:
+            return header, mpCount, matchRows
+        mpIndex = header.index('NumProductions')
+        for row in reader:
+            try:
+                numProds = float(row[mpIndex])
+            except (IndexError, ValueError):
+                continue
+            mpCount += numProds
+            if keepRows:
+                matchRows.append(row)
+    return header, mpCount, matchRows
+
+
+def _multProdsResults(csvDir, processes=None, keepRows=True):
+    
+    """
+    Generator. Applies _multProdsFile() to every csv file in csvDir in a 
+    pool of processes, yielding results in file order.
+    
+    Parameters:
+        csvDir : str indicating csv directory to search
+        processes : int. default None. Number of worker processes. 
+            None uses the number of CPUs; 1 searches in this process only.
+        keepRows : bool. default True. Passed to _multProdsFile()
+    """
+    
+    csv_files = _multProdsFiles(csvDir)
+    print('Searching all csv files in directory...')
+    searchFile = partial(_multProdsFile, keepRows=keepRows)
+    if processes == 1:
+        for result in map(searchFile, csv_files):
+            yield result
+        return
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for result in executor.map(searchFile, csv_files, chunksize=64):
+            yield result
+
+
+def _multProdsFiles(csvDir):
+    
+    """
+    Returns sorted list of absolute paths of csv files in csvDir.
+    """
+    
+    return sorted(os.path.join(os.path.abspath(csvDir), fName) 
+                  for fName in os.listdir(csvDir) 
+                  if fName.endswith('.csv'))
+
+
+def _multProdsColumns(csvDir):
+    
+    """
+    Reads only the header of every csv file in csvDir and builds the union 
+    of the columns of files with a NumProductions column, in order of first 
+    appearance (as mergeCSV(..., schema='union')).
+    
+    Returns list of column names
+    """
+    
+    columns = []
+    seen = set()
+    for fpath in _multProdsFiles(csvDir):
+        with io.open(fpath, mode='rb') as current_csv:
+            header = next(csv.reader(current_csv, encoding='utf-8'), [])
+        if 'NumProductions' not in header:
+            continue
+        for col in header:
+            if col not in seen:
+                seen.add(col)
+                columns.append(col)
+    return columns
+
+
+def multProdsCount(csvDir = 'csv', processes = None):
     
     """
     Searches a directory of csv files and adds the number of "multiple
@@ -421,42 +723,82 @@ def extractMultProds(csvDir = 'csv'):
     
     Parameters:
         csvDir : str indicating csv directory to search. Default 'csv'
+        processes : int. default None. Number of worker processes.
     
     Returns multiple productions count as float and prints to console.
     """
-    # Check that edit worked
-    pattern = re.compile =r'(.*,.*,.*,.*,.*,.*,)(\d.\d)(,.*)'
+    
     mpCount = 0
-        
-    with enter_dir(csvDir):   
-        # Create list of csv files in subdirectories
-        csv_files = os.listdir(os.getcwd())
-        # Loop through files in directory
-        print('Searching all csv files in directory...')
-        matchRows = []
-        for cur_csv in csv_files:
-            # open CSV file in read mode with UTF-8 encoding
-            with io.open(cur_csv, mode='r', encoding='utf-8') as current_csv:
-                # Create string variable from CSV
-                csv_str = current_csv.read()
-                result = re.findall(pattern, csv_str)
-                for match in result:
-                    #for match[1] in result:
-                    #    mpCount += float(numStr)
-                    matchRow = ''.join(match)
-                    matchRows.append(matchRow)
-        
-        
-    with enter_dir('info'):
-        with io.open(f'{csvDir}_mult_prod_matches.csv', 'wb') as f:
-            writer = csv.writer(f)
-            for row in matchRows:
-                writer.writerow([row])
+    for header, fileCount, matchRows in _multProdsResults(csvDir, processes, 
+                                                          keepRows=False):
+        mpCount += fileCount
+    print(mpCount)
+    return mpCount
+    
+
+def extractMultProds(csvDir = 'csv', processes = None, returnRows = False):
+    
+    """
+    Searches a directory of csv files for rows with "multiple productions" 
+    and saves them to '{csvDir}_mult_prod_matches.csv' in 'info' directory.
+    Rows are written as each file is searched. Files with different columns 
+    are written under the union of their headers, with missing columns left 
+    empty.
+    
+    Parameters:
+        csvDir : str indicating csv directory to search. Default 'csv'
+        processes : int. default None. Number of worker processes.
+        returnRows : bool. default False. If True, also keeps the matching 
+            rows in memory and returns them
+    
+    Returns list of matching rows (each a list of fields, in the order of 
+    the saved header) if returnRows, else number of matching rows.
+    """
+    
+    matchRows = []
+    numRows = 0
+    columns = _multProdsColumns(csvDir)
+    os.makedirs('info', exist_ok=True)
+    outName = f'{os.path.basename(os.path.normpath(csvDir))}_mult_prod_matches.csv'
+    with io.open(os.path.join('info', outName), 'wb') as f:
+        writer = csv.writer(f, encoding='utf-8')
+        headerWritten = False
+        for header, fileCount, fileRows in _multProdsResults(csvDir, 
+                                                             processes):
+            if not fileRows:
+                continue
+            if not headerWritten:
+                writer.writerow(columns)
+                headerWritten = True
+            if header != columns:
+                # Column-reorder map: index in file row for each union column
+                position = {col: i for i, col in enumerate(header)}
+                reorder = [position.get(col) for col in columns]
+                fileRows = [[row[i] if i is not None and i < len(row) 
+                             else '' for i in reorder] for row in fileRows]
+            writer.writerows(fileRows)
+            numRows += len(fileRows)
+            if returnRows:
+                matchRows.extend(fileRows)
                     
-    return matchRows
+    return matchRows if returnRows else numRows
 
     
-def postProcessingReplacements(csvDir = 'csv'):
+def postProcessingReplacements(csvDir = 'csv', replacedRows = None):
+    
+    """
+    Replaces the csv rows itemized in dicts/replacements_table.csv.
+    
+    Parameters:
+        csvDir : str. Directory of csv files
+        replacedRows : list, or None. If given, [csv file name, header, 
+            original row, replacement row, number of rows] is appended for 
+            each replacement made, e.g. to check the new rows for illegal 
+            characters
+    
+    Returns Counter of original rows replaced (once per file)
+    """
+    
     # Read replacements table
     with open('dicts/replacements_table.csv', mode='r', encoding='utf-8') as f:
         lines = f.readlines()
@@ -489,6 +831,9 @@ def postProcessingReplacements(csvDir = 'csv'):
                     for repl in replList:
                         if repl[0] in csvStr:
                             counter.update([repl[0]])
+                            if replacedRows is not None:
+                                replacedRows.append([fName, csvStr.split('\n', 1)[0].rstrip('\r'), 
+                                                     repl[0], repl[1], csvStr.count(repl[0])])
                             revCSVStr = revCSVStr.replace(repl[0], repl[1])
             else:
                 continue
@@ -497,6 +842,15 @@ def postProcessingReplacements(csvDir = 'csv'):
             else:
                 with open(fName, mode = 'w', encoding='utf-8') as curCSV:                            
                     curCSV.write(revCSVStr)
+                # Replaced rows need new X-SAMPA columns, if present
+                xsampaCols = ['IPA Target XSAMPA', 'IPA Actual XSAMPA']
+                if revCSVStr.split('\n', 1)[0].endswith(','.join(xsampaCols)):
+                    dfCSV = pd.read_csv(fName, encoding = 'utf-8', dtype = str, 
+                                        keep_default_na = False)
+                    dfCSV[xsampaCols] = translateDataFrame(
+                            dfCSV, ['IPA Target', 'IPA Actual'], 'xsampa')[
+                            ['IPA Target', 'IPA Actual']].values
+                    dfCSV.to_csv(fName, encoding = 'utf-8', index = False)
     
     # Check that all replacements were made. Print warning to console.
     for line in originals:
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of the DPA conversion on synthetic workbooks.
+
+Generates a synthetic corpus with syntheticDPA.py, runs
+dpa_script.runConversion() on it in a temporary directory, and appends the
+time of each stage (dictionaries, read, rule application, write, info files
+and post-processing) to info/benchmark_results.csv, so runs can be compared
+over time and across revisions.
+
+Usage:
+    runBenchmark(participants = 20, rows = 100, label = 'baseline')
+    compareBenchmarks()
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import platform
+import subprocess
+import pandas as pd
+import dpa_script
+from syntheticDPA import generateCorpus
+
+resultsPath = os.path.join('info', 'benchmark_results.csv')
+stages = ['dicts', 'read', 'rules', 'write', 'info', 'post']
+# Parameters identifying comparable runs
+paramColumns = ['participants', 'probes', 'sessions', 'rows', 'seed', 'ext']
+
+
+def gitRevision():
+
+    """
+    Returns short git revision of the working tree, with '+' if it has
+    uncommitted changes, or '' if git is not available.
+    """
+
+    try:
+        revision = subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(
+                ['git', 'status', '--porcelain', '--untracked-files=no'],
+                stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return revision + ('+' if dirty else '')
+
+
+def runBenchmark(participants=10, probes=4, sessions=3, rows=60, seed=0,
+                 ext='.xlsx', label='', resultsPath=resultsPath, keep=False):
+
+    """
+    Times one conversion of a synthetic corpus and appends the result to
+    resultsPath.
+
+    Parameters:
+        participants, probes, sessions, rows, seed, ext : corpus size and
+            content, see syntheticDPA.generateCorpus()
+        label : str. Free text stored with the result, e.g. 'add_xsampa'
+        resultsPath : str. csv file of results
+        keep : bool. default False. Keep the temporary directory with the
+            synthetic workbooks and output
+
+    Returns dict of the recorded result
+    """
+
+    workDir = tempfile.mkdtemp(prefix='dpa_benchmark_')
+    try:
+        xlsDir = os.path.join(workDir, 'excel')
+        fpaths, cells = generateCorpus(xlsDir, participants, probes,
+                                       sessions, rows, seed, ext)
+        start = time.perf_counter()
+        stage_times = dpa_script.runConversion(xlsDir, outDir=workDir)
+        total = time.perf_counter() - start
+        csvDir = os.path.join(workDir, 'csv')
+        csvFiles = [fname for fname in os.listdir(csvDir)
+                    if fname.endswith('.csv')]
+        outBytes = sum(os.path.getsize(os.path.join(csvDir, fname))
+                       for fname in csvFiles)
+    finally:
+        if keep:
+            print('Benchmark files kept in', workDir)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    result = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'label': label,
+              'revision': gitRevision(),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'participants': participants, 'probes': probes,
+              'sessions': sessions, 'rows': rows, 'seed': seed, 'ext': ext,
+              'workbooks': len(fpaths), 'cells': cells,
+              'csv_files': len(csvFiles), 'csv_bytes': outBytes}
+    for stage in stages:
+        result[stage] = round(stage_times[stage], 4)
+    result['total'] = round(total, 4)
+    result['cells_per_s'] = round(cells / total, 1)
+
+    resultsDir = os.path.dirname(resultsPath)
+    if resultsDir:
+        os.makedirs(resultsDir, exist_ok=True)
+    pd.DataFrame([result]).to_csv(resultsPath, mode='a', index=False,
+                                  header=not os.path.isfile(resultsPath),
+                                  encoding='utf-8')
+    print('{} cells in {:.2f} s ({} cells/s): '.format(
+            cells, total, result['cells_per_s']) +
+          ', '.join('{} {:.2f} s'.format(stage, result[stage])
+                    for stage in stages))
+    return result
+
+
+def compareBenchmarks(resultsPath=resultsPath, last=10):
+
+    """
+    Prints and returns the last results for each corpus size, so that runs
+    on the same synthetic corpus can be compared.
+
+    Returns DataFrame
+    """
+
+    df = pd.read_csv(resultsPath, encoding='utf-8', keep_default_na=False)
+    df = df.groupby(paramColumns, sort=False).tail(last)
+    columns = ['timestamp', 'label', 'revision'] + paramColumns + \
+        stages + ['total', 'cells_per_s']
+    df = df.sort_values(paramColumns + ['timestamp'], kind='mergesort')
+    print(df[columns].to_string(index=False))
+    return df
+
+
+if __name__ == '__main__':
+    runBenchmark(label=' '.join(sys.argv[1:]))
+    compareBenchmarks()
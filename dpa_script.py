@@ -40,13 +40,26 @@ import os
 import csv
 import sys
 import re
+import time
+import json
+import shutil
+import hashlib
 from collections import Counter
 from collections import OrderedDict
 from contextlib import contextmanager
 import six
 from six.moves import zip
 from six.moves import input
-from auxiliar import excludeListSpaces, postProcessingReplacements
+from auxiliar import excludeListSpaces, postProcessingReplacements, enter_dir
+from auxiliar import loadPhonLegalChars, findIllegalChars, guardedReplace
+from auxiliar import selectFiles, readExcelSelection
+from regressionCheck import compareOutputs
+from IPAtranslate import translateSeries
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: peak memory is not recorded
+    resource = None
 
 
 # Set default directory to location of script
@@ -56,6 +69,49 @@ cwd = os.getcwd()
 # Set xls directory
 xls_dir = os.path.join(cwd,r'excel')    
 
+# Check IPA Target and IPA Actual for characters illegal in Phon as each 
+# session is produced. Requires ipa.xml from Phon source code.
+validate_ipa = True
+# Stop at the first illegal character instead of logging all of them
+validate_fail_fast = False
+ipa_xml_path = os.path.join(cwd, 'files', 'ipa.xml')
+
+# Add X-SAMPA versions of IPA Target and IPA Actual as the last two columns 
+# of each csv (for R), instead of a second pass with IPAtranslate.py
+add_xsampa = False
+
+# Time limit in seconds for each dictionary regex on each cell, or None for 
+# no limit. Cells that exceed it are left unchanged and logged in 
+# info/quarantined_cells.csv (see regexCheck.py for patterns at risk). 
+# re cannot be interrupted, so with a time limit dictionary regexes are run 
+# with the regex module (auxiliar.guardedReplace()) instead of pandas and re. 
+# The two engines give the same replacements for the dictionaries in 'dicts', 
+# but not for every pattern (e.g. POSIX classes and nested sets are regex 
+# only): compare the output with and without regex_timeout after editing 
+# the dictionaries, e.g. with regressionCheck.compareOutputs()
+regex_timeout = None
+
+# Write per-workbook and per-stage timings, rows, cells, bytes written and 
+# peak memory to info/telemetry.jsonl, and print a summary at the end
+telemetry = True
+
+# Record each completed workbook in info/run_journal.jsonl. A run that stopped 
+# partway resumes from the journal: completed workbooks are skipped and their 
+# saved counts merged. Unreadable or failing workbooks are reported in 
+# info/workbook_errors.csv and the run carries on with the rest
+resume_run = True
+
+
+
+class IllegalCharsError(ValueError):
+
+    """
+    Raised at the first transcription with characters illegal in Phon when 
+    validate_fail_fast is set. Stops the whole run, unlike other errors in a 
+    workbook, which are reported in info/workbook_errors.csv.
+    """
+
+
 # Create contextmanager function that changes directory then returns to 
 # original directory upon completion
 
@@ -67,106 +123,1045 @@ def change_dir(newdir):
     finally:
         os.chdir(prevdir)
 
-#### Step 1: Get list of illegal characters. This step is optional 
-#### if "other_chars_translate_dict.csv", "superscript_dict_initial.csv", 
-#### and "superscript_dict_noninitial.csv" already exist in "dicts" directory.
-
-print('**********Step 1: Check for translation dictionaries**********')
-assert os.path.isfile(os.path.join(cwd,r'dicts\other_chars_translate_dict.csv')), 'superscript_dict_noninitial.csv not found. Exiting script.'
-assert os.path.isfile(os.path.join(cwd,r'dicts\superscript_dict_initial.csv')), 'superscript_dict_initial.csv.csv not found. Exiting script.'
-assert os.path.isfile(os.path.join(cwd,r'dicts\superscript_dict_noninitial.csv')), 'other_chars_translate_dict.csv not found. Exiting script.'
-print(r'other_chars_translate_dict.csv, superscript_dict_initial.csv, and superscript_dict_noninitial.csv found in directory dicts')
-print(r'Proceeding to Excel edits using these dictionaries')
-   
-#### Step 2: Work with Excel files as DataFrames
-print('**********Step 2: Work with Excel files as DataFrames**********')
-
-## Defined variables
-word_list = []
-
-# Create dictionary other_chars_dict from csv
-other_chars_path = os.path.join(cwd,r"dicts\other_chars_translate_dict.csv")
-reader1 = csv.DictReader(open(other_chars_path, encoding = 'utf-8')) 
-for row in reader1:
-    other_chars_dict = OrderedDict(row)
-
-# Create dictionary compounds_dict from csv   
-compounds_dict_path = os.path.join(cwd,r"dicts\compounds_dict.csv")
-dummylist = []
-with open(compounds_dict_path, 'r', encoding = 'utf-8') as f:
-    reader = csv.reader(f)
-    headers = next(reader)
-    for row in reader:
-        dummylist.append(OrderedDict(list(zip(headers, row))))
-compounds_dict = dummylist[0]
-
-# Create ordered dictionary superscript_dict_initial from csv
-superscript_dict_initial_path = os.path.join(cwd,r"dicts\superscript_dict_initial.csv")
-dummylist = []
-with open(superscript_dict_initial_path, 'r', encoding = 'utf-8') as f:
-    reader = csv.reader(f)
-    headers = next(reader)
-    for row in reader:
-        dummylist.append(OrderedDict(list(zip(headers, row))))
-superscript_dict_initial = dummylist[0]
-
-# Create ordered dictionary superscript_dict_initial2 from csv
-superscript_dict_initial_path2 = os.path.join(cwd,r"dicts\superscript_dict_initial_2.csv")
-dummylist = []
-with open(superscript_dict_initial_path2, 'r', encoding = 'utf-8') as f:
-    reader = csv.reader(f)
-    headers = next(reader)
-    for row in reader:
-        dummylist.append(OrderedDict(list(zip(headers, row))))
-superscript_dict_initial2 = dummylist[0]
-
-# Create ordered dictionary superscript_dict_initial3 from csv
-superscript_dict_initial_path3 = os.path.join(cwd,r"dicts\superscript_dict_initial_3.csv")
-dummylist = []
-with open(superscript_dict_initial_path3, 'r', encoding = 'utf-8') as f:
-    reader = csv.reader(f)
-    headers = next(reader)
-    for row in reader:
-        dummylist.append(OrderedDict(list(zip(headers, row))))
-superscript_dict_initial3 = dummylist[0]
-
-# Create dictionary superscript_dict_noninitial from csv
-superscript_dict_noninitial_path = os.path.join(cwd,r"dicts\superscript_dict_noninitial.csv")  
-dummylist = []
-with open(superscript_dict_noninitial_path, 'r', encoding = 'utf-8') as f:
-    reader = csv.reader(f)
-    headers = next(reader)
-    for row in reader:
-        dummylist.append(OrderedDict(list(zip(headers, row))))
-superscript_dict_noninitial = dummylist[0]
-
-# Create dictionary notes_dict from csv
-notes_dict_path = os.path.join(cwd,r"dicts\notes_dict.csv")
-reader3 = csv.DictReader(open(notes_dict_path, encoding = 'utf-8')) 
-for row in reader3:
-    notes_dict = dict(row)
-    
-# Create word index for df
-word_dict_path = os.path.join(cwd,r"dicts\word_dict.csv")
-reader4 = csv.reader(open(word_dict_path, encoding = 'utf-8')) 
-for row in reader4:
-    word_dict = list(row)
-    
-# Create dictionary target_dict from csv
-target_dict_path = os.path.join(cwd,r"dicts\target_dict.csv")
-reader5 = csv.DictReader(open(target_dict_path, encoding = 'utf-8')) 
-for row in reader5:
-    target_dict = dict(row)
-    
-
-# If preset directory is not present, get user input
-try:
-    xls_dir
-except NameError:
-    xls_dir = os.path.normpath(input('xls directory not specified. Enter xls directory path: '))
-with change_dir(os.path.normpath(xls_dir)):
-    print("XLS Directory set to: ", os.getcwd())
-    
+
+def loadDictionaries(dictsDir = os.path.join(cwd, 'dicts'), baseDir = None):
+
+    """
+    Reads the translation dictionaries used by convertSession().
+
+    Parameters:
+        dictsDir : str. Directory of dictionary csv files. Default 'dicts'
+        baseDir : str. default None. Directory of the files missing from 
+            dictsDir, so that a dictionary variant only holds the files it 
+            changes (e.g. target_dict.csv)
+
+    Returns dict of dictionaries keyed by their variable names in this script,
+    e.g. dicts['other_chars_dict']
+    """
+
+    #### Step 1: Get list of illegal characters. This step is optional 
+    #### if "other_chars_translate_dict.csv", "superscript_dict_initial.csv", 
+    #### and "superscript_dict_noninitial.csv" already exist in "dicts" directory.
+
+    def dictPath(fname):
+        fpath = os.path.join(dictsDir, fname)
+        if baseDir is not None and not os.path.isfile(fpath):
+            return os.path.join(baseDir, fname)
+        return fpath
+
+    print('**********Step 1: Check for translation dictionaries**********')
+    assert os.path.isfile(dictPath('other_chars_translate_dict.csv')), 'other_chars_translate_dict.csv not found. Exiting script.'
+    assert os.path.isfile(dictPath('superscript_dict_initial.csv')), 'superscript_dict_initial.csv not found. Exiting script.'
+    assert os.path.isfile(dictPath('superscript_dict_noninitial.csv')), 'superscript_dict_noninitial.csv not found. Exiting script.'
+    print(r'other_chars_translate_dict.csv, superscript_dict_initial.csv, and superscript_dict_noninitial.csv found in directory dicts')
+    print(r'Proceeding to Excel edits using these dictionaries')
+
+    dicts = {}
+
+    # Create dictionary other_chars_dict from csv
+    with open(dictPath('other_chars_translate_dict.csv'), encoding = 'utf-8') as f:
+        for row in csv.DictReader(f):
+            dicts['other_chars_dict'] = OrderedDict(row)
+
+    # Create ordered dictionaries compounds_dict and superscript_dict_* from csv
+    for key, fname in [('compounds_dict', 'compounds_dict.csv'),
+                       ('superscript_dict_initial', 'superscript_dict_initial.csv'),
+                       ('superscript_dict_initial2', 'superscript_dict_initial_2.csv'),
+                       ('superscript_dict_initial3', 'superscript_dict_initial_3.csv'),
+                       ('superscript_dict_noninitial', 'superscript_dict_noninitial.csv')]:
+        dummylist = []
+        with open(dictPath(fname), 'r', encoding = 'utf-8') as f:
+            reader = csv.reader(f)
+            headers = next(reader)
+            for row in reader:
+                dummylist.append(OrderedDict(list(zip(headers, row))))
+        dicts[key] = dummylist[0]
+
+    # Create dictionary notes_dict from csv
+    with open(dictPath('notes_dict.csv'), encoding = 'utf-8') as f:
+        for row in csv.DictReader(f):
+            dicts['notes_dict'] = dict(row)
+
+    # Create word index for df
+    with open(dictPath('word_dict.csv'), encoding = 'utf-8') as f:
+        for row in csv.reader(f):
+            dicts['word_dict'] = list(row)
+
+    # Create dictionary target_dict from csv
+    with open(dictPath('target_dict.csv'), encoding = 'utf-8') as f:
+        for row in csv.DictReader(f):
+            dicts['target_dict'] = dict(row)
+    return dicts
+
+
+def phonLegalChars():
+
+    """
+    Returns frozenset of characters legal in Phon from ipa.xml, or None if 
+    validate_ipa is not set or ipa.xml is not found.
+    """
+
+    # Create set of characters legal in Phon from ipa.xml
+    phon_legal_chars = None
+    if validate_ipa:
+        try:
+            phon_legal_chars = loadPhonLegalChars(ipa_xml_path)
+            print(r'ipa.xml found. IPA Target and IPA Actual will be checked for illegal characters')
+        except (IOError, OSError):
+            print(r'ipa.xml not found in directory files. Skipping illegal character check')
+    return phon_legal_chars
+
+
+def newRunLog(legalChars = None):
+
+    """
+    Returns dict of results collected over a conversion run: replacement
+    counts, unique words, illegal characters and quarantined cells.
+
+    Parameters:
+        legalChars : frozenset of characters legal in Phon, or None to skip
+            the illegal character check
+    """
+
+    return {'replace_counts': pd.DataFrame(),
+            'word_list': [],
+            'legal_chars': legalChars,
+            # Illegal characters found, and cache of checked transcriptions
+            'illegal_chars_log': [],
+            'illegal_chars_cache': {},
+            # Cells skipped by a dictionary regex after exceeding regex_timeout
+            'quarantined_cells': [],
+            # Per-workbook telemetry records, see convertWorkbook()
+            'telemetry': [],
+            # [column, replacement counts] of each session, in order
+            'session_counts': [],
+            # Paths of the csv files written, in order, see rollbackWorkbook()
+            'csv_files': []}
+
+
+def peakRSS():
+
+    """
+    Returns peak resident memory of this process in MB, or None if it 
+    cannot be measured.
+    """
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    return round(peak / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0), 1)
+
+
+def cleanOrthography(df_sheet, col, sheet_rep_dict):
+
+    """
+    Edits the Word column of a probe sheet in place (steps 5.11 and 5.12),
+    counting replacements in sheet_rep_dict.
+    """
+
+
+    # Replace ' i' with "-i"
+    cur_rep_count = df_sheet[col].str.count(u' i', re.UNICODE).sum()
+    sheet_rep_dict[u' i Ortho'+u'_to_-i'] += cur_rep_count                            
+    # replace all instances
+    df_sheet[col] = df_sheet[col].str.replace(u' i', u'-i', re.UNICODE)
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} removed'.format(cur_rep_count, u'̹'))
+
+    # Remove instances '\u0339' 
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = df_sheet[col].str.count(u'̹', re.UNICODE).sum()
+    sheet_rep_dict[u'̹ Ortho'+u'_removed'] += cur_rep_count                            
+    # replace all instances
+    df_sheet[col] = df_sheet[col].str.replace(u'̹', u'', re.UNICODE)
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} removed'.format(cur_rep_count, u'̹'))
+
+    # Replace 'ɑ' with 'a'
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = df_sheet[col].str.count(u'ɑ', re.UNICODE).sum()
+    sheet_rep_dict[u'ɑ Ortho'+u'_to_'+u'a'] += cur_rep_count                            
+    # replace all instances
+    df_sheet[col] = df_sheet[col].str.replace(u'ɑ', u'a', re.UNICODE)
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} removed'.format(cur_rep_count, u'ɑ'))  
+
+    # Replace ɢ in orthography with 'G'
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = df_sheet[col].str.count(u'ɢ', re.UNICODE).sum()
+    sheet_rep_dict[u'ɢ Ortho'+u'_to_'+u'G'] += cur_rep_count                            
+    # replace all instances
+    df_sheet[col] = df_sheet[col].str.replace(u'ɢ', u'G', re.UNICODE)
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} replaced with {}'.format(cur_rep_count, u'ɢ', u'G'))                                                      
+
+    # Replace '\r' with blank
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = df_sheet[col].str.count(u'\n', re.UNICODE).sum()
+    sheet_rep_dict[u'\n Ortho'+u'_to_'+u''] += cur_rep_count                            
+    # replace all instances
+    df_sheet[col] = df_sheet[col].str.replace(u'\n', '', re.UNICODE)
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} removed'.format(cur_rep_count, u'new line'))
+
+    # Replace 'thiers' with 'theirs'
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = df_sheet[col].str.count(r'^thiers$', re.UNICODE).sum()
+    sheet_rep_dict[r'^thiers$'+u'_to_'+u'theirs'] += cur_rep_count                            
+    # replace all instances
+    df_sheet[col] = df_sheet[col].str.replace(r'^thiers$', u'theirs', re.UNICODE)
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} replaced with {}'.format(cur_rep_count, u'thiers', u'theirs'))
+
+    # Replace 'moustach' with 'moustache'
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = df_sheet[col].str.count(r'^moustach$', re.UNICODE).sum()
+    sheet_rep_dict[r'^moustach$'+u'_to_'+u'moustache'] += cur_rep_count                            
+    # replace all instances
+    df_sheet[col] = df_sheet[col].str.replace(r'^moustach$', u'moustache', re.UNICODE)
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} replaced with {}'.format(cur_rep_count, u'moustach', u'moustache'))                                                               
+
+    # Replace 'loag' with 'loaf'
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = df_sheet[col].str.count(r'^loag$', re.UNICODE).sum()
+    sheet_rep_dict[r'^loag$'+u'_to_'+u'loaf'] += cur_rep_count                            
+    # replace all instances
+    df_sheet[col] = df_sheet[col].str.replace(r'^loag$', u'loaf', re.UNICODE)
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} replaced with {}'.format(cur_rep_count, u'loag', u'loaf'))                                                                                                                                 
+
+def applyDictionary(dfTrans, col, dictionary, rep_counts, quarantined_cells, context):
+
+    """
+    Replaces every key of a translation dictionary (regex) with its value in 
+    the session column, in dictionary order, counting replacements in 
+    rep_counts. With regex_timeout, cells that time out are left unchanged 
+    and added to quarantined_cells with context [name, sheet, col].
+    """
+
+    for key in dictionary:
+        if regex_timeout:
+            # Time limit per cell. Cells that time out are left unchanged and quarantined
+            cur_rep_count, dfTrans[col] = guardedReplace(dfTrans[col], key, dictionary[key], regex_timeout, quarantined_cells, context)
+            rep_counts[key+u'_to_'+ dictionary[key]] += cur_rep_count
+            continue
+        # cur_rep_count to track instances of replacements. In unicode
+        cur_rep_count = dfTrans[col].str.count(six.text_type(key), re.UNICODE).sum()
+        rep_counts[key+u'_to_'+ dictionary[key]] += cur_rep_count             
+        # replace all instances of dictionary key with corresponding value. In unicode
+        dfTrans[col] = dfTrans[col].str.replace(six.text_type(key), six.text_type(dictionary[key]), re.UNICODE)
+
+
+def removeWhitespace(dfTrans, col, sheet_rep_dict):
+
+    """
+    Removes whitespace from the session column, except the spaces separating 
+    multiple productions.
+    """
+
+    # Replace whitespaces, but leave space between multiple productions
+    # Mask excluding cells with multiple productions (these white spaces should remain)
+    mask = dfTrans.filter(['Word',col,'NumProductions'], axis=1).NumProductions == ''                           
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = dfTrans.loc[mask, col].str.count(' ', re.UNICODE).sum()
+    sheet_rep_dict[u' '+u'_to_'+u''] += cur_rep_count                            
+    # replace all instances of space ' ' with blank.
+    dfTrans.loc[mask, col] = dfTrans.loc[mask, col].str.replace(' ', '', re.UNICODE) 
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} removed'.format(cur_rep_count, 'whitespace'))
+
+    # Replace single whitespaces in instances with multiple productions
+    mask = dfTrans.filter(['Word',col,'NumProductions'], axis=1).NumProductions != ''
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = dfTrans.loc[mask, col].str.count(' {1,3}(?! )', re.UNICODE).sum()
+    sheet_rep_dict[u' {1,3}(?! )'+u'_to_'+u''] += cur_rep_count                            
+    # replace all instances of space ' {1,2}(?! )' with blank.
+    dfTrans.loc[mask, col] = dfTrans.loc[mask, col].str.replace(' {1,3}(?! )', '', re.UNICODE)                             
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} removed from records with multiple utterances'.format(cur_rep_count, 'whitespace'))                          
+
+
+# Rule passes of convertSession() after the dictionary-independent steps, in 
+# order: (name, key of the dictionary used in loadDictionaries(), or None)
+### Superscript replacement must occur after
+### whitespace removal due to current regex used
+ruleStages = [('other_chars', 'other_chars_dict'),
+              ('compounds', 'compounds_dict'),
+              ('whitespace', None),
+              ('superscript_initial', 'superscript_dict_initial'),
+              ('superscript_initial2', 'superscript_dict_initial2'),
+              ('superscript_initial3', 'superscript_dict_initial3'),
+              ('superscript_noninitial', 'superscript_dict_noninitial')]
+
+
+def finishSession(dfTrans, col, name, sheet, target_dict, sheet_rep_dict, run_log):
+
+    """
+    Completes a session converted by the rule passes: IPA Target from 
+    target_dict, multiple productions, illegal character check and X-SAMPA 
+    tiers (steps 5.4 and after).
+    """
+
+    phon_legal_chars = run_log['legal_chars']
+    illegal_chars_log = run_log['illegal_chars_log']
+    illegal_chars_cache = run_log['illegal_chars_cache']
+
+    # Populate IPA Target Tier with target_dict.csv
+    dfTrans.set_index('Word', drop=False, inplace=True)
+    dfTrans['IPA Target'] = pd.Series(target_dict, name='IPA Target')
+
+    # Duplicate words in 'Word' column according to how many repetitions of the word are recorded                                          
+    ########## Also, don't remove spaces in multiple words.
+
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = dfTrans['NumProductions'].str.count('2.0', re.UNICODE).sum()                            
+    sheet_rep_dict[u'ortho x 2'] += cur_rep_count
+    cur_rep_count = dfTrans['NumProductions'].str.count('3.0', re.UNICODE).sum()                            
+    sheet_rep_dict[u'ortho x 3'] += cur_rep_count
+    cur_rep_count = dfTrans['NumProductions'].str.count('4.0', re.UNICODE).sum()                            
+    sheet_rep_dict[u'ortho x 4'] += cur_rep_count                                
+    cur_rep_count = dfTrans['NumProductions'].str.count('5.0', re.UNICODE).sum()                            
+    sheet_rep_dict[u'ortho x 5'] += cur_rep_count   
+
+    # Multiply orthography instances by number of productions
+
+    dfTrans['Orthography'] = dfTrans['Word']
+    mask = dfTrans.filter(['Orthography',col,'NumProductions'], axis=1).NumProductions == '2.0'                            
+    dfTrans.loc[mask, 'Orthography'] = dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']                            
+    mask = dfTrans.filter(['Orthography',col,'NumProductions'], axis=1).NumProductions == '3.0'                            
+    dfTrans.loc[mask, 'Orthography'] = dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']                             
+    mask = dfTrans.filter(['Orthography',col,'NumProductions'], axis=1).NumProductions == '4.0'                            
+    dfTrans.loc[mask, 'Orthography'] = dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']
+    mask = dfTrans.filter(['Orthography',col,'NumProductions'], axis=1).NumProductions == '5.0'                            
+    dfTrans.loc[mask, 'Orthography'] = dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']\
+    +' \ '+dfTrans.loc[mask, 'Orthography']
+
+    # Multiply IPA Target instances by number of productions
+
+    dfTrans['IPA Target_dup'] = dfTrans['IPA Target']
+    mask = dfTrans.filter(['IPA Target_dup',col,'NumProductions'], axis=1).NumProductions == '2.0'                            
+    dfTrans.loc[mask, 'IPA Target_dup'] = dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']                            
+    mask = dfTrans.filter(['IPA Target_dup',col,'NumProductions'], axis=1).NumProductions == '3.0'                            
+    dfTrans.loc[mask, 'IPA Target_dup'] = dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']                             
+    mask = dfTrans.filter(['IPA Target_dup',col,'NumProductions'], axis=1).NumProductions == '4.0'                            
+    dfTrans.loc[mask, 'IPA Target_dup'] = dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']
+    mask = dfTrans.filter(['IPA Target_dup',col,'NumProductions'], axis=1).NumProductions == '5.0'                            
+    dfTrans.loc[mask, 'IPA Target_dup'] = dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']\
+    +' \ '+dfTrans.loc[mask, 'IPA Target_dup']                                                                                                                                             
+
+    # Change NumProductions column to integer type
+    dfTrans['NumProductions'] = pd.to_numeric(
+            dfTrans['NumProductions'], 
+            downcast = 'integer')
+
+    # Check for errors against characters legal in Phon
+    if phon_legal_chars is not None:
+        for tier, tierCol in [('IPA Target', 'IPA Target_dup'), ('IPA Actual', col)]:
+            for word, transcription in zip(dfTrans['Word'], dfTrans[tierCol]):
+                if not isinstance(transcription, str):
+                    continue
+                try:
+                    illegal = illegal_chars_cache[transcription]
+                except KeyError:
+                    illegal = findIllegalChars(transcription, phon_legal_chars)
+                    illegal_chars_cache[transcription] = illegal
+                if illegal:
+                    illegal_chars_log.append([name, sheet, col, word, tier, transcription, illegal])
+                    if validate_fail_fast:
+                        raise IllegalCharsError(u"Illegal characters '{}' in {} '{}' ({} {} {} '{}')".format(illegal, tier, transcription, name, sheet, col, word))
+
+    # Add X-SAMPA tiers. Each unique transcription is translated once
+    if add_xsampa:
+        dfTrans['IPA Target XSAMPA'] = translateSeries(dfTrans['IPA Target_dup'], 'xsampa')
+        dfTrans['IPA Actual XSAMPA'] = translateSeries(dfTrans[col], 'xsampa')
+    return dfTrans
+
+
+def convertSessionVariants(df_sheet, col, name, sheet, CA_dict, variants, sheet_rep_dicts, run_logs):
+
+    """
+    Converts one probe administration (session column) of a probe sheet to
+    Phon format with one or more sets of dictionaries (steps 5.21 to 5.4). 
+    The dictionary-independent steps run once, and each rule pass in 
+    ruleStages runs once for every group of variants whose dictionaries 
+    agree up to that pass.
+
+    Parameters:
+        df_sheet, col, name, sheet, CA_dict : probe sheet, session column, 
+            participant, probe and Probe:CA dictionary
+        variants : OrderedDict {variant name : dict from loadDictionaries()}
+        sheet_rep_dicts : dict {variant name : Counter of replacements}
+        run_logs : dict {variant name : dict from newRunLog()}
+
+    Returns dict {variant name : DataFrame of the session, indexed by Word}
+    """
+
+    ## Copy and work from copy of dataframe
+    dfTrans = df_sheet[['Word', 'Target', col, ]]
+    dfTrans.set_index('Word', drop=False, inplace=True)
+
+    # Populate DI column (delayed/direct imitation) locating [] in cells.
+    dfTrans['DI'] = np.where(dfTrans[col].str.contains(u'\[\]|□', re.UNICODE, regex=True).fillna(False), 1, '')
+
+    # Number of Productions Tier
+    # Multiple productions = when there is a 4 spaces + character not followed by spaces + ']'
+    ## Changed to 5 spaces
+    dfTrans['NumProductions'] = np.where(dfTrans[col].str.contains('    [^\s](?! *\])', regex=True).fillna(False), 1.0+dfTrans[col].str.count('    [^\s](?! *\])', re.UNICODE), '')                       
+
+    # NR "denotes 'no response'" - new column entry (Notes
+    dfTrans['Notes'] = np.where(dfTrans[col].str.contains(r'NR|ɴʀ', re.UNICODE, regex=True).fillna(False), 'No Response', "") 
+
+    # Add participant number to metadata, participant tier, and name of file
+    dfTrans['Speaker'] = name
+
+    # Add Probe to new tier and to name of file
+    dfTrans['Probe'] = sheet
+
+    # Add Session to new tier and to name of file
+    dfTrans['Session'] = col
+
+    # Add CA from CA_Dict to new tier and to session metadata 
+    try:
+        dfTrans['CA'] = CA_dict[col]
+    # Condition A and Condition B are not specified in column heading. Workaround follows:
+    except KeyError:
+        if ' A ' in sheet:
+            try:
+                dfTrans['CA'] = CA_dict['Cond A ' + col]
+            except KeyError:
+                dfTrans['CA'] = CA_dict['Ver A ' + col]
+        if ' B ' in sheet:
+            try:
+                dfTrans['CA'] = CA_dict['Cond B ' + col]
+            except KeyError:
+                dfTrans['CA'] = CA_dict['Ver B ' + col]                                                                                                                                                                                                                               
+
+
+    # Replace items from excludeListSpaces
+    excludedList = []
+    for item in excludeListSpaces:                             
+        if len(dfTrans[dfTrans[col].astype(str).str.contains(item, regex=False)]) == 1:
+            excludedList.append(item)
+            # Get row index of item
+            rowIndex = dfTrans[dfTrans[col].astype(str).str.contains(item, regex=False)].index
+            # remove item from cell
+            dfTrans[col] = dfTrans[col].str.replace(item, '', regex=False)
+            # remove symbols around word
+            item = item.strip("'() ")
+            # replace item in word column
+            dfTrans.loc[rowIndex, 'Word'] = item
+           # Add Note
+            dfTrans.loc[rowIndex, 'Notes'] = f"Probe target '{rowIndex[0]}' but child produced '{item}'"                                    
+            # also replace item in index column
+            dfTrans.rename(index={rowIndex[0]:item},inplace=True)
+
+
+    # Update unique word_list
+    for run_log in run_logs.values():
+        run_log['word_list'] = list(set(run_log['word_list']+df_sheet['Word'].tolist()))
+
+    prefix_counts = Counter()
+    # Populate Notes Tier... other stuff?                                      
+
+    ######## Replacements applying to all data go here:
+    ## 1. Replace delayed imitation notion
+    ## 2. Replace miscellanous non-standard IPA characters
+    ## 3. Replace compound segments
+    ## 4. Replace most whitespaces (except multiple productions)
+    ######################################
+    ## Current logic:
+    ## Identify initials only when at the beginning of a word
+    ## All else are non-initials.
+    ##
+    ## 5. Replace initial superscript diacritics.
+    ##    This i dones before non-initial diacritics 
+    ##    because this is the special case. Non-initial
+    ##    diacritics are assumed to be those that remain.
+    ## 6. Repeat initial superscript diacritics 2 more
+    ##    times to capture segments with multiple diacritics
+    ## 7. Replace noninitial superscript diacritics
+    ## 8. Duplicate multiple-production words
+
+    # Replace [] and □ with blank
+    # cur_rep_count to track instances of replacements. In unicode
+    cur_rep_count = dfTrans[col].str.count('\[\]', re.UNICODE).sum()
+    cur_rep_count += dfTrans[col].str.count('□', re.UNICODE).sum()
+    prefix_counts[u'\[\] or □'+u'_to_'+u''] += cur_rep_count                            
+    # replace all instances of space ' {1,2}(?! )' with blank.
+    dfTrans[col] = dfTrans[col].str.replace('\[\]', '', re.UNICODE)
+    #if cur_rep_count > 0:
+        #print('************************************')
+        #print(u'{} instances of {} removed'.format(cur_rep_count, '[]'))     
+    for variant in variants:
+        for key, count in prefix_counts.items():
+            sheet_rep_dicts[variant][key] += count
+
+    sessions = {}
+
+    def applyStages(stage, dfTrans, group):
+        if stage == len(ruleStages):
+            for i, variant in enumerate(group):
+                branch = dfTrans if i == len(group) - 1 else dfTrans.copy()
+                sessions[variant] = finishSession(branch, col, name, sheet, variants[variant]['target_dict'], 
+                                                  sheet_rep_dicts[variant], run_logs[variant])
+            return
+        stage_name, dict_key = ruleStages[stage]
+        # Split the group by the dictionary of this pass
+        subgroups = OrderedDict()
+        for variant in group:
+            identity = None if dict_key is None else tuple(variants[variant][dict_key].items())
+            subgroups.setdefault(identity, []).append(variant)
+        for i, subgroup in enumerate(subgroups.values()):
+            branch = dfTrans if i == len(subgroups) - 1 else dfTrans.copy()
+            stage_counts = Counter()
+            quarantined_cells = []
+            if dict_key is None:
+                removeWhitespace(branch, col, stage_counts)
+            else:
+                applyDictionary(branch, col, variants[subgroup[0]][dict_key], stage_counts, quarantined_cells, [name, sheet, col])
+            for variant in subgroup:
+                for key, count in stage_counts.items():
+                    sheet_rep_dicts[variant][key] += count
+                run_logs[variant]['quarantined_cells'].extend(quarantined_cells)
+            applyStages(stage + 1, branch, subgroup)
+
+    applyStages(0, dfTrans, list(variants))
+    return sessions
+
+
+def convertSession(df_sheet, col, name, sheet, CA_dict, dicts, sheet_rep_dict, run_log):
+
+    """
+    Converts one probe administration (session column) of a probe sheet to
+    Phon format (steps 5.21 to 5.4), counting replacements in sheet_rep_dict
+    and collecting words, illegal characters and quarantined cells in run_log.
+
+    Returns DataFrame of the session, indexed by Word
+    """
+
+    return convertSessionVariants(df_sheet, col, name, sheet, CA_dict, OrderedDict([(None, dicts)]), 
+                                  {None: sheet_rep_dict}, {None: run_log})[None]
+
+
+def convertWorkbookVariants(fpath, variants, outDirs, run_logs, probes = None, sessions = None):
+
+    """
+    Converts a DPA xls file with one or more sets of dictionaries, saving a 
+    csv file in outDirs[variant]/csv for each session and variant (steps 2 
+    to 6). The workbook is read and the orthography cleaned once, and rule 
+    passes are shared between variants, see convertSessionVariants().
+
+    Parameters:
+        fpath : str path to '####_PHON.xls' file
+        variants : OrderedDict {variant name : dict from loadDictionaries()}
+        outDirs : dict {variant name : str output directory}
+        run_logs : dict {variant name : dict from newRunLog()}. Updated in place
+        probes, sessions : default None (all). Probe sheets and session column 
+            patterns converted; other sheets and columns are not parsed, see 
+            auxiliar.readExcelSelection()
+
+    Returns Counter of seconds spent in each stage: 'read' (xls file),
+    'rules' (replacements) and 'write' (csv files), or None if the file
+    cannot be read. A telemetry record of the workbook (sheets, sessions, 
+    rows, transcription cells, bytes written, stage times and peak memory) 
+    is appended to the 'telemetry' list of each run log
+    """
+
+    stage_times = Counter()
+    counts = {variant: Counter() for variant in variants}
+    file = os.path.basename(fpath)
+
+    # Read Excel file as dictionary of Pandas DataFrames (data_xls) Key = sheet name
+    start = time.perf_counter()
+    try:
+        data_xls = readExcelSelection(fpath, probes, sessions)
+    except:
+        #print(sys.exc_info()[1])
+        #print('Unable to read {} {}'.format(file, type(file)))
+        print('{} skipped'.format(file))
+        return None
+    stage_times['read'] += time.perf_counter() - start
+
+    #Extract/create Probe:CA dictionary
+    CA_dict = data_xls['Probe Schedule'].set_index('Probe').T.to_dict('records')[0]
+
+    # Extract participant number from file name
+    name = file[:file.find('_')]
+    # Create new subdirectory to place csv files
+    csv_dirs = {variant: os.path.join(outDirs[variant], 'csv') for variant in variants}
+    for csv_dir in csv_dirs.values():
+        os.makedirs(csv_dir, exist_ok = True)
+
+    for sheet in data_xls:
+        # Define working Excel tab as DataFrame
+        df_sheet = data_xls[sheet]
+
+        # Define counting dictionary for replacements in current DataFrame
+        sheet_rep_dicts = {variant: Counter() for variant in variants}
+
+        # Skip Copyright and Probe schedule sheets
+        if sheet == 'Copyright':
+            #print(name, "Copyright sheet excluded")
+            continue
+        if sheet == 'Probe Schedule':
+            #print(name, "Probe Schedule sheet excluded")
+            ### TODO get index of notes: accomplished with auxiliary.py
+            continue
+        # Iterate through DataFrame columns
+        for col in df_sheet.columns:
+            if col == 'Target':
+                #print('Target skipped')
+                continue
+            start = time.perf_counter()
+            ## Working with Word column (replacements)
+            if col == 'Word':
+                word_counts = Counter()
+                cleanOrthography(df_sheet, col, word_counts)
+                for variant in variants:
+                    for key, count in word_counts.items():
+                        sheet_rep_dicts[variant][key] += count
+                stage_times['rules'] += time.perf_counter() - start
+                continue
+            ## Working with current probe administration column
+            dfTransByVariant = convertSessionVariants(df_sheet, col, name, sheet, CA_dict, variants, sheet_rep_dicts, run_logs)
+            for variant, dfTrans in dfTransByVariant.items():
+                counts[variant]['sessions'] += 1
+                counts[variant]['rows'] += len(dfTrans)
+                counts[variant]['cells'] += int(dfTrans[col].notna().sum())
+
+                # Create DataFrame Series from replace counts for current column/probe administration
+                probe_counts = pd.Series(sheet_rep_dicts[variant])
+                # Add current column Series replace counts to DataFrame of counts for this participant
+                df_replace_counts = run_logs[variant]['replace_counts']
+                df_replace_counts[col] = probe_counts
+                df_replace_counts.rename(columns={col:name+' '+col}, inplace=True)
+                run_logs[variant]['session_counts'].append([name+' '+col, dict(sheet_rep_dicts[variant])])
+            #print(name, col, 'column complete.')
+            stage_times['rules'] += time.perf_counter() - start
+
+            ## Save CSV of transcription data for current probe administration
+            start = time.perf_counter()
+            for variant, dfTrans in dfTransByVariant.items():
+                csv_path = os.path.join(csv_dirs[variant], name + '_' + sheet + '_' + col + '.csv')
+                run_logs[variant]['csv_files'].append(csv_path)
+                dfTrans.filter(['Target','Orthography','IPA Target_dup', col, 'DI', 'Notes', 'NumProductions','Speaker', 'CA', 'Probe', 'Session', 'IPA Target XSAMPA', 'IPA Actual XSAMPA'], axis=1).rename(columns={'IPA Target_dup':'IPA Target', col:'IPA Actual'}).to_csv(csv_path, encoding = 'utf-8', index = False)
+                counts[variant]['bytes'] += os.path.getsize(csv_path)
+            stage_times['write'] += time.perf_counter() - start
+        for variant in variants:
+            counts[variant]['sheets'] += 1
+        #print(name,sheet, "Done")
+    for variant in variants:
+        record = OrderedDict([('type', 'workbook'), ('workbook', file)])
+        for key in ['sheets', 'sessions', 'rows', 'cells', 'bytes']:
+            record[key] = counts[variant][key]
+        for stage in ['read', 'rules', 'write']:
+            record[stage + '_s'] = round(stage_times[stage], 4)
+        record['total_s'] = round(sum(stage_times.values()), 4)
+        record['peak_rss_mb'] = peakRSS()
+        run_logs[variant]['telemetry'].append(record)
+    print(name, "Done")
+    return stage_times
+
+
+def convertWorkbook(fpath, dicts, outDir, run_log, probes = None, sessions = None):
+
+    """
+    Converts a DPA xls file, saving a csv file in outDir/csv for each session
+    (steps 2 to 6).
+
+    Parameters:
+        fpath : str path to '####_PHON.xls' file
+        dicts : dict from loadDictionaries()
+        outDir : str. Output directory
+        run_log : dict from newRunLog(). Updated in place
+        probes, sessions : default None (all). Probe sheets and session column 
+            patterns converted; other sheets and columns are not parsed, see 
+            auxiliar.readExcelSelection()
+
+    Returns Counter of seconds spent in each stage: 'read' (xls file),
+    'rules' (replacements) and 'write' (csv files), or None if the file
+    cannot be read. A telemetry record of the workbook (sheets, sessions, 
+    rows, transcription cells, bytes written, stage times and peak memory) 
+    is appended to run_log['telemetry']
+    """
+
+    return convertWorkbookVariants(fpath, OrderedDict([(None, dicts)]), {None: outDir}, {None: run_log}, 
+                                   probes, sessions)
+
+
+def telemetrySummary(records, stage_times, slowest = 5):
+
+    """
+    Prints a summary of a conversion run: time and share of each stage, 
+    overall throughput, and the slowest workbooks.
+
+    Parameters:
+        records : list of workbook records from run_log['telemetry']
+        stage_times : Counter of seconds spent in each stage
+        slowest : int. Number of slowest workbooks listed
+    """
+
+    total = sum(stage_times.values())
+    cells = sum(record['cells'] for record in records)
+    print('**********Telemetry summary**********')
+    print('{} workbooks, {} sessions, {} cells, {:.1f} MB written in {:.2f} s ({:.0f} cells/s)'.format(
+            len(records), sum(record['sessions'] for record in records), cells, 
+            sum(record['bytes'] for record in records) / 1024.0 ** 2, total, 
+            cells / total if total else 0))
+    for stage, seconds in stage_times.most_common():
+        print('\t{:<6} {:8.2f} s {:6.1%}'.format(stage, seconds, seconds / total if total else 0))
+    if records:
+        print('Slowest workbooks:')
+        for record in sorted(records, key = lambda record: -record['total_s'])[:slowest]:
+            print('\t{:<20} {:8.2f} s {:8.0f} cells/s (read {:.2f}, rules {:.2f}, write {:.2f})'.format(
+                    record['workbook'], record['total_s'], 
+                    record['cells'] / record['total_s'] if record['total_s'] else 0, 
+                    record['read_s'], record['rules_s'], record['write_s']))
+    print('Peak memory: {} MB'.format(peakRSS()))
+
+
+def runFingerprint(dictsDir, selection = None):
+
+    """
+    Returns hex digest of the dictionaries, options and workbook selection 
+    (see selectWorkbooks()) that determine the output, so that a journal is 
+    only resumed by an identical run.
+    """
+
+    digest = hashlib.sha256()
+    for fname in sorted(os.listdir(dictsDir)):
+        fpath = os.path.join(dictsDir, fname)
+        if os.path.isfile(fpath):
+            digest.update(fname.encode('utf-8'))
+            with open(fpath, 'rb') as f:
+                digest.update(f.read())
+    options = [validate_ipa, validate_fail_fast, add_xsampa, regex_timeout, selection]
+    digest.update(json.dumps(options).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def workbookStamp(fpath):
+
+    """
+    Returns [size, mtime] of a workbook, used to detect changed files.
+    """
+
+    stat = os.stat(fpath)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def readJournal(journalPath, fingerprint):
+
+    """
+    Reads the run journal of an interrupted run.
+
+    Returns OrderedDict of file name : journal entry of completed workbooks, 
+    or None if there is no journal to resume (missing, from a different 
+    run configuration, or from a run that completed)
+    """
+
+    if not os.path.isfile(journalPath):
+        return None
+    completed = OrderedDict()
+    with open(journalPath, 'r', encoding = 'utf-8') as f:
+        for n, line in enumerate(f):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Last line cut short by a crash
+                break
+            if n == 0 and (entry.get('type') != 'header' or entry.get('fingerprint') != fingerprint):
+                return None
+            if entry['type'] == 'complete':
+                return None
+            if entry['type'] == 'workbook':
+                completed.pop(entry['workbook'], None)
+                if entry['status'] == 'done':
+                    completed[entry['workbook']] = entry
+    return completed
+
+
+def snapshotRunLog(run_log):
+
+    """
+    Returns snapshot of run_log taken before a workbook is converted, for 
+    journalEntry() and rollbackWorkbook().
+    """
+
+    # replace_counts gains one column per session: only its width is kept
+    return {'replace_counts': len(run_log['replace_counts'].columns), 
+            'word_list': set(run_log['word_list']), 
+            'illegal_chars_log': len(run_log['illegal_chars_log']), 
+            'quarantined_cells': len(run_log['quarantined_cells']), 
+            'telemetry': len(run_log['telemetry']), 
+            'session_counts': len(run_log['session_counts']), 
+            'csv_files': len(run_log['csv_files'])}
+
+
+def rollbackWorkbook(run_log, before):
+
+    """
+    Restores run_log to its snapshot before a workbook that failed partway, 
+    and removes the csv files the workbook wrote. Output of other workbooks 
+    of the same participant is kept.
+    """
+
+    if before['replace_counts']:
+        run_log['replace_counts'] = run_log['replace_counts'].iloc[:, :before['replace_counts']].copy()
+    else:
+        run_log['replace_counts'] = pd.DataFrame()
+    # Remove csv files of the failed workbook, including one being written
+    for csv_path in run_log['csv_files'][before['csv_files']:]:
+        if os.path.isfile(csv_path):
+            os.remove(csv_path)
+    for key in ['illegal_chars_log', 'quarantined_cells', 'telemetry', 'session_counts', 'csv_files']:
+        del run_log[key][before[key]:]
+    run_log['word_list'] = list(before['word_list'])
+
+
+def journalEntry(file, stamp, workbook_times, run_log, before):
+
+    """
+    Returns journal entry of a completed workbook: its stage times and what 
+    it added to run_log since the snapshot before (from newRunLog() keys to 
+    lengths, and 'replace_counts' columns).
+    """
+
+    return OrderedDict([
+            ('type', 'workbook'), ('workbook', file), ('stamp', stamp), ('status', 'done'),
+            ('stage_times', dict(workbook_times)),
+            ('replace_counts', run_log['session_counts'][before['session_counts']:]),
+            ('word_list', sorted(set(run_log['word_list']) - before['word_list'], key = str)),
+            ('illegal_chars_log', run_log['illegal_chars_log'][before['illegal_chars_log']:]),
+            ('quarantined_cells', run_log['quarantined_cells'][before['quarantined_cells']:]),
+            ('telemetry', run_log['telemetry'][-1])])
+
+
+def restoreWorkbook(entry, run_log):
+
+    """
+    Merges the counts saved in a journal entry into run_log, in the same 
+    order as the original run. Returns Counter of the saved stage times.
+    """
+
+    # Columns are added by position, as convertWorkbookVariants() adds them: 
+    # a session label repeated across sheets keeps one column per session. 
+    # Rows are those of the first column, as in column assignment
+    replace_counts = run_log['replace_counts']
+    if entry['replace_counts']:
+        index = replace_counts.index if len(replace_counts.columns) else pd.Series(entry['replace_counts'][0][1]).index
+        df_counts = pd.concat([pd.Series(counts).reindex(index) for col, counts in entry['replace_counts']], axis = 1)
+        df_counts.columns = [col for col, counts in entry['replace_counts']]
+        run_log['replace_counts'] = pd.concat([replace_counts, df_counts], axis = 1) if len(replace_counts.columns) else df_counts
+    run_log['session_counts'].extend(entry['replace_counts'])
+    run_log['word_list'] = list(set(run_log['word_list'] + entry['word_list']))
+    run_log['illegal_chars_log'].extend(entry['illegal_chars_log'])
+    run_log['quarantined_cells'].extend(entry['quarantined_cells'])
+    run_log['telemetry'].append(entry['telemetry'])
+    return Counter(entry['stage_times'])
+
+
+def selectWorkbooks(files, shard = None, participants = None):
+
+    """
+    Returns the files of xlsDir (in their original order) converted by this 
+    node.
+
+    Parameters:
+        files : list of file names in xlsDir
+        shard : tuple(index, count), 0 <= index < count, or None. Participant 
+            workbooks are dealt round robin in order of file name, so count 
+            nodes with indices 0 to count-1 convert every workbook once
+        participants : list of participant numbers (str), or None for all. 
+            Workbooks of other participants are not opened
+    """
+
+    files = selectFiles(files, participants)
+    if shard is not None:
+        index, count = shard
+        if not 0 <= index < count:
+            raise ValueError('Shard index must be in 0 to {}: {}'.format(count - 1, index))
+        selected = set(sorted(files)[index::count])
+        files = [file for file in files if file in selected]
+    return files
+
+
+def checkReplacedRows(replaced_rows, run_log):
+
+    """
+    Checks the csv rows rewritten by postProcessingReplacements() for 
+    characters illegal in Phon, as finishSession() checks converted rows.
+
+    Parameters:
+        replaced_rows : list from the replacedRows parameter of 
+            postProcessingReplacements()
+        run_log : dict from newRunLog(), with legal_chars set
+
+    Returns list of [speaker, probe, session, tier, original transcription, 
+    replacement transcription, illegal characters, orthography, number of 
+    rows] for each tier changed, for updateIllegalCharsLog()
+    """
+
+    phon_legal_chars = run_log['legal_chars']
+    illegal_chars_cache = run_log['illegal_chars_cache']
+    changes = []
+    for fname, header, original, replacement, count in replaced_rows:
+        header = next(csv.reader([header]))
+        row, new_row = [dict(zip(header, next(csv.reader([line])))) for line in [original, replacement]]
+        for tier in ['IPA Target', 'IPA Actual']:
+            transcription = new_row.get(tier, '')
+            if row.get(tier, '') == transcription:
+                continue
+            try:
+                illegal = illegal_chars_cache[transcription]
+            except KeyError:
+                illegal = findIllegalChars(transcription, phon_legal_chars)
+                illegal_chars_cache[transcription] = illegal
+            changes.append([row.get('Speaker'), row.get('Probe'), row.get('Session'), tier, row.get(tier, ''), 
+                            transcription, illegal, new_row.get('Orthography'), count])
+    return changes
+
+
+def updateIllegalCharsLog(run_log, changes):
+
+    """
+    Updates run_log['illegal_chars_log'] with the rows rewritten by 
+    post-processing (from checkReplacedRows()), so that the log matches the 
+    csv files imported by Phon: entries of original rows are removed, and 
+    replacement rows with illegal characters are added, with the Word of the 
+    entry they replace (or their Orthography).
+    """
+
+    remove = Counter()
+    for speaker, probe, session, tier, original, replacement, illegal, orthography, count in changes:
+        remove[(speaker, probe, session, tier, original)] += count
+    words = {}
+    illegal_chars_log = []
+    for entry in run_log['illegal_chars_log']:
+        key = (entry[0], entry[1], entry[2], entry[4], entry[5])
+        if remove[key] > 0:
+            remove[key] -= 1
+            words[key] = entry[3]
+            continue
+        illegal_chars_log.append(entry)
+    for speaker, probe, session, tier, original, replacement, illegal, orthography, count in changes:
+        if illegal:
+            word = words.get((speaker, probe, session, tier, original), orthography)
+            illegal_chars_log.extend([speaker, probe, session, word, tier, replacement, illegal] for i in range(count))
+    run_log['illegal_chars_log'] = illegal_chars_log
+
+
+def writeRunInfo(run_log, info_dir, workbook_errors, post_counts):
+
+    """
+    Writes the info files of a run: replacement counts, word list, illegal 
+    characters (if checked), quarantined cells (if regex_timeout is set), 
+    workbook errors and post-processing counts.
+    """
+
+    ## Save CSV of replacement counts
+    run_log['replace_counts'].T.to_csv(os.path.join(info_dir, 'replacement_counts.csv'), encoding = 'utf-8')
+    print('\treplacement_counts.csv created')
+
+    ### Other features to implement in future:
+    # Add info from notes_dict to participant metadata/phon corpus, CA
+    # Add CA from CA_Dict to session metadata
+    # If participant_num in notes_dict, insert dictionary entry to notes Tier. Also add to corpus notes
+
+    # Create csv of unique orthography items, sorted so that runs are reproducible
+    pd.DataFrame(sorted(run_log['word_list'], key = str), columns = ['Orthography']).to_csv(
+            os.path.join(info_dir, 'word_list.csv'), encoding = 'utf-8', index = False)
+    print('\tword_list.csv created')
+
+    # Create error log of illegal characters
+    if run_log['legal_chars'] is not None:
+        illegal_chars_log = run_log['illegal_chars_log']
+        pd.DataFrame(illegal_chars_log, columns = ['Speaker', 'Probe', 'Session', 'Word', 'Tier', 'Transcription', 'Illegal Characters']).to_csv(
+                os.path.join(info_dir, 'illegal_chars_log.csv'), encoding = 'utf-8', index = False)
+        print('\tillegal_chars_log.csv created: {} transcriptions with illegal characters'.format(len(illegal_chars_log)))
+
+    # Create log of quarantined cells
+    if regex_timeout:
+        quarantined_cells = run_log['quarantined_cells']
+        pd.DataFrame(quarantined_cells, columns = ['Speaker', 'Probe', 'Session', 'Word', 'Pattern', 'Transcription']).to_csv(
+                os.path.join(info_dir, 'quarantined_cells.csv'), encoding = 'utf-8', index = False)
+        print('\tquarantined_cells.csv created: {} cells quarantined'.format(len(quarantined_cells)))
+
+    # Create report of workbooks that could not be converted
+    pd.DataFrame(workbook_errors, columns = ['Workbook', 'Error']).to_csv(
+            os.path.join(info_dir, 'workbook_errors.csv'), encoding = 'utf-8', index = False)
+    print('\tworkbook_errors.csv created: {} workbooks failed'.format(len(workbook_errors)))
+
+    # Create csv of lines replaced in post-processing
+    pd.DataFrame(sorted(post_counts.items()), columns = ['Line', 'Count']).to_csv(
+            os.path.join(info_dir, 'post_processing_counts.csv'), encoding = 'utf-8', index = False)
+
+
+def runConversion(xlsDir, outDir = cwd, dictsDir = os.path.join(cwd, 'dicts'), shard = None, participants = None, 
+                  probes = None, sessions = None):
+
+    """
+    Converts every DPA xls file in xlsDir, saving csv files in outDir/csv and
+    replacement counts, word list and logs in outDir/info, then applies
+    post-processing replacements (steps 1 to 8).
+
+    Parameters:
+        xlsDir : str. Directory of xls files
+        outDir : str. Output directory. Default: script directory
+        dictsDir : str. Directory of dictionary csv files
+        shard, participants : convert only part of xlsDir, see 
+            selectWorkbooks(). Output of several shards is merged with 
+            reduceShards()
+        probes, sessions : convert only these probe sheets (e.g. ['GFTA']) and 
+            session columns (regex patterns, e.g. ['Pre']), see convertWorkbook()
+
+    Returns Counter of seconds spent in each stage: 'dicts', 'read', 'rules',
+    'write', 'info' and 'post'. If telemetry is set, a record per workbook 
+    and per run stage is written to outDir/info/telemetry.jsonl as it 
+    completes, and a summary is printed at the end. If resume_run is set, 
+    completed workbooks are recorded in outDir/info/run_journal.jsonl, and 
+    a run interrupted with the same dictionaries and options resumes from it. 
+    The journal is always kept for shards, as reduceShards() reads it
+    """
+
+    stage_times = Counter()
+    start = time.perf_counter()
+    dicts = loadDictionaries(dictsDir)
+    stage_times['dicts'] += time.perf_counter() - start
+
+    #### Step 2: Work with Excel files as DataFrames
+    print('**********Step 2: Work with Excel files as DataFrames**********')
+
+    phon_legal_chars = phonLegalChars()
+    run_log = newRunLog(phon_legal_chars)
+
+    info_dir = os.path.join(outDir, 'info')
+    os.makedirs(info_dir, exist_ok = True)
+    telemetry_file = None
+    if telemetry:
+        telemetry_file = open(os.path.join(info_dir, 'telemetry.jsonl'), 'w', encoding = 'utf-8')
+
+    def emit(record):
+        if telemetry_file is not None:
+            telemetry_file.write(json.dumps(record, ensure_ascii = False) + '\n')
+            telemetry_file.flush()
+
+    emit(OrderedDict([('type', 'stage'), ('stage', 'dicts'), ('seconds', round(stage_times['dicts'], 4))]))
+
+    print("XLS Directory set to: ", os.path.normpath(xlsDir))
+
     print("""
     \n1) Iterate through Excel directory 
     \n2) generate subdirectory (Participant num.) for given file 
@@ -190,439 +1185,331 @@ with change_dir(os.path.normpath(xls_dir)):
     \n7) return to base directory and repeat
     \n8 ) save csv of replacement/deletion counts
     """   
-        
-    # Create empty DataFrame for replace counts for each participant
-    df_replace_counts = pd.DataFrame()    
-   
-    # for each file in list of files in directory xls_dir...
-    for file in os.listdir(xls_dir):        
-        # Read Excel file as dictionary of Pandas DataFrames (data_xls) Key = sheet name
-        try:
-            data_xls = pd.read_excel(file, None)
-        except:
-            #print(sys.exc_info()[1])
-            #print('Unable to read {} {}'.format(file, type(file)))
-            print('{} skipped'.format(file))
-            break
-
-        #Extract/create Probe:CA dictionary
-        CA_dict = data_xls['Probe Schedule'].set_index('Probe').T.to_dict('records')[0]
-        
-        # Extract participant number from file name
-        name = file[:file.find('_')]
-        # Create new subdirectory to place csv files
+
+    # The journal and telemetry files are closed even if a stage fails
+    journal = None
+    try:
+        # Resume an interrupted run from its journal, or start a new journal
+        journal_path = os.path.join(info_dir, 'run_journal.jsonl')
+        completed = OrderedDict()
+        selection = None
+        if any(option is not None for option in [shard, participants, probes, sessions]):
+            selection = [list(shard) if shard is not None else None] + \
+                        [sorted(str(item) for item in option) if option is not None else None 
+                         for option in [participants, probes, sessions]]
+        if resume_run or selection is not None:
+            fingerprint = runFingerprint(dictsDir, selection)
+            completed = readJournal(journal_path, fingerprint) if resume_run else None
+            if completed is None:
+                completed = OrderedDict()
+                journal = open(journal_path, 'w', encoding = 'utf-8')
+                # config identifies the dictionaries and options shared by shards
+                journal.write(json.dumps({'type': 'header', 'fingerprint': fingerprint, 
+                                          'config': runFingerprint(dictsDir), 'selection': selection}) + '\n')
+            else:
+                journal = open(journal_path, 'a', encoding = 'utf-8')
+                print('Resuming run: {} workbooks already complete'.format(len(completed)))
+
+        def record(entry):
+            if journal is not None:
+                # Counts may be numpy scalars: item() keeps them int or float
+                journal.write(json.dumps(entry, ensure_ascii = False, default = lambda value: value.item()) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+
+        workbook_errors = []
+        # for each file in list of files in directory xlsDir...
+        for file in selectWorkbooks(os.listdir(xlsDir), shard, participants):
+            fpath = os.path.join(xlsDir, file)
+            stamp = workbookStamp(fpath)
+            entry = completed.get(file)
+            if entry is not None and entry['stamp'] == stamp:
+                stage_times.update(restoreWorkbook(entry, run_log))
+                emit(run_log['telemetry'][-1])
+                print(file, 'restored from journal')
+                continue
+            # Snapshot of run_log, to roll back a workbook that fails partway
+            before = snapshotRunLog(run_log)
+            try:
+                workbook_times = convertWorkbook(fpath, dicts, outDir, run_log, probes, sessions)
+                error = None if workbook_times is not None else 'Unable to read file'
+            except IllegalCharsError as e:
+                # validate_fail_fast stops the run. The workbook is journaled as 
+                # failed, so a resumed run converts it again
+                error = '{}: {}'.format(type(e).__name__, e)
+                rollbackWorkbook(run_log, before)
+                record(OrderedDict([('type', 'workbook'), ('workbook', file), ('stamp', stamp), ('status', 'error'), ('error', error)]))
+                emit(OrderedDict([('type', 'error'), ('workbook', file), ('error', error)]))
+                raise
+            except Exception as e:
+                workbook_times = None
+                error = '{}: {}'.format(type(e).__name__, e)
+            if workbook_times is None:
+                rollbackWorkbook(run_log, before)
+                workbook_errors.append([file, error])
+                record(OrderedDict([('type', 'workbook'), ('workbook', file), ('stamp', stamp), ('status', 'error'), ('error', error)]))
+                print(file, 'failed:', error)
+                continue
+            stage_times.update(workbook_times)
+            record(journalEntry(file, stamp, workbook_times, run_log, before))
+            emit(run_log['telemetry'][-1])
+        print("All files in directory complete")
+
+        # Replace post-processing errors itemized in replacements_table.csv. 
+        # csv is created if no workbook was converted
+        start = time.perf_counter()
+        os.makedirs(os.path.join(outDir, 'csv'), exist_ok = True)
+        replaced_rows = []
+        with enter_dir(os.path.dirname(os.path.normpath(dictsDir))):
+            post_counts = postProcessingReplacements(csvDir = os.path.join(outDir, 'csv'), replacedRows = replaced_rows)
+        # Check the rewritten rows, so illegal_chars_log matches the final csv files
+        post_illegal_chars = checkReplacedRows(replaced_rows, run_log) if phon_legal_chars is not None else []
+        updateIllegalCharsLog(run_log, post_illegal_chars)
+        stage_times['post'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        writeRunInfo(run_log, info_dir, workbook_errors, post_counts)
+        stage_times['info'] += time.perf_counter() - start
+        if journal is not None:
+            record({'type': 'complete', 'post_counts': dict(post_counts), 
+                    'illegal_chars_checked': phon_legal_chars is not None, 
+                    'post_illegal_chars': post_illegal_chars})
+
+        if telemetry:
+            for stage in ['post', 'info']:
+                emit(OrderedDict([('type', 'stage'), ('stage', stage), ('seconds', round(stage_times[stage], 4))]))
+            records = run_log['telemetry']
+            run_record = OrderedDict([('type', 'run'), ('workbooks', len(records))])
+            for key in ['sessions', 'rows', 'cells', 'bytes']:
+                run_record[key] = sum(record[key] for record in records)
+            for stage in ['dicts', 'read', 'rules', 'write', 'info', 'post']:
+                run_record[stage + '_s'] = round(stage_times[stage], 4)
+            run_record['total_s'] = round(sum(stage_times.values()), 4)
+            run_record['peak_rss_mb'] = peakRSS()
+            emit(run_record)
+            telemetrySummary(records, stage_times)
+    finally:
+        for log_file in [journal, telemetry_file]:
+            if log_file is not None:
+                log_file.close()
+    return stage_times
+
+
+def reduceShards(shardDirs, outDir = cwd, xlsDir = None):
+
+    """
+    Merges the output of sharded runs (see runConversion()) into outDir. Csv 
+    files are copied to outDir/csv, and the info files are rebuilt from the 
+    shard journals in the order a single run over xlsDir would have 
+    converted the workbooks, so the result is identical to a single-node run.
+
+    Parameters:
+        shardDirs : list of str. Output directories of the shards
+        outDir : str. Output directory
+        xlsDir : str. Directory of xls files, for the order of conversion. 
+            Default: order of file name
+
+    Returns int number of workbooks merged
+    """
+
+    entries = {}
+    errors = {}
+    shard_of = {}
+    post_counts = Counter()
+    post_illegal_chars = []
+    config = None
+    illegal_chars_checked = False
+    for shardDir in shardDirs:
+        with open(os.path.join(shardDir, 'info', 'run_journal.jsonl'), 'r', encoding = 'utf-8') as f:
+            journal = [json.loads(line) for line in f]
+        if journal[-1]['type'] != 'complete':
+            raise ValueError('Run in {} is not complete. Resume it before reducing'.format(shardDir))
+        if config is None:
+            config = journal[0]['config']
+        elif journal[0]['config'] != config:
+            raise ValueError('Run in {} used different dictionaries or options'.format(shardDir))
+        for entry in journal:
+            if entry['type'] != 'workbook':
+                continue
+            file = entry['workbook']
+            if shard_of.setdefault(file, shardDir) != shardDir:
+                raise ValueError('{} converted in both {} and {}'.format(file, shard_of[file], shardDir))
+            if entry['status'] == 'done':
+                entries[file] = entry
+                errors.pop(file, None)
+            else:
+                errors[file] = entry['error']
+                entries.pop(file, None)
+        post_counts.update(journal[-1]['post_counts'])
+        post_illegal_chars.extend(journal[-1].get('post_illegal_chars', []))
+        illegal_chars_checked = illegal_chars_checked or journal[-1]['illegal_chars_checked']
+
+    # Copy csv files of each shard
+    csv_dir = os.path.join(outDir, 'csv')
+    os.makedirs(csv_dir, exist_ok = True)
+    for shardDir in shardDirs:
+        shard_csv_dir = os.path.join(shardDir, 'csv')
+        if not os.path.isdir(shard_csv_dir) or os.path.samefile(shard_csv_dir, csv_dir):
+            continue
+        for fname in os.listdir(shard_csv_dir):
+            if fname.endswith('.csv'):
+                shutil.copyfile(os.path.join(shard_csv_dir, fname), os.path.join(csv_dir, fname))
+
+    # Replay workbooks in the order of a single run
+    files = os.listdir(xlsDir) if xlsDir is not None else []
+    files = [file for file in files if file in shard_of] + sorted(set(shard_of) - set(files))
+    run_log = newRunLog(frozenset() if illegal_chars_checked else None)
+    workbook_errors = []
+    for file in files:
+        if file in entries:
+            restoreWorkbook(entries[file], run_log)
+        else:
+            workbook_errors.append([file, errors[file]])
+    updateIllegalCharsLog(run_log, post_illegal_chars)
+    info_dir = os.path.join(outDir, 'info')
+    os.makedirs(info_dir, exist_ok = True)
+    writeRunInfo(run_log, info_dir, workbook_errors, post_counts)
+    print('{} workbooks from {} shards merged into {}'.format(len(entries), len(shardDirs), outDir))
+    return len(entries)
+
+
+def runVariants(xlsDir, variants, outDir = cwd, dictsDir = os.path.join(cwd, 'dicts'), participants = None, 
+                probes = None, sessions = None):
+
+    """
+    Converts every DPA xls file in xlsDir with several named sets of 
+    dictionaries, reading each workbook once, and saves one output directory 
+    (csv and info, as runConversion()) per variant in outDir/variants/name. 
+    Rule passes are run once for all variants whose dictionaries agree up to 
+    that pass, see ruleStages.
+
+    The first variant is the baseline. Every cell in which another variant 
+    differs from it is saved in that variant's info/variant_diff.csv, and a 
+    summary of all variants in outDir/variants/variant_summary.csv. 
+    Post-processing replacements (replacements_table.csv of dictsDir) are the 
+    same for all variants. Variant runs are not journaled or sharded.
+
+    Parameters:
+        xlsDir : str. Directory of xls files
+        variants : OrderedDict {variant name : directory of dictionary csv 
+            files}. Files missing from a variant directory are read from 
+            dictsDir, e.g. OrderedDict([('current', 'dicts'), 
+            ('new_targets', 'dicts_new_targets')])
+        outDir : str. Output directory. Default: script directory
+        dictsDir : str. Directory of dictionary csv files
+        participants, probes, sessions : see runConversion()
+
+    Returns DataFrame of the summary
+    """
+
+    stage_times = Counter()
+    start = time.perf_counter()
+    variant_dicts = OrderedDict((variant, loadDictionaries(variantDir, baseDir = dictsDir)) 
+                                for variant, variantDir in variants.items())
+    stage_times['dicts'] += time.perf_counter() - start
+    baseline = next(iter(variants))
+    phon_legal_chars = phonLegalChars()
+    run_logs = {variant: newRunLog(phon_legal_chars) for variant in variants}
+    out_dirs = {variant: os.path.join(outDir, 'variants', variant) for variant in variants}
+
+    print('Converting {} with dictionary variants: {}'.format(os.path.normpath(xlsDir), ', '.join(variants)))
+    workbook_errors = []
+    for file in selectWorkbooks(os.listdir(xlsDir), participants = participants):
+        before = {variant: snapshotRunLog(run_logs[variant]) for variant in variants}
         try:
-            os.makedirs(os.path.join(cwd,'csv'))
-            #print('Working with participant', name)
-        except WindowsError:
-            pass
-            #print('Working with participant', name)
-        
-        # Change to new subdirectory
-        with change_dir(os.path.join(cwd, 'csv')):
-            #print("Saving in directory: ", os.getcwd())
-            # Get list of sheets as xls_keys
-            xls_keys = list(data_xls.keys())
-            for sheet in data_xls:
-                # Define working Excel tab as DataFrame
-                df_sheet = data_xls[sheet]
-                
-                # Define counting dictionary for replacements in current DataFrame
-                sheet_rep_dict = Counter()
-                
-                # Skip Copyright and Probe schedule sheets
-                if sheet == 'Copyright':
-                    #print(name, "Copyright sheet excluded")
-                    continue         
-                if sheet == 'Probe Schedule':
-                    #print(name, "Probe Schedule sheet excluded")
-                    ### TODO get index of notes: accomplished with auxiliary.py
-                    continue
-                else:                                   
-                    # Iterate through DataFrame columns
-                    for col in df_sheet.columns:
-                        if col == 'Target':
-                            #print('Target skipped')
-                            continue
-                        ## Working with Word column (replacements)
-                        elif col =='Word':                            
-                            # Replace ' i' with "-i"
-                            cur_rep_count = df_sheet[col].str.count(u' i', re.UNICODE).sum()
-                            sheet_rep_dict[u' i Ortho'+u'_to_-i'] += cur_rep_count                            
-                            # replace all instances
-                            df_sheet[col] = df_sheet[col].str.replace(u' i', u'-i', re.UNICODE)
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} removed'.format(cur_rep_count, u'̹'))
-                                                            
-                            # Remove instances '\u0339' 
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = df_sheet[col].str.count(u'̹', re.UNICODE).sum()
-                            sheet_rep_dict[u'̹ Ortho'+u'_removed'] += cur_rep_count                            
-                            # replace all instances
-                            df_sheet[col] = df_sheet[col].str.replace(u'̹', u'', re.UNICODE)
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} removed'.format(cur_rep_count, u'̹'))
-                                                                                                                                                               
-                            # Replace 'ɑ' with 'a'
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = df_sheet[col].str.count(u'ɑ', re.UNICODE).sum()
-                            sheet_rep_dict[u'ɑ Ortho'+u'_to_'+u'a'] += cur_rep_count                            
-                            # replace all instances
-                            df_sheet[col] = df_sheet[col].str.replace(u'ɑ', u'a', re.UNICODE)
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} removed'.format(cur_rep_count, u'ɑ'))  
-                        
-                            # Replace ɢ in orthography with 'G'
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = df_sheet[col].str.count(u'ɢ', re.UNICODE).sum()
-                            sheet_rep_dict[u'ɢ Ortho'+u'_to_'+u'G'] += cur_rep_count                            
-                            # replace all instances
-                            df_sheet[col] = df_sheet[col].str.replace(u'ɢ', u'G', re.UNICODE)
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} replaced with {}'.format(cur_rep_count, u'ɢ', u'G'))                                                      
-                            
-                            # Replace '\r' with blank
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = df_sheet[col].str.count(u'\n', re.UNICODE).sum()
-                            sheet_rep_dict[u'\n Ortho'+u'_to_'+u''] += cur_rep_count                            
-                            # replace all instances
-                            df_sheet[col] = df_sheet[col].str.replace(u'\n', '', re.UNICODE)
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} removed'.format(cur_rep_count, u'new line'))
-                            
-                            # Replace 'thiers' with 'theirs'
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = df_sheet[col].str.count(r'^thiers$', re.UNICODE).sum()
-                            sheet_rep_dict[r'^thiers$'+u'_to_'+u'theirs'] += cur_rep_count                            
-                            # replace all instances
-                            df_sheet[col] = df_sheet[col].str.replace(r'^thiers$', u'theirs', re.UNICODE)
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} replaced with {}'.format(cur_rep_count, u'thiers', u'theirs'))
-                                
-                            # Replace 'moustach' with 'moustache'
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = df_sheet[col].str.count(r'^moustach$', re.UNICODE).sum()
-                            sheet_rep_dict[r'^moustach$'+u'_to_'+u'moustache'] += cur_rep_count                            
-                            # replace all instances
-                            df_sheet[col] = df_sheet[col].str.replace(r'^moustach$', u'moustache', re.UNICODE)
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} replaced with {}'.format(cur_rep_count, u'moustach', u'moustache'))                                                               
-
-                            # Replace 'loag' with 'loaf'
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = df_sheet[col].str.count(r'^loag$', re.UNICODE).sum()
-                            sheet_rep_dict[r'^loag$'+u'_to_'+u'loaf'] += cur_rep_count                            
-                            # replace all instances
-                            df_sheet[col] = df_sheet[col].str.replace(r'^loag$', u'loaf', re.UNICODE)
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} replaced with {}'.format(cur_rep_count, u'loag', u'loaf'))                                                                                                                                 
-                           
-                        else:                                               
-                            ## Working with current probe administration column
-                            
-                            ## Copy and work from copy of dataframe
-                            dfTrans = df_sheet[['Word', 'Target', col, ]]
-                            dfTrans.set_index('Word', drop=False, inplace=True)
-                            
-                            # Populate DI column (delayed/direct imitation) locating [] in cells.
-                            dfTrans['DI'] = np.where(dfTrans[col].str.contains(u'\[\]|□', re.UNICODE, regex=True).fillna(False), 1, '')
-                            
-                            # Number of Productions Tier
-                            # Multiple productions = when there is a 4 spaces + character not followed by spaces + ']'
-                            ## Changed to 5 spaces
-                            dfTrans['NumProductions'] = np.where(dfTrans[col].str.contains('    [^\s](?! *\])', regex=True).fillna(False), 1.0+dfTrans[col].str.count('    [^\s](?! *\])', re.UNICODE), '')                       
-                        
-                            # NR "denotes 'no response'" - new column entry (Notes
-                            dfTrans['Notes'] = np.where(dfTrans[col].str.contains(r'NR|ɴʀ', re.UNICODE, regex=True).fillna(False), 'No Response', "") 
-                            
-                            # Add participant number to metadata, participant tier, and name of file
-                            dfTrans['Speaker'] = name
-                            
-                            # Add Probe to new tier and to name of file
-                            dfTrans['Probe'] = sheet
-                            
-                            # Add Session to new tier and to name of file
-                            dfTrans['Session'] = col
-                            
-                            # Add CA from CA_Dict to new tier and to session metadata 
-                            try:
-                                dfTrans['CA'] = CA_dict[col]
-                            # Condition A and Condition B are not specified in column heading. Workaround follows:
-                            except KeyError:
-                                if ' A ' in sheet:
-                                    try:
-                                        dfTrans['CA'] = CA_dict['Cond A ' + col]
-                                    except KeyError:
-                                        dfTrans['CA'] = CA_dict['Ver A ' + col]
-                                if ' B ' in sheet:
-                                    try:
-                                        dfTrans['CA'] = CA_dict['Cond B ' + col]
-                                    except KeyError:
-                                        dfTrans['CA'] = CA_dict['Ver B ' + col]                                                                                                                                                                                                                               
-
-
-                            # Replace items from excludeListSpaces
-                            excludedList = []
-                            for item in excludeListSpaces:                             
-                                if len(dfTrans[dfTrans[col].astype(str).str.contains(item, regex=False)]) == 1:
-                                    excludedList.append(item)
-                                    # Get row index of item
-                                    rowIndex = dfTrans[dfTrans[col].astype(str).str.contains(item, regex=False)].index
-                                    # remove item from cell
-                                    dfTrans[col] = dfTrans[col].str.replace(item, '', regex=False)
-                                    # remove symbols around word
-                                    item = item.strip("'() ")
-                                    # replace item in word column
-                                    dfTrans.loc[rowIndex, 'Word'] = item
-                                   # Add Note
-                                    dfTrans.loc[rowIndex, 'Notes'] = f"Probe target '{rowIndex[0]}' but child produced '{item}'"                                    
-                                    # also replace item in index column
-                                    dfTrans.rename(index={rowIndex[0]:item},inplace=True)
-
-
-                            # Update unique word_list
-                            word_list = list(set(word_list+df_sheet['Word'].tolist()))
-                            
-                            # Populate IPA Target Tier with target_dict.csv
-                            dfTrans.set_index('Word', drop=False, inplace=True)
-                            dfTrans['IPA Target'] = pd.Series(target_dict, name='IPA Target')
-                            
-                            # Populate Notes Tier... other stuff?                                      
-                                    
-                            ######## Replacements applying to all data go here:
-                            ## 1. Replace delayed imitation notion
-                            ## 2. Replace miscellanous non-standard IPA characters
-                            ## 3. Replace compound segments
-                            ## 4. Replace most whitespaces (except multiple productions)
-                            ######################################
-                            ## Current logic:
-                            ## Identify initials only when at the beginning of a word
-                            ## All else are non-initials.
-                            ##
-                            ## 5. Replace initial superscript diacritics.
-                            ##    This i dones before non-initial diacritics 
-                            ##    because this is the special case. Non-initial
-                            ##    diacritics are assumed to be those that remain.
-                            ## 6. Repeat initial superscript diacritics 2 more
-                            ##    times to capture segments with multiple diacritics
-                            ## 7. Replace noninitial superscript diacritics
-                            ## 8. Duplicate multiple-production words
-                            
-                            # Replace [] and □ with blank
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = dfTrans[col].str.count('\[\]', re.UNICODE).sum()
-                            cur_rep_count += dfTrans[col].str.count('□', re.UNICODE).sum()
-                            sheet_rep_dict[u'\[\] or □'+u'_to_'+u''] += cur_rep_count                            
-                            # replace all instances of space ' {1,2}(?! )' with blank.
-                            dfTrans[col] = dfTrans[col].str.replace('\[\]', '', re.UNICODE)
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} removed'.format(cur_rep_count, '[]'))     
-                            
-                            # replace other translated segments other_chars_translate_dict.csv
-                            # Also addresses " line parsing error with extra return in cell. Possible solution: remove /n before creating csv
-                            # Also addresses removal of [] and some whitespaces
-                            for key in other_chars_dict:
-                                # cur_rep_count to track instances of replacements. In unicode
-                                cur_rep_count = dfTrans[col].str.count(six.text_type(key), re.UNICODE).sum()
-                                sheet_rep_dict[key+u'_to_'+ other_chars_dict[key]] += cur_rep_count             
-                                # replace all instances of dictionary key with corresponding value. In unicode
-                                dfTrans[col] = dfTrans[col].str.replace(six.text_type(key), six.text_type(other_chars_dict[key]), re.UNICODE)
-                                #if cur_rep_count > 0:
-                                    #print('************************************')
-                                    #print(u'{} instances of {} replaced with {}'.format(cur_rep_count, key, other_chars_dict[key]))    
-
-                            # Address combo segments
-                            for key in compounds_dict:
-                                # cur_rep_count to track instances of replacements. In unicode
-                                cur_rep_count = dfTrans[col].str.count(six.text_type(key), re.UNICODE).sum()
-                                sheet_rep_dict[key+u'_to_'+ compounds_dict[key]] += cur_rep_count             
-                                # replace all instances of dictionary key with corresponding value. In unicode
-                                dfTrans[col] = dfTrans[col].str.replace(six.text_type(key), six.text_type(compounds_dict[key]), re.UNICODE)
-                                #if cur_rep_count > 0:
-                                    #print('************************************')
-                                    #print(u'{} instances of {} replaced with {}'.format(cur_rep_count, key, compounds_dict[key]))    
-                            
-                            # Replace whitespaces, but leave space between multiple productions
-                            # Mask excluding cells with multiple productions (these white spaces should remain)
-                            mask = dfTrans.filter(['Word',col,'NumProductions'], axis=1).NumProductions == ''                           
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = dfTrans.loc[mask, col].str.count(' ', re.UNICODE).sum()
-                            sheet_rep_dict[u' '+u'_to_'+u''] += cur_rep_count                            
-                            # replace all instances of space ' ' with blank.
-                            dfTrans.loc[mask, col] = dfTrans.loc[mask, col].str.replace(' ', '', re.UNICODE) 
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} removed'.format(cur_rep_count, 'whitespace'))
-                                                                                                              
-                            # Replace single whitespaces in instances with multiple productions
-                            mask = dfTrans.filter(['Word',col,'NumProductions'], axis=1).NumProductions != ''
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = dfTrans.loc[mask, col].str.count(' {1,3}(?! )', re.UNICODE).sum()
-                            sheet_rep_dict[u' {1,3}(?! )'+u'_to_'+u''] += cur_rep_count                            
-                            # replace all instances of space ' {1,2}(?! )' with blank.
-                            dfTrans.loc[mask, col] = dfTrans.loc[mask, col].str.replace(' {1,3}(?! )', '', re.UNICODE)                             
-                            #if cur_rep_count > 0:
-                                #print('************************************')
-                                #print(u'{} instances of {} removed from records with multiple utterances'.format(cur_rep_count, 'whitespace'))                          
-
-                            ### Superscript replacement must occur after
-                            ### whitespace removal due to current regex used
-                            
-                            # replace superscripts superscript_dict_initial.csv                
-                            for key in superscript_dict_initial:
-                                # cur_rep_count to track instances of replacements. In unicode
-                                cur_rep_count = dfTrans[col].str.count(six.text_type(key), re.UNICODE).sum()
-                                sheet_rep_dict[key+u'_to_'+ superscript_dict_initial[key]] += cur_rep_count             
-                                # replace all instances of dictionary key with corresponding value. In unicode
-                                dfTrans[col] = dfTrans[col].str.replace(six.text_type(key), six.text_type(superscript_dict_initial[key]), re.UNICODE)                               
-                                #if cur_rep_count > 0:
-                                    #print('************************************')
-                                    #print(u'{} instances of {} (initial) replaced with {}'.format(cur_rep_count, key, superscript_dict_initial[key]))
-
-                            # replace superscripts superscript_dict_initial_2.csv                
-                            for key in superscript_dict_initial2:
-                                # cur_rep_count to track instances of replacements. In unicode
-                                cur_rep_count = dfTrans[col].str.count(six.text_type(key), re.UNICODE).sum()
-                                sheet_rep_dict[key+u'_to_'+ superscript_dict_initial2[key]] += cur_rep_count             
-                                # replace all instances of dictionary key with corresponding value. In unicode
-                                dfTrans[col] = dfTrans[col].str.replace(six.text_type(key), six.text_type(superscript_dict_initial2[key]), re.UNICODE)                               
-                                #if cur_rep_count > 0:
-                                    #print('************************************')
-                                    #print(u'{} instances of {} (initial) replaced with {}'.format(cur_rep_count, key, superscript_dict_initial2[key]))
-                                    
-                            # replace superscripts superscript_dict_initial_3.csv                
-                            for key in superscript_dict_initial3:
-                                # cur_rep_count to track instances of replacements. In unicode
-                                cur_rep_count = dfTrans[col].str.count(six.text_type(key), re.UNICODE).sum()
-                                sheet_rep_dict[key+u'_to_'+ superscript_dict_initial3[key]] += cur_rep_count             
-                                # replace all instances of dictionary key with corresponding value. In unicode
-                                dfTrans[col] = dfTrans[col].str.replace(six.text_type(key), six.text_type(superscript_dict_initial3[key]), re.UNICODE)                               
-                                #if cur_rep_count > 0:
-                                    #print('************************************')
-                                    #print(u'{} instances of {} (initial) replaced with {}'.format(cur_rep_count, key, superscript_dict_initial3[key]))
-                                     
-                            # replace superscripts superscript_dict_noninitial.csv                
-                            for key in superscript_dict_noninitial:
-                                # cur_rep_count to track instances of replacements. In unicode
-                                cur_rep_count = dfTrans[col].str.count(six.text_type(key), re.UNICODE).sum()
-                                sheet_rep_dict[key+u'_to_'+ superscript_dict_noninitial[key]] += cur_rep_count             
-                                # replace all instances of dictionary key with corresponding value. In unicode
-                                dfTrans[col] = dfTrans[col].str.replace(six.text_type(key), six.text_type(superscript_dict_noninitial[key]), re.UNICODE)                               
-                                #if cur_rep_count > 0:
-                                    #print('************************************')
-                                    #print(u'{} instances of {} (noninitial) replaced with {}'.format(cur_rep_count, key, superscript_dict_noninitial[key]))
-
-                            # Duplicate words in 'Word' column according to how many repetitions of the word are recorded                                          
-                            ########## Also, don't remove spaces in multiple words.
-                                                        
-                            # cur_rep_count to track instances of replacements. In unicode
-                            cur_rep_count = dfTrans['NumProductions'].str.count('2.0', re.UNICODE).sum()                            
-                            sheet_rep_dict[u'ortho x 2'] += cur_rep_count
-                            cur_rep_count = dfTrans['NumProductions'].str.count('3.0', re.UNICODE).sum()                            
-                            sheet_rep_dict[u'ortho x 3'] += cur_rep_count
-                            cur_rep_count = dfTrans['NumProductions'].str.count('4.0', re.UNICODE).sum()                            
-                            sheet_rep_dict[u'ortho x 4'] += cur_rep_count                                
-                            cur_rep_count = dfTrans['NumProductions'].str.count('5.0', re.UNICODE).sum()                            
-                            sheet_rep_dict[u'ortho x 5'] += cur_rep_count   
-                                                                                    
-                            # Multiply orthography instances by number of productions
-                            
-                            dfTrans['Orthography'] = dfTrans['Word']
-                            mask = dfTrans.filter(['Orthography',col,'NumProductions'], axis=1).NumProductions == '2.0'                            
-                            dfTrans.loc[mask, 'Orthography'] = dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']                            
-                            mask = dfTrans.filter(['Orthography',col,'NumProductions'], axis=1).NumProductions == '3.0'                            
-                            dfTrans.loc[mask, 'Orthography'] = dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']                             
-                            mask = dfTrans.filter(['Orthography',col,'NumProductions'], axis=1).NumProductions == '4.0'                            
-                            dfTrans.loc[mask, 'Orthography'] = dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']
-                            mask = dfTrans.filter(['Orthography',col,'NumProductions'], axis=1).NumProductions == '5.0'                            
-                            dfTrans.loc[mask, 'Orthography'] = dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']+' '+dfTrans.loc[mask, 'Orthography']\
-                            +' \ '+dfTrans.loc[mask, 'Orthography']
-                            
-                            # Multiply IPA Target instances by number of productions
-                            
-                            dfTrans['IPA Target_dup'] = dfTrans['IPA Target']
-                            mask = dfTrans.filter(['IPA Target_dup',col,'NumProductions'], axis=1).NumProductions == '2.0'                            
-                            dfTrans.loc[mask, 'IPA Target_dup'] = dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']                            
-                            mask = dfTrans.filter(['IPA Target_dup',col,'NumProductions'], axis=1).NumProductions == '3.0'                            
-                            dfTrans.loc[mask, 'IPA Target_dup'] = dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']                             
-                            mask = dfTrans.filter(['IPA Target_dup',col,'NumProductions'], axis=1).NumProductions == '4.0'                            
-                            dfTrans.loc[mask, 'IPA Target_dup'] = dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']
-                            mask = dfTrans.filter(['IPA Target_dup',col,'NumProductions'], axis=1).NumProductions == '5.0'                            
-                            dfTrans.loc[mask, 'IPA Target_dup'] = dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']+' '+dfTrans.loc[mask, 'IPA Target_dup']\
-                            +' \ '+dfTrans.loc[mask, 'IPA Target_dup']                                                                                                                                             
-                            
-                            # Change NumProductions column to integer type
-                            dfTrans['NumProductions'] = pd.to_numeric(
-                                    dfTrans['NumProductions'], 
-                                    downcast = 'integer')
-                            
-                            # Create DataFrame Series from replace counts for current column/probe administration
-                            probe_counts = pd.Series(sheet_rep_dict)
-                            # Add current column Series replace counts to DataFrame of counts for this participant
-                            df_replace_counts[col] = probe_counts
-                            df_replace_counts.rename(columns={col:name+' '+col}, inplace=True)
-                            #print(name, col, 'column complete.')
-
-                            
-                            ## Save CSV of transcription data for current probe administration
-                            # Change to new subdirectory
-                            with change_dir(os.path.join(cwd)):                                 
-                                # Create new subdirectory to place csv files
-                                try:
-                                    os.makedirs(os.path.join('csv'))
-                                    #print('Created:', os.path.join(os.getcwd(),'csv'))
-                                except WindowsError:
-                                    #print('saving to csv directory')
-                                    pass
-                                # Change to new subdirectory
-                                with change_dir(os.path.join(cwd, 'csv')):                                
-                                    dfTrans.filter(['Target','Orthography','IPA Target_dup', col, 'DI', 'Notes', 'NumProductions','Speaker', 'CA', 'Probe', 'Session'], axis=1).rename(columns={'IPA Target_dup':'IPA Target', col:'IPA Actual'}).to_csv(name + '_' + sheet + '_' + col + '.csv', encoding = 'utf-8', index = False)        
-            #print(name,sheet, "Done")
-        print(name, "Done")     
+            workbook_times = convertWorkbookVariants(os.path.join(xlsDir, file), variant_dicts, out_dirs, run_logs, 
+                                                     probes, sessions)
+            error = None if workbook_times is not None else 'Unable to read file'
+        except IllegalCharsError:
+            # validate_fail_fast stops the run
+            for variant in variants:
+                rollbackWorkbook(run_logs[variant], before[variant])
+            raise
+        except Exception as e:
+            workbook_times = None
+            error = '{}: {}'.format(type(e).__name__, e)
+        if workbook_times is None:
+            for variant in variants:
+                rollbackWorkbook(run_logs[variant], before[variant])
+            workbook_errors.append([file, error])
+            print(file, 'failed:', error)
+            continue
+        stage_times.update(workbook_times)
     print("All files in directory complete")
-                            
-    ## Save CSV of replacement counts
-    # Change to new subdirectory
-    with change_dir(os.path.join(cwd)):                                 
-        # Create new subdirectory to place csv files
-        try:
-            os.makedirs('info')
-            print('Created:', os.path.join(os.getcwd(),'info'))
-        except WindowsError:
-            print('info directory already found')
-        # Change to new subdirectory
-        with change_dir(os.path.join(cwd, 'info')):                                            
-                df_replace_counts.T.to_csv('replacement_counts.csv', encoding = 'utf-8')
-    print('\treplacement_counts.csv created')
-                            
-    ### Other features to implement in future:                     
-    # Add info from notes_dict to participant metadata/phon corpus, CA
-    # Add CA from CA_Dict to session metadata
-    # If participant_num in notes_dict, insert dictionary entry to notes Tier. Also add to corpus notes
-    # Check for errors against illegal characters key. Search for illegal characters in DataFrame. Create error log                                                                                                                                                                                                                                                                                    
-    
-    # Create csv of unique orthography items
-    with change_dir(os.path.join(cwd)):                                 
-        # Create new subdirectory to place csv file
-        try:
-            os.makedirs('info')
-            print('Created:', os.path.join(os.getcwd(),'info'))
-        except WindowsError:
-            print('info directory found')
-        # Change to new subdirectory
-        with change_dir(os.path.join(cwd, 'info')):                                            
-                pd.DataFrame(word_list).to_csv('word_list.csv', header = ['Orthography'], 
-                            encoding = 'utf-8', index = False)
-    print('\tword_list.csv created')
 
-# Replace post-processing errors itemized in replacements_table.csv
-replCounter = postProcessingReplacements(csvDir = 'csv')
+    for variant in variants:
+        start = time.perf_counter()
+        os.makedirs(os.path.join(out_dirs[variant], 'csv'), exist_ok = True)
+        replaced_rows = []
+        with enter_dir(os.path.dirname(os.path.normpath(dictsDir))):
+            post_counts = postProcessingReplacements(csvDir = os.path.join(out_dirs[variant], 'csv'), 
+                                                     replacedRows = replaced_rows)
+        if phon_legal_chars is not None:
+            updateIllegalCharsLog(run_logs[variant], checkReplacedRows(replaced_rows, run_logs[variant]))
+        stage_times['post'] += time.perf_counter() - start
+        start = time.perf_counter()
+        info_dir = os.path.join(out_dirs[variant], 'info')
+        os.makedirs(info_dir, exist_ok = True)
+        writeRunInfo(run_logs[variant], info_dir, workbook_errors, post_counts)
+        stage_times['info'] += time.perf_counter() - start
+
+    # Compare each variant with the baseline
+    summary = []
+    for variant, variantDir in variants.items():
+        # Rule passes run once for both variants
+        shared = 0
+        for stage, dict_key in ruleStages:
+            if dict_key is not None and variant_dicts[variant][dict_key] != variant_dicts[baseline][dict_key]:
+                break
+            shared += 1
+        df_diff = compareOutputs(out_dirs[baseline], out_dirs[variant], maxCells = sys.maxsize, verbose = False)
+        df_diff.to_csv(os.path.join(out_dirs[variant], 'info', 'variant_diff.csv'), encoding = 'utf-8', index = False)
+        csv_diff = df_diff[df_diff['File'].str.startswith('csv')]
+        summary.append([variant, os.path.normpath(variantDir), shared, 
+                        variant_dicts[variant]['target_dict'] == variant_dicts[baseline]['target_dict'], 
+                        df_diff['File'].nunique(), len(csv_diff[['File', 'Row']].drop_duplicates()), len(csv_diff)])
+    df_summary = pd.DataFrame(summary, columns = ['Variant', 'Dictionaries', 'Shared Rule Passes', 'Same Targets', 
+                                                  'Files Differing', 'Rows Differing', 'Cells Differing'])
+    df_summary.to_csv(os.path.join(outDir, 'variants', 'variant_summary.csv'), encoding = 'utf-8', index = False)
+    print('Differences from baseline variant {} (of {} rule passes):'.format(baseline, len(ruleStages)))
+    print(df_summary.to_string(index = False))
+    if telemetry:
+        telemetrySummary(run_logs[baseline]['telemetry'], stage_times)
+    return df_summary
+
+
+if __name__ == '__main__':
+    import argparse
+    if sys.argv[1:2] == ['reduce']:
+        parser = argparse.ArgumentParser(prog = 'dpa_script.py reduce', 
+                description = 'Merge the output of sharded runs into one output directory')
+        parser.add_argument('out', help = 'output directory')
+        parser.add_argument('shards', nargs = '+', help = 'output directories of the shards')
+        parser.add_argument('--xls', help = 'xls directory, for the order of conversion')
+        args = parser.parse_args(sys.argv[2:])
+        reduceShards(args.shards, args.out, args.xls)
+    else:
+        parser = argparse.ArgumentParser(description = 'Convert DPA xls files to Phon csv files')
+        parser.add_argument('xls', nargs = '?', default = xls_dir, help = 'xls directory')
+        parser.add_argument('--out', default = cwd, help = 'output directory')
+        parser.add_argument('--shard', help = 'convert shard INDEX/COUNT, e.g. 0/4')
+        parser.add_argument('--participants', help = 'convert only these participants, e.g. 0101,0102')
+        parser.add_argument('--probes', help = 'convert only these probe sheets, e.g. GFTA,PKP')
+        parser.add_argument('--sessions', help = 'convert only session columns matching these patterns, e.g. Pre,Post')
+        parser.add_argument('--variant', action = 'append', metavar = 'NAME=DIR', 
+                            help = 'dictionary variant, repeated for each variant (the first is the baseline)')
+        args = parser.parse_args()
+        # If preset directory is not present, get user input
+        if not os.path.isdir(args.xls):
+            args.xls = os.path.normpath(input('xls directory not found. Enter xls directory path: '))
+        shard = tuple(int(n) for n in args.shard.split('/')) if args.shard else None
+        participants, probes, sessions = [option.split(',') if option else None 
+                                          for option in [args.participants, args.probes, args.sessions]]
+        if args.variant:
+            if shard is not None:
+                parser.error('--variant cannot be combined with --shard')
+            runVariants(args.xls, OrderedDict(variant.split('=', 1) for variant in args.variant), args.out, 
+                        participants = participants, probes = probes, sessions = sessions)
+        else:
+            runConversion(args.xls, args.out, shard = shard, participants = participants, 
+                          probes = probes, sessions = sessions)
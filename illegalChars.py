@@ -11,55 +11,144 @@ import pandas as pd
 import os
 import io
 import sys
-import xml.etree.ElementTree as etree
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
+from functools import partial
 from six.moves import input
-from auxiliar import genRawCSV
+from auxiliar import genRawCSV, loadPhonLegalChars, readExcelSelection
+from auxiliar import selectFiles, selectSheet, selectCSV
 
 
-def illegalChars(csvType):    
-    assert csvType in ['raw', 'processed'], """
-    csvType must specify csv directory used in search. Specify:
-        'raw' for unmodified data in csv form prior to processing for Phon
+def scanFile(fpath, label, legalChars, maxSamples=5, chunkSize=1 << 20):
+
+    """
+    Counts every character in a text file, reading it in chunks of lines,
+    and records sample locations of characters not in legalChars.
+
+    Parameters:
+        fpath : str path to file, read as UTF-8
+        label : str used for the file in sample locations
+        legalChars : frozenset of legal characters
+        maxSamples : int. default 5. Locations kept per illegal character
+        chunkSize : int. Approximate number of bytes read per chunk
+
+    Returns tuple(Counter of characters, dict {char : [(label, line), ...]})
+    """
+
+    charCounter = Counter()
+    samples = {}
+    lineNum = 0
+    with io.open(fpath, mode='r', encoding='utf-8') as current_csv:
+        while True:
+            lines = current_csv.readlines(chunkSize)
+            if not lines:
+                break
+            chunkCounter = Counter(''.join(lines))
+            charCounter.update(chunkCounter)
+            # Only look for line numbers of illegal characters still
+            # needing samples
+            sampleChars = [char for char in chunkCounter
+                           if char not in legalChars
+                           and len(samples.get(char, ())) < maxSamples]
+            for i, line in enumerate(lines, lineNum + 1):
+                if not sampleChars:
+                    break
+                for char in sampleChars:
+                    if char in line:
+                        samples.setdefault(char, []).append((label, i))
+                sampleChars = [char for char in sampleChars
+                               if len(samples.get(char, ())) < maxSamples]
+            lineNum += len(lines)
+    return charCounter, samples
+
+
+def scanWorkbook(fpath, legalChars, maxSamples=5, cacheDir=None,
+                 probes=None, sessions=None):
+
+    """
+    Counts every character in the column names and string cells of the probe
+    sheets of a DPA xls file, without writing intermediate csv files, and
+    records sample locations of characters not in legalChars.
+
+    Parameters:
+        fpath : str path to xls file
+        legalChars : frozenset of legal characters
+        maxSamples : int. default 5. Locations kept per illegal character
+        cacheDir : str. default None. Parsed-workbook cache directory,
+            see auxiliar.readExcelCached()
+        probes, sessions : default None (all). Probe sheets and session
+            column patterns parsed and scanned, see
+            auxiliar.readExcelSelection()
+
+    Returns tuple(Counter of characters,
+                  dict {char : [('file/sheet/column', Excel row), ...]})
+    """
+
+    charCounter = Counter()
+    samples = {}
+    fname = os.path.basename(fpath)
+    data_xls = readExcelSelection(fpath, probes, sessions, cacheDir)
+    for sheet, dfSheet in data_xls.items():
+        # Exclude 'Copyright' and 'Probe Schedule' sheets as in genRawCSV()
+        if sheet == 'Copyright' or sheet == 'Probe Schedule':
+            continue
+        for col in dfSheet.columns:
+            label = '/'.join([fname, sheet, str(col)])
+            # Row 1 of the sheet is the header row
+            for i, value in enumerate([str(col)] + dfSheet[col].tolist(), 1):
+                if not isinstance(value, str):
+                    continue
+                charCounter.update(value)
+                for char in set(value) - legalChars:
+                    charSamples = samples.setdefault(char, [])
+                    if len(charSamples) < maxSamples:
+                        charSamples.append((label, i))
+    return charCounter, samples
+
+
+def illegalChars(csvType, processes=None, maxSamples=5, cacheDir=None,
+                 participants=None, probes=None, sessions=None):
+    assert csvType in ['raw', 'rawCSV', 'processed'], """
+    csvType must specify data used in search. Specify:
+        'raw' for unmodified data read directly from xls files in 'excel'
+        'rawCSV' for unmodified data in csv form prior to processing for Phon
         'processed' for Phon-ready csv generated by the main script"""
-    
+    # participants, probes (sheet names) and sessions (column patterns)
+    # restrict the files opened and the sheets and columns parsed. 'rawCSV'
+    # files hold every session of a probe, so sessions cannot apply to them
+    if csvType == 'rawCSV' and sessions is not None:
+        raise ValueError("sessions cannot be selected in 'rawCSV' files")
+
     # Set default directory to location of script
     os.chdir(os.path.dirname(sys.argv[0]))
-    cwd = os.getcwd()  
+    cwd = os.getcwd()
 
-    # Create contextmanager function that changes directory then returns to 
+    # Create contextmanager function that changes directory then returns to
     # original directory upon completion
-    
+
     @contextmanager
     def change_dir(newdir):
         prevdir = os.getcwd()
         try:
-            yield os.chdir(os.path.expanduser(newdir)) 
+            yield os.chdir(os.path.expanduser(newdir))
         finally:
             os.chdir(prevdir)
     """
     Steps to create list of characters illegal in Phon:
-    Create csv versions of excel files
-    iterate through every CSV DPA file
-        iterate through every row
-            skip first row
-                iterate through every column
-                create a list of every segment
-                turn list into a set
-    convert ipa.xml to a list of the values of char values
-    create a list of all the items in CSV set that do not occur in ipa.xml list
+    Create csv versions of excel files (csvType 'rawCSV' only)
+    load ipa.xml once as a frozenset of legal characters
+    scan every CSV DPA file in parallel, in chunks (or every xls file
+    directly for csvType 'raw')
+        count every character
+        record sample locations (file, line) of illegal characters
+    merge counts and samples into a report of illegal characters
     """
-    # Defined variables
-    csv_char_list = []
-    HTML_char_set = set()
-    Phon_legal_chars = []
-    csv_char_set = set()
-    illegal_chars = []
-    
+
     ### Create raw csv files if not in directory
 
-    if csvType == 'raw':
-        if os.path.isdir('rawCSV'):    
+    if csvType == 'rawCSV':
+        if os.path.isdir('rawCSV'):
             print("'rawCSV' folder found.")
         else:
             genRawCSV()
@@ -69,76 +158,95 @@ def illegalChars(csvType):
         else:
             sys.exit("No 'csv' folder found. First run dpa_script.py to generate processed csv files.")
 
-    # Preset xls_dir
-    xls_dir = os.path.join(cwd,r'excel')
-    
-    ### Use raw csv files and ipa.xml from Phon source code to 
-    ### generate list of illegal characters to be replaced    
+    # Get set of legal Phon characters from ipa.xml
+    ipaPath = os.path.join(cwd, 'files', 'ipa.xml')
+    if not os.path.isfile(ipaPath):
+        ipaDir = os.path.normpath(input('File ipa.xml not found. Enter directory containing ipa.xml: '))
+        ipaPath = os.path.join(ipaDir, 'ipa.xml')
+    Phon_legal_chars = loadPhonLegalChars(ipaPath)
+
+    ### Use raw csv files and ipa.xml from Phon source code to
+    ### generate list of illegal characters to be replaced
     if csvType == 'raw':
-        csvDir = 'rawCSV'
-    if csvType == 'processed':
-        csvDir = 'csv'
-    # csv directory
-    with change_dir(csvDir):   
+        # Search xls files directly, without writing 'rawCSV'
+        xls_dir = os.path.join(cwd, 'excel')
+        scan_files = [os.path.join(xls_dir, filename)
+                      for filename in selectFiles(sorted(os.listdir(xls_dir)),
+                                                  participants)
+                      if filename.endswith(('.xls', '.xlsx'))
+                      and not filename.startswith('~$')]
+        scan = partial(scanWorkbook, legalChars=Phon_legal_chars,
+                       maxSamples=maxSamples, cacheDir=cacheDir,
+                       probes=probes, sessions=sessions)
+        scan_args = [scan_files]
+        print('Searching all xls files in directory...')
+    else:
+        if csvType == 'rawCSV':
+            csvDir = 'rawCSV'
+        if csvType == 'processed':
+            csvDir = 'csv'
         # Create list of csv files in subdirectories
-        csv_files = [os.path.join(root, filename)
-                    for root, dirs, files in os.walk(os.getcwd())
-                    for filename in files
-                    if filename.endswith((".csv"))]
-        # Loop through files in directory
+        scan_files = [os.path.join(root, filename)
+                      for root, dirs, files in os.walk(os.path.join(cwd, csvDir))
+                      for filename in files
+                      if filename.endswith((".csv"))]
+        if csvType == 'rawCSV':
+            # rawCSV/####/probe.csv
+            scan_files = [fpath for fpath in scan_files
+                          if (participants is None or os.path.basename(
+                              os.path.dirname(fpath)) in map(str, participants))
+                          and selectSheet(os.path.splitext(
+                              os.path.basename(fpath))[0], probes)]
+        else:
+            scan_files = [fpath for fpath in scan_files
+                          if selectCSV(fpath, participants, probes, sessions)]
+        scan = partial(scanFile, legalChars=Phon_legal_chars,
+                       maxSamples=maxSamples)
+        scan_args = [scan_files, [os.path.relpath(fpath, os.path.join(cwd, csvDir))
+                                  for fpath in scan_files]]
         print('Searching all csv files in directory...')
-        for cur_csv in csv_files:
-            # open CSV file in read mode with UTF-8 encoding
-            with io.open(cur_csv, mode='r', encoding='utf-8') as current_csv:
-                # Create string variable from CSV
-                csv_str = current_csv.read()
-                # Create a list of all the characters in the string
-                for char in csv_str:
-                    csv_char_list
-                    csv_char_list.append(char)
-        # Create a set of all the unique characters csv_char_set
-        csv_char_set
-        csv_char_set = set(csv_char_list)
+    csv_char_counter = Counter()
+    samples = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for fileCounter, fileSamples in executor.map(scan, *scan_args,
+                                                     chunksize=8):
+            csv_char_counter.update(fileCounter)
+            for char, locations in fileSamples.items():
+                charSamples = samples.setdefault(char, [])
+                charSamples.extend(locations[:maxSamples-len(charSamples)])
     print('list of unique characters in dataset:')
-    for char in csv_char_set:
+    for char in csv_char_counter:
         print(char, end=' ')
-    
-    # Get list of legal Phon characters by extracting character element dictionaries from ipa.xml
-
-    if 'ipa.xml' not in os.listdir(os.path.join(cwd, r'files')):
-        dir = os.path.normpath(input('File ipa.xml not found. Enter directory containing ipa.xml: '))
-        with change_dir(os.path.normpath(dir)):
-            tree = etree.parse('ipa.xml')
-    else:    
-        tree = etree.parse(r'files\ipa.xml')
-    root = tree.getroot()
-    
-    # For each element in ipa.xml, extract the unicode value and add to new list
-    for char in root:
-        char_hex = list(char.attrib.values())
-        Phon_legal_chars.append(char_hex[0])
+
     print('\ncsv_char_set and Phon_legal_chars created')
     print('illegal Phon characters:')
-    for char in list(csv_char_set):
-        if char in Phon_legal_chars:
-            continue
-        else:
-            print(char, end=' ')
-            illegal_chars.append(char)
-            df_illegal_chars = pd.DataFrame(illegal_chars, columns = ['Illegal Characters'])
-                ## Save CSV of replacement tracker
-                # Change to new subdirectory
-    with change_dir(cwd):                                 
+    illegal_chars = [char for char, count in csv_char_counter.most_common()
+                     if char not in Phon_legal_chars]
+    for char in illegal_chars:
+        print(char, end=' ')
+    df_illegal_chars = pd.DataFrame({
+        'Illegal Characters': illegal_chars,
+        'Code Point': ['U+{:04X}'.format(ord(char)) for char in illegal_chars],
+        'Count': [csv_char_counter[char] for char in illegal_chars],
+        'Sample Locations': ['; '.join('{}:{}'.format(label, line)
+                for label, line in samples.get(char, []))
+                for char in illegal_chars]},
+        columns = ['Illegal Characters', 'Code Point', 'Count',
+                   'Sample Locations'])
+    ## Save CSV of illegal characters
+    with change_dir(cwd):
         # Create new subdirectory to place csv files
         try:
             os.makedirs('info')
             print('Created:', os.path.join(os.getcwd(),'info'))
-        except WindowsError:
+        except FileExistsError:
             print('\ninfo/ directory already created.')
         # Change to new subdirectory
-        with change_dir(os.path.join(cwd, 'info')):                                            
-                df_illegal_chars.to_csv('illegal_chars.csv', encoding = 'utf-8', index = False)       
+        with change_dir(os.path.join(cwd, 'info')):
+                df_illegal_chars.to_csv('illegal_chars.csv', encoding = 'utf-8', index = False)
     print('illegal_chars list created')
-    return
+    return df_illegal_chars
+
 
-illegalChars('processed')
\ No newline at end of file
+if __name__ == '__main__':
+    illegalChars('processed')
@@ -1,33 +1,290 @@
-# Simple script to open and merge all csv files in a single folder into a single
-# csv file. 
-### Note: Files must have same header structure
+# -*- coding: utf-8 -*-
+# Simple script to open and merge all csv files in a folder (and its
+# subfolders) into a single csv file.
+### Note: Files must have same header structure. Headers are checked before
+### merging by reading only the first line of each file.
+### Note: For files with different columns (e.g. rawCSV sessions), use
+### mergeCSV(..., schema='union')
 ### Note: Cannot set output directory to same folder as input directory
 
 import io
-import shutil
-import glob
-import csv
 import os
+import csv
+import shutil
+import gzip
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Block size for copying file bodies
+bufferSize = 1 << 20
+
+
+def listCSV(path, recursive=True):
+
+    """
+    Returns sorted list of paths of csv files in path, including
+    subdirectories if recursive.
+    """
+
+    if not recursive:
+        return sorted(os.path.join(path, fname) for fname in os.listdir(path)
+                      if fname.endswith('.csv'))
+    return sorted(os.path.join(root, fname)
+                  for root, dirs, files in os.walk(path)
+                  for fname in files if fname.endswith('.csv'))
+
+
+def readHeader(fpath):
+
+    """
+    Returns the first line of a file as bytes, without line ending.
+    """
+
+    with io.open(fpath, 'rb') as infile:
+        return infile.readline().rstrip(b'\r\n')
+
+
+def checkHeaders(fpaths, workers=None):
+
+    """
+    Reads the header line of every file, in parallel threads if workers is
+    given, and checks that all headers match the first file.
+
+    Raises ValueError listing files with a different header.
+
+    Returns header of first file as bytes
+    """
+
+    if workers:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            headers = list(executor.map(readHeader, fpaths))
+    else:
+        headers = [readHeader(fpath) for fpath in fpaths]
+    mismatched = [fpath for fpath, header in zip(fpaths, headers)
+                  if header != headers[0]]
+    if mismatched:
+        raise ValueError("Header differs from {} in {} files (use "
+                         "schema='union' to merge them):\n{}".format(
+                fpaths[0], len(mismatched), '\n'.join(mismatched)))
+    return headers[0]
+
+
+def unionHeaders(fpaths, workers=None):
+
+    """
+    Reads the header line of every file, in parallel threads if workers is
+    given, and builds the union of their columns in order of first
+    appearance.
+
+    Returns tuple(list of union columns, list of column lists per file)
+    """
+
+    if workers:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            headers = list(executor.map(readHeader, fpaths))
+    else:
+        headers = [readHeader(fpath) for fpath in fpaths]
+    fileColumns = [next(csv.reader([header.decode('utf-8-sig')]), [])
+                   for header in headers]
+    columns = []
+    seen = set()
+    for fileCols in fileColumns:
+        for col in fileCols:
+            if col not in seen:
+                seen.add(col)
+                columns.append(col)
+    return columns, fileColumns
+
+
+def _writeUnion(fpaths, fileColumns, columns, outfile):
+
+    """
+    Streams csv files row by row into outfile (opened in text mode),
+    reordering each file's columns to the union columns. Columns missing
+    from a file are left empty.
+    """
+
+    writer = csv.writer(outfile, lineterminator='\n')
+    writer.writerow(columns)
+    for fpath, fileCols in zip(fpaths, fileColumns):
+        position = {col: i for i, col in enumerate(fileCols)}
+        # Column-reorder map: index in file row for each union column
+        reorder = [position.get(col) for col in columns]
+        with io.open(fpath, 'r', encoding='utf-8-sig', newline='') as infile:
+            reader = csv.reader(infile)
+            next(reader, None)
+            for row in reader:
+                writer.writerow([row[i] if i is not None and i < len(row)
+                                 else '' for i in reorder])
+
+
+def _readBody(fpath):
+
+    """
+    Returns a file without its header line as bytes, ending with a newline.
+    """
+
+    with io.open(fpath, 'rb') as infile:
+        infile.readline()
+        body = infile.read()
+    if body and not body.endswith(b'\n'):
+        body += b'\n'
+    return body
+
+
+def _copyBody(fpath, outfile, useSendfile=False):
+
+    """
+    Block copies a file without its header line to outfile without parsing,
+    adding a final newline if missing. Uses os.sendfile if useSendfile.
+    """
+
+    with io.open(fpath, 'rb') as infile:
+        infile.readline()  # Throw away header
+        start = infile.tell()
+        size = os.fstat(infile.fileno()).st_size
+        if size == start:
+            return
+        offset = start
+        if useSendfile:
+            outfile.flush()
+            try:
+                while offset < size:
+                    sent = os.sendfile(outfile.fileno(), infile.fileno(),
+                                       offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+            except OSError:
+                # sendfile between regular files is not supported everywhere
+                pass
+        if offset < size:
+            infile.seek(offset)
+            shutil.copyfileobj(infile, outfile, bufferSize)
+        infile.seek(-1, os.SEEK_END)
+        if infile.read(1) != b'\n':
+            outfile.write(b'\n')
+
+
+def _mergeParquet(fpaths, columns, outPath):
+
+    """
+    Streams csv files into a single Parquet file, all columns as strings.
+    Columns are reordered to columns; columns missing from a file are left
+    empty. Requires pyarrow.
+    """
+
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+
+    convert = pacsv.ConvertOptions(
+            column_types={col: pa.string() for col in columns},
+            strings_can_be_null=False)
+    parse = pacsv.ParseOptions(newlines_in_values=True)
+    schema = pa.schema([(col, pa.string()) for col in columns])
+    with pq.ParquetWriter(outPath, schema) as writer:
+        for fpath in fpaths:
+            reader = pacsv.open_csv(fpath, parse_options=parse,
+                                    convert_options=convert)
+            for batch in reader:
+                table = pa.Table.from_batches([batch])
+                for col in columns:
+                    if col not in table.column_names:
+                        table = table.append_column(
+                                col, pa.array([''] * table.num_rows,
+                                              pa.string()))
+                writer.write_table(table.select(columns))
+
+
+def mergeCSV(path, outPath, recursive=True, compression=None, workers=None,
+             schema='strict'):
+
+    """
+    Merges all csv files in path into a single csv file at outPath. Headers
+    are checked first, then the rest of each file is block copied without
+    parsing, so memory use does not depend on the size of the files.
+
+    Parameters:
+        path : str. Directory of csv files
+        outPath : str. Path of merged output file
+        recursive : bool. default True. Include subdirectories of path
+        compression : str. default None.
+            'gzip' : write gzip compressed csv
+            'parquet' : write Parquet file (requires pyarrow)
+        workers : int. default None. Number of threads reading files in
+            parallel. None reads one file at a time.
+        schema : str. default 'strict'.
+            'strict' : all headers must match; bodies are block copied
+            'union' : output has the union of all columns; each file is
+                streamed row by row through a column-reorder map
+
+    Returns list of merged file paths
+    """
+
+    fpaths = [fpath for fpath in listCSV(path, recursive)
+              if os.path.abspath(fpath) != os.path.abspath(outPath)]
+    if not fpaths:
+        print('No csv files found in {}'.format(path))
+        return fpaths
+    assert schema in ['strict', 'union'], "schema must be 'strict' or 'union'"
+    if schema == 'union':
+        columns, fileColumns = unionHeaders(fpaths, workers)
+        print('{} csv files with {} columns in total found.'.format(
+                len(fpaths), len(columns)))
+    else:
+        header = checkHeaders(fpaths, workers)
+        columns = next(csv.reader([header.decode('utf-8-sig')]))
+        print('{} csv files with matching headers found.'.format(len(fpaths)))
+
+    if compression == 'parquet':
+        _mergeParquet(fpaths, columns, outPath)
+        print('{} created'.format(outPath))
+        return fpaths
+
+    if schema == 'union':
+        if compression == 'gzip':
+            outfile = gzip.open(outPath, 'wt', encoding='utf-8', newline='')
+        else:
+            outfile = io.open(outPath, 'w', encoding='utf-8', newline='')
+        with outfile:
+            _writeUnion(fpaths, fileColumns, columns, outfile)
+        print('{} created'.format(outPath))
+        return fpaths
 
-#import csv files from folder specified below
-path = os.path.normpath(input('Input CSV directory'))
+    if compression == 'gzip':
+        outfile = gzip.open(outPath, 'wb')
+    else:
+        outfile = io.open(outPath, 'wb')
+    with outfile:
+        # Header of first file, with its original line ending
+        with io.open(fpaths[0], 'rb') as infile:
+            outfile.write(infile.readline())
+        if workers:
+            # Read ahead up to 'workers' files while writing in order
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                for fpath in fpaths:
+                    pending.append(executor.submit(_readBody, fpath))
+                    if len(pending) >= workers:
+                        outfile.write(pending.popleft().result())
+                while pending:
+                    outfile.write(pending.popleft().result())
+        else:
+            useSendfile = compression is None and hasattr(os, 'sendfile')
+            for fpath in fpaths:
+                _copyBody(fpath, outfile, useSendfile)
+    print('{} created'.format(outPath))
+    return fpaths
 
-# save combined Master csv to folder specified below
-Master_path = os.path.normpath(input('Input combined CSV output directory')) 
 
-assert path != Master_path, "Cannot set output directory to same folder as input directory"
+if __name__ == '__main__':
+    #import csv files from folder specified below
+    path = os.path.normpath(input('Input CSV directory'))
 
-allFiles = glob.glob(path + "/*.csv")
-with io.open(Master_path+r'/'+path.split('\\')[-1]+'.csv', 'wb') as outfile:
-    print (outfile)
-    for i, fname in enumerate(glob.glob(path + "\*.csv")):
-        with io.open(fname, 'rb') as infile:
-            if i != 0:
-                infile.readline()  # Throw away header on all but first file
-            # Block copy rest of file from input to output without parsing
-            shutil.copyfileobj(infile, outfile)C:\Users\Philip\test1
-            print(fname + " has been imported.")
-    csv.writer(outfile)
+    # save combined Master csv to folder specified below
+    Master_path = os.path.normpath(input('Input combined CSV output directory'))
 
-    
+    assert path != Master_path, "Cannot set output directory to same folder as input directory"
 
+    mergeCSV(path, os.path.join(Master_path, os.path.basename(path) + '.csv'))
@@ -0,0 +1,497 @@
+# -*- coding: utf-8 -*-
+"""
+Catastrophic-backtracking check of the dictionary regexes.
+
+Every key of the regex dictionaries applied by dpa_script.py (and the
+patterns written into the script itself) is checked in two ways:
+    staticCheck() flags constructs that can backtrack super-linearly: nested
+        quantifiers, adjacent repeats that can match the same character,
+        repeated alternations with overlapping branches and leading repeats.
+    fuzzPattern() times the pattern on adversarial inputs of growing size
+        (long runs of the characters its repeats match, e.g. the spaces of a
+        multiple-production cell) and on real transcriptions, with a time
+        budget per input. Patterns whose time grows faster than the input,
+        or that exceed the budget, are flagged.
+
+Patterns are timed with the re module, which pandas uses for the
+replacements of dpa_script.py. The regex module backtracks differently (it
+has safeguards against some catastrophic patterns that re lacks), so it is
+only used to analyse patterns in staticCheck(). re cannot be interrupted,
+so patterns run in a worker process that is killed when an input exceeds
+the budget. See dpa_script.regex_timeout for the runtime per-cell guard.
+
+Usage:
+    regexCheck()                # writes info/regex_check.csv
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import io
+import csv
+import time
+import multiprocessing
+import pandas as pd
+import re as pyre
+import regex as re
+from regexPattern import tokenizeEntry, loadTranscriptions
+from regexPattern import _splitAtoms, _escapeEnd, _groupEnd
+
+# Dictionaries of regex keys in the order dpa_script.py applies them
+regexDicts = ['other_chars_translate_dict.csv', 'compounds_dict.csv',
+              'superscript_dict_initial.csv', 'superscript_dict_initial_2.csv',
+              'superscript_dict_initial_3.csv',
+              'superscript_dict_noninitial.csv']
+# Patterns written in dpa_script.py
+scriptPatterns = [(r'\[\]|□', ''), (r'    [^\s](?! *\])', ''), (r'NR|ɴʀ', ''),
+                  (r'\[\]', ''), (r' {1,3}(?! )', '')]
+
+# Adversarial input lengths. Time growing faster than length between the
+# last two sizes flags a pattern as super-linear.
+fuzzSizes = [1000, 4000, 16000]
+# Growth ratio allowed between sizes (4x longer input; linear time gives 4,
+# quadratic 16)
+maxGrowth = 8.0
+# Times below this (seconds) are too noisy to judge growth
+minTime = 0.002
+# Seconds allowed for the worker process to start and to answer, on top of
+# the budget
+workerGrace = 1.0
+
+
+def loadDictionaryPatterns(dictsDir='dicts'):
+
+    """
+    Returns list of (source, pattern, replacement) for every key of the regex
+    dictionaries in dictsDir (row 1 keys, row 2 values) and the patterns of
+    dpa_script.py.
+    """
+
+    patterns = []
+    for fname in regexDicts:
+        with io.open(os.path.join(dictsDir, fname), 'r', encoding='utf-8',
+                     newline='') as f:
+            reader = csv.reader(f)
+            keys = next(reader)
+            values = next(reader, [''] * len(keys))
+        patterns.extend((fname, key, value) for key, value in zip(keys, values)
+                        if key)
+    patterns.extend(('dpa_script.py', key, value)
+                    for key, value in scriptPatterns)
+    return patterns
+
+
+def _splitQuantifier(atom):
+
+    """
+    Returns tuple(base atom, quantifier) of a tokenized atom.
+    """
+
+    if atom.startswith('\\'):
+        end = _escapeEnd(atom, 0)
+    elif atom[:1] in ('(', '['):
+        end = _groupEnd(atom, 0)
+    else:
+        end = 1
+    return atom[:end], atom[end:]
+
+
+def _branches(pattern):
+
+    """
+    Returns list of the alternatives of pattern separated by '|' outside
+    any group.
+    """
+
+    branches = []
+    while True:
+        atoms, alternation = _splitAtoms(pattern)
+        branch = ''.join(atoms)
+        branches.append(branch)
+        if not alternation:
+            return branches
+        pattern = pattern[len(branch)+1:]
+
+
+def _hasQuantifier(pattern):
+
+    """
+    True if any atom of pattern, or of a group within it, is quantified.
+    """
+
+    for branch in _branches(pattern):
+        for atom in tokenizeEntry(branch):
+            base, quantifier = _splitQuantifier(atom)
+            if quantifier:
+                return True
+            if base.startswith('(') and _hasQuantifier(_groupInner(base)):
+                return True
+    return False
+
+
+def _groupInner(group):
+
+    """
+    Returns the pattern inside a group or lookaround, without its opening
+    '(?:', '(?=', '(?<!', '(?P<name>', etc.
+    """
+
+    inner = group[1:-1]
+    m = re.match(r'\?(?:P?<[^>=!]*>|<?[=!]|[:>|])', inner)
+    return inner[m.end():] if m else inner
+
+
+def _isRepeat(quantifier):
+
+    """
+    True if quantifier allows an unbounded number of repetitions.
+    """
+
+    return quantifier[:1] in ('*', '+') or \
+        bool(re.match(r'\{\d*,\}', quantifier))
+
+
+def _probeChars(pattern):
+
+    """
+    Returns the characters used to probe what an atom can match: whitespace,
+    ASCII letters and digits, and every character of the pattern.
+    """
+
+    return sorted(set(' \t\nabcxyzABC09.' + pattern))
+
+
+def _matchedChars(base, probe, partial=False):
+
+    """
+    Returns set of probe characters matched by base atom on its own (or
+    that can start a match, if partial), or None if base cannot be compiled
+    on its own.
+    """
+
+    try:
+        compiled = re.compile(base)
+    except re.error:
+        return None
+    return {char for char in probe
+            if compiled.fullmatch(char, partial=partial)}
+
+
+def staticCheck(pattern):
+
+    """
+    Flags constructs of a regex that can backtrack super-linearly.
+
+    Returns list of str warnings (empty if none found)
+    """
+
+    warnings = []
+    probe = _probeChars(pattern)
+    try:
+        branches = _branches(pattern)
+    except ValueError as e:
+        return ['unparsed: {}'.format(e)]
+    if len(branches) > 1:
+        return [w for branch in branches for w in staticCheck(branch)]
+    atoms = tokenizeEntry(pattern)
+
+    repeats = []
+    for i, atom in enumerate(atoms):
+        base, quantifier = _splitQuantifier(atom)
+        zeroWidth = base.startswith(('(?=', '(?!', '(?<=', '(?<!')) or \
+            base in ('^', '$', r'\b', r'\B', r'\A', r'\Z')
+        if base.startswith('(') and not zeroWidth:
+            inner = _groupInner(base)
+            if quantifier and _hasQuantifier(inner):
+                warnings.append('nested quantifier: {}'.format(atom))
+            innerBranches = _branches(inner)
+            if _isRepeat(quantifier) and len(innerBranches) > 1:
+                # First characters each branch can match
+                branchChars = [_matchedChars(
+                        '(?:' + branch + ')', probe, partial=True) or set()
+                        for branch in innerBranches]
+                for j, chars in enumerate(branchChars):
+                    if any(chars & other for other in branchChars[j+1:]):
+                        warnings.append('repeated overlapping alternation: {}'
+                                        .format(atom))
+                        break
+        if base.startswith(('(?<=', '(?<!')) and \
+                _hasQuantifier(_groupInner(base)):
+            warnings.append('variable-length lookbehind: {}'.format(atom))
+        if zeroWidth:
+            continue
+        if _isRepeat(quantifier) or quantifier[:1] == '?':
+            chars = _matchedChars(base, probe)
+            # Compare with the closest preceding optional or repeated atoms
+            for prevAtom, prevChars in repeats:
+                if chars and prevChars and chars & prevChars and \
+                        (_isRepeat(quantifier) or _isRepeat(
+                                _splitQuantifier(prevAtom)[1])):
+                    warnings.append('adjacent overlapping repeats: {}{}'
+                                    .format(prevAtom, atom))
+            if _isRepeat(quantifier) and i == 0:
+                warnings.append('leading repeat: {}'.format(atom))
+            repeats.append((atom, chars))
+        else:
+            repeats = []
+    return warnings
+
+
+def adversarialInputs(pattern, size):
+
+    """
+    Returns list of str inputs of about size characters likely to make
+    pattern backtrack: long runs of each character its repeated atoms can
+    match, followed by a character that matches nothing in the pattern, and
+    a multiple-production cell with long runs of spaces.
+    """
+
+    probe = _probeChars(pattern)
+    runChars = set(' ')
+    try:
+        atoms = [atom for branch in _branches(pattern)
+                 for atom in tokenizeEntry(branch)]
+    except ValueError:
+        atoms = []
+    for atom in atoms:
+        base, quantifier = _splitQuantifier(atom)
+        if quantifier:
+            chars = _matchedChars(base, probe) or set()
+            # One character per atom is enough to trigger backtracking
+            runChars.update(sorted(chars)[:2])
+    # A character unlikely to complete any match
+    stop = '\U0001F6AB'
+    inputs = []
+    for char in sorted(runChars):
+        inputs.append(char * size + stop)
+        # Runs interleaved with the pattern's literal prefix
+        literal = ''.join(a for a in atoms[:2] if len(a) == 1)
+        if literal:
+            inputs.append(literal + char * size + stop)
+            inputs.append((literal + char * 8) * (size // 9 + 1) + stop)
+    inputs.append(('ba' + ' ' * 16) * (size // 18 + 1) + stop)
+    return inputs
+
+
+def _reWorker(conn):
+
+    """
+    Worker process of fuzzPattern(), using the re module. Receives on conn:
+        ('compile', pattern) : answers ('ok', None) or ('error', message)
+        ('time', replacement, texts, budget) : for each text, answers ('ok',
+            best of 3 times of compiled.subn(replacement, text)), or ('ok',
+            time) of the first run over budget and skips the other texts,
+            or ('error', message) and skips the other texts
+    Stops on None.
+    """
+
+    compiled = None
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+        try:
+            if message[0] == 'compile':
+                compiled = pyre.compile(message[1])
+                conn.send(('ok', None))
+                continue
+            replacement, texts, budget = message[1:]
+            for text in texts:
+                # Best of 3 runs, to reduce noise in the growth ratio
+                seconds = []
+                for run in range(3):
+                    start = time.perf_counter()
+                    compiled.subn(replacement, text)
+                    seconds.append(time.perf_counter() - start)
+                    if seconds[-1] >= budget:
+                        break
+                conn.send(('ok', min(seconds) if seconds[-1] < budget
+                           else seconds[-1]))
+                if seconds[-1] >= budget:
+                    break
+        except Exception as e:
+            conn.send(('error', '{}: {}'.format(type(e).__name__, e)))
+
+
+def startWorker():
+
+    """
+    Starts a worker process timing patterns with the re module, for
+    fuzzPattern(). Returns dict with keys 'process' and 'conn'. Stop it with
+    stopWorker().
+    """
+
+    conn, workerConn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_reWorker, args=(workerConn,),
+                                      daemon=True)
+    process.start()
+    return {'process': process, 'conn': conn}
+
+
+def stopWorker(worker):
+
+    """
+    Stops a worker from startWorker(), killing it if it is busy.
+    """
+
+    if worker['process'].is_alive():
+        try:
+            worker['conn'].send(None)
+        except OSError:
+            pass
+        worker['process'].join(1)
+    if worker['process'].is_alive():
+        worker['process'].kill()
+        worker['process'].join()
+    worker['conn'].close()
+
+
+def _receive(worker, timeout):
+
+    """
+    Returns the next answer of worker. If none comes within timeout seconds,
+    the worker is killed and replaced by a new one (worker is updated in
+    place) and TimeoutError is raised.
+    """
+
+    if worker['conn'].poll(timeout):
+        return worker['conn'].recv()
+    worker['process'].kill()
+    worker['process'].join()
+    worker['conn'].close()
+    worker.update(startWorker())
+    raise TimeoutError
+
+
+def fuzzPattern(pattern, replacement='', texts=(), budget=0.05,
+                sizes=fuzzSizes, worker=None):
+
+    """
+    Times pattern.subn(replacement, text) with the re module on adversarial
+    inputs of each size and on every real text, with a time budget per
+    input. Single characters are matched literally, as pandas does.
+
+    Parameters:
+        pattern : str regex
+        replacement : str replacement template
+        texts : list of str real transcriptions
+        budget : float. Seconds allowed per input
+        sizes : list of int adversarial input lengths, increasing
+        worker : dict from startWorker(), reused across patterns. Default:
+            a worker is started and stopped for this pattern
+
+    Returns dict with keys 'status' ('ok', 'superlinear', 'timeout' or
+    'error'), 'seconds' (worst time), 'growth' (worst time ratio between the
+    last two sizes) and 'input' (repr of worst input, truncated)
+    """
+
+    if worker is None:
+        worker = startWorker()
+        try:
+            return fuzzPattern(pattern, replacement, texts, budget, sizes,
+                               worker)
+        finally:
+            stopWorker(worker)
+
+    result = {'status': 'ok', 'seconds': 0.0, 'growth': 0.0, 'input': ''}
+    worker['conn'].send(('compile', pyre.escape(pattern)
+                         if len(pattern) == 1 else pattern))
+    status, error = _receive(worker, workerGrace)
+    if status == 'error':
+        result.update(status='error', input=error)
+        return result
+
+    def timed(texts):
+        # Times of texts, run in the worker. A run over the budget cannot be
+        # interrupted: the worker is killed, and the input times out
+        worker['conn'].send(('time', replacement, texts, budget))
+        seconds = []
+        for text in texts:
+            try:
+                status, value = _receive(worker, 3 * budget + workerGrace)
+            except TimeoutError:
+                record(budget, text)
+                raise
+            if status == 'error':
+                raise ValueError(value)
+            record(value, text)
+            if value >= budget:
+                raise TimeoutError
+            seconds.append(value)
+        return seconds
+
+    def record(seconds, text):
+        if seconds >= result['seconds']:
+            result['seconds'] = seconds
+            result['input'] = repr(text[:40]) + ('...' if len(text) > 40
+                                                 else '')
+
+    try:
+        times = []
+        for size in sizes:
+            times.append(timed(adversarialInputs(pattern, size)))
+        if len(times) > 1:
+            for prev, last in zip(times[-2], times[-1]):
+                if last > minTime:
+                    result['growth'] = max(result['growth'],
+                                           last / max(prev, 1e-9))
+            if result['growth'] > maxGrowth:
+                result['status'] = 'superlinear'
+        timed(list(texts))
+    except TimeoutError:
+        result['status'] = 'timeout'
+    except ValueError as e:
+        result.update(status='error', input=str(e))
+    return result
+
+
+def regexCheck(dictsDir='dicts', csvDir='csv', budget=0.05, maxTexts=20000):
+
+    """
+    Runs staticCheck() and fuzzPattern() on every dictionary pattern and
+    saves the report as info/regex_check.csv. Real inputs are the IPA Target
+    and IPA Actual transcriptions of the csv files in csvDir, if any.
+
+    Parameters:
+        dictsDir : str. Dictionary directory
+        csvDir : str. Phon-ready csv directory used for real inputs
+        budget : float. Seconds allowed per pattern and input
+        maxTexts : int. Maximum number of real transcriptions used
+
+    Returns DataFrame with one row per pattern, flagged patterns first
+    """
+
+    texts = loadTranscriptions(csvDir)[:maxTexts] if os.path.isdir(csvDir) \
+        else []
+    print('Checking dictionary patterns against {} transcriptions...'
+          .format(len(texts)))
+    rows = []
+    worker = startWorker()
+    try:
+        for source, pattern, replacement in loadDictionaryPatterns(dictsDir):
+            warnings = staticCheck(pattern)
+            fuzz = fuzzPattern(pattern, replacement, texts, budget,
+                               worker=worker)
+            rows.append([source, pattern, '; '.join(warnings),
+                         fuzz['status'], fuzz['seconds'], fuzz['growth'],
+                         fuzz['input']])
+            if fuzz['status'] != 'ok':
+                print('{} {}: {}'.format(fuzz['status'], source, pattern))
+    finally:
+        stopWorker(worker)
+    df = pd.DataFrame(rows, columns=['Dictionary', 'Pattern', 'Warnings',
+                                     'Status', 'Seconds', 'Growth',
+                                     'Worst Input'])
+    df['Flagged'] = (df['Status'] != 'ok') | (df['Warnings'] != '')
+    df = df.sort_values(['Flagged', 'Seconds'], ascending=False,
+                        kind='mergesort').drop(columns='Flagged')
+    os.makedirs('info', exist_ok=True)
+    df.to_csv(os.path.join('info', 'regex_check.csv'), encoding='utf-8',
+              index=False)
+    print('{} of {} patterns flagged. Report saved to info/regex_check.csv'
+          .format(((df['Status'] != 'ok') | (df['Warnings'] != '')).sum(),
+                  len(df)))
+    return df
+
+
+if __name__ == '__main__':
+    regexCheck()
@@ -4,6 +4,10 @@ Created on Fri Jun  5 16:47:26 2020
 
 @author: Philip
 """
+import io
+import os
+import csv
+import timeit
 import regex as re
 
 def regexPattern(prefix = None, suffix = None, groups = None):
@@ -80,4 +84,306 @@ def elementwisePattern(between = None, frame = None, prefix = None, suffix = Non
     print(','.join(newEntriesList))
     return ','.join(newEntriesList)
 
-elementwisePattern(frame = '()', prefix = '(?<!̂)')
\ No newline at end of file
+
+# Quantifier following an atom: *, +, ?, {m}, {m,}, {m,n}, optionally lazy or
+# possessive
+_quantifier = re.compile(r'(?:[*+?]|\{\d*(?:,\d*)?\})[?+]?')
+_backreference = re.compile(r'\\(?:[1-9]|g<)')
+
+
+def _groupEnd(entry, i):
+
+    """
+    Returns index after the group or set opened at entry[i], skipping
+    escapes and nested groups and sets.
+    """
+
+    close = {'(': ')', '[': ']'}
+    stack = [entry[i]]
+    i += 1
+    if stack[0] == '[':
+        # A ']' first in a set (or after '^') is literal
+        if entry[i:i+1] == '^':
+            i += 1
+        if entry[i:i+1] == ']':
+            i += 1
+    while i < len(entry):
+        char = entry[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == close[stack[-1]]:
+            stack.pop()
+            if not stack:
+                return i + 1
+        elif char == '[':
+            stack.append(char)
+        elif char == '(' and stack[-1] == '(':
+            stack.append(char)
+        i += 1
+    raise ValueError('Unbalanced group or set in {}'.format(entry))
+
+
+def _escapeEnd(entry, i):
+
+    """
+    Returns index after the escape starting at entry[i].
+    """
+
+    m = re.match(r'\\(?:[pPNx]\{[^}]*\}|[pP][A-Za-z]|x[0-9A-Fa-f]{2}|'
+                 r'u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)', entry[i:], re.DOTALL)
+    return i + m.end()
+
+
+def _splitAtoms(entry):
+
+    """
+    Returns tuple(list of atoms of entry, True if entry has '|' outside any
+    group). Splitting stops at the first such '|'.
+    """
+
+    atoms = []
+    i = 0
+    while i < len(entry):
+        char = entry[i]
+        if char == '|':
+            return atoms, True
+        if char == '\\':
+            end = _escapeEnd(entry, i)
+        elif char in '([':
+            end = _groupEnd(entry, i)
+        else:
+            end = i + 1
+        m = _quantifier.match(entry, end)
+        if m and m.end() > end:
+            end = m.end()
+        atoms.append(entry[i:end])
+        i = end
+    return atoms, False
+
+
+def tokenizeEntry(entry):
+
+    """
+    Splits a regex entry into atoms: a literal character, an escape, a set,
+    a group or lookaround, or an anchor, each with its quantifier if any.
+    ''.join(atoms) == entry.
+
+    An entry with '|' outside any group is a single atom.
+
+    Returns list of str
+    """
+
+    atoms, alternation = _splitAtoms(entry)
+    if alternation:
+        return [entry]
+    return atoms
+
+
+def isDeterministic(atom):
+
+    """
+    True if atom can match in at most one way at a given position: an
+    unquantified literal, escape, set, anchor, lookaround, or group of such
+    atoms without alternation. Factoring a shared prefix of deterministic
+    atoms out of consecutive alternatives does not change what matches.
+    """
+
+    if _backreference.search(atom):
+        return False
+    if atom.startswith('('):
+        if atom.startswith(('(?=', '(?!', '(?<=', '(?<!')):
+            # Lookarounds are zero-width assertions
+            return atom.endswith(')')
+        if not atom.endswith(')') or atom.startswith('(?#'):
+            return False
+        inner = atom[1:-1]
+        if inner.startswith('?:'):
+            inner = inner[2:]
+        elif inner.startswith(('?P<', '?<')):
+            inner = inner[inner.index('>')+1:]
+        elif inner.startswith('?'):
+            # Inline flags, atomic groups, branch resets, etc.
+            return False
+        innerAtoms, alternation = _splitAtoms(inner)
+        return not alternation and all(isDeterministic(a) for a in innerAtoms)
+    # Quantified atoms end with a quantifier after their base atom
+    if atom.startswith('\\'):
+        return _escapeEnd(atom, 0) == len(atom)
+    if atom.startswith('['):
+        return _groupEnd(atom, 0) == len(atom)
+    return len(atom) == 1
+
+
+def _hasGroups(atoms):
+
+    """
+    True if any atom contains a capturing group.
+    """
+
+    return any(re.search(r'(?<!\\)\((?!\?)|\(\?P?<(?![=!])', atom)
+               for atom in atoms)
+
+
+def _buildTrie(atomLists):
+
+    """
+    Builds the prefix-factored alternatives of a list of atom lists.
+
+    Only consecutive entries starting with the same deterministic atom are
+    factored, so entries keep their order of priority.
+
+    Returns list of str alternatives
+    """
+
+    alternatives = []
+    i = 0
+    while i < len(atomLists):
+        atoms = atomLists[i]
+        j = i + 1
+        if atoms and isDeterministic(atoms[0]):
+            while j < len(atomLists) and atomLists[j][:1] == atoms[:1]:
+                j += 1
+        if j - i == 1:
+            alternatives.append(''.join(atoms))
+        else:
+            alternatives.append(atoms[0] + _joinAlternatives(
+                    _buildTrie([a[1:] for a in atomLists[i:j]]),
+                    any(_hasGroups(a[1:]) for a in atomLists[i:j])))
+        i = j
+    return alternatives
+
+
+def _joinAlternatives(alternatives, groups, top=False):
+
+    """
+    Joins alternatives into a group. Single characters are joined into a
+    set; alternatives with capturing groups into a branch reset group
+    (?|...), so every alternative numbers its groups from the same number.
+    """
+
+    if len(alternatives) == 1:
+        # Factored alternatives never have '|' outside a group
+        return alternatives[0]
+    if all(len(a) == 1 and a not in '\\[]^-.$|()' for a in alternatives) \
+            and len(set(alternatives)) == len(alternatives):
+        return '[' + ''.join(alternatives) + ']'
+    if groups:
+        return '(?|' + '|'.join(alternatives) + ')'
+    if top:
+        return '|'.join(alternatives)
+    return '(?:' + '|'.join(alternatives) + ')'
+
+
+def trieRegex(entries, prefix = None, suffix = None, groups = None):
+
+    """
+    Generates a prefix-factored regex from a list of entries. Equivalent to
+    the flat alternation '|'.join(entries) of regexPattern(), but shared
+    prefixes of consecutive entries (e.g. a lookbehind such as (?<!̂)) are
+    matched once instead of once per entry.
+
+    If entries contain capturing groups, alternatives are joined in branch
+    reset groups (?|...), so groups are numbered within each entry, e.g.
+    (?<!̂)(b)(ð) and (?<!̂)(k)(θ) both use \1 and \2.
+
+    Entries containing backreferences are joined without factoring.
+
+    Parameters:
+        entries: list of str
+        prefix, suffix, groups: as in regexPattern()
+
+    Requires regex as re
+
+    Returns pattern as str
+    """
+
+    entryList = []
+    for entry in entries:
+        if prefix != None:
+            entry = prefix + entry
+        if suffix != None:
+            entry = entry + suffix
+        if groups == 'capture':
+            entry = '('+entry+')'
+        if groups == 'noncapture':
+            entry = '(?:'+entry+')'
+        entryList.append(entry)
+    if any(_backreference.search(entry) for entry in entryList):
+        return r'|'.join(entryList)
+    atomLists = [tokenizeEntry(entry) for entry in entryList]
+    return _joinAlternatives(_buildTrie(atomLists),
+                             any(_hasGroups(atoms) for atoms in atomLists),
+                             top=True)
+
+
+def loadTranscriptions(csvDir = 'csv', columns = ['IPA Target', 'IPA Actual']):
+
+    """
+    Returns list of str transcriptions in columns of every csv file in csvDir
+    and its subdirectories (Phon-ready csv files from dpa_script.py).
+    """
+
+    texts = []
+    for root, dirs, files in os.walk(csvDir):
+        for fname in sorted(files):
+            if not fname.endswith('.csv'):
+                continue
+            with io.open(os.path.join(root, fname), 'r', encoding='utf-8',
+                         newline='') as f:
+                for row in csv.DictReader(f):
+                    texts.extend(row[col] for col in columns
+                                 if row.get(col))
+    return texts
+
+
+def verifyTrieRegex(entries, texts, flags = 0):
+
+    """
+    Checks that trieRegex(entries) finds the same matches as the flat
+    alternation '|'.join(entries) in every text, comparing finditer spans.
+
+    Parameters:
+        entries: list of str
+        texts: list of str, e.g. loadTranscriptions()
+        flags: regex flags for both patterns
+
+    Returns list of (text, flat spans, trie spans) for each text that differs
+    """
+
+    flat = re.compile(r'|'.join(entries), flags)
+    trie = re.compile(trieRegex(entries), flags)
+    mismatches = []
+    for text in texts:
+        flatSpans = [m.span() for m in flat.finditer(text)]
+        trieSpans = [m.span() for m in trie.finditer(text)]
+        if flatSpans != trieSpans:
+            mismatches.append((text, flatSpans, trieSpans))
+    print('{} of {} texts differ'.format(len(mismatches), len(texts)))
+    return mismatches
+
+
+def benchmarkTrieRegex(entries, texts, flags = 0, number = 3):
+
+    """
+    Times finditer over all texts with the flat alternation and with
+    trieRegex(entries).
+
+    Returns tuple(flat seconds, trie seconds) per run
+    """
+
+    flat = re.compile(r'|'.join(entries), flags)
+    trie = re.compile(trieRegex(entries), flags)
+    text = '\n'.join(texts)
+    flatTime = timeit.timeit(lambda: sum(1 for m in flat.finditer(text)),
+                             number=number) / number
+    trieTime = timeit.timeit(lambda: sum(1 for m in trie.finditer(text)),
+                             number=number) / number
+    print('{} entries, {} characters: flat {:.3f} s, trie {:.3f} s '
+          '({:.1f}x)'.format(len(entries), len(text), flatTime, trieTime,
+                             flatTime/trieTime))
+    return flatTime, trieTime
+
+
+if __name__ == '__main__':
+    elementwisePattern(frame = '()', prefix = '(?<!̂)')
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""
+Golden-output regression check of the DPA conversion.
+
+Runs the current pipeline (a git revision, HEAD by default) and a candidate
+pipeline (the working tree by default) on the same xls files, for example
+the workbooks of syntheticDPA.py, and compares their output:
+    csv/*.csv                       row by row, in order
+    info/replacement_counts.csv     row by row, matched by session
+    info/word_list.csv              as a set (its order is not defined)
+
+Identical files are recognised by their hash alone. Rows of other files are
+compared by per-row hashes, and the first differing cells are reported.
+
+checkFailFast() checks that validate_fail_fast stops a run at the first
+illegal character, checkReduce() that sharded runs merged with
+reduceShards() give the output of a single run, and checkResume() that an
+interrupted run resumed from its journal does.
+
+Usage:
+    regressionCheck('synthetic/excel')          # HEAD against working tree
+    compareOutputs('golden', 'candidate')       # two existing output dirs
+    checkFailFast('synthetic/excel')
+    checkReduce('synthetic/excel')
+    checkResume('synthetic/excel')
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import io
+import sys
+import csv
+import json
+import shutil
+import hashlib
+import tempfile
+import subprocess
+import pandas as pd
+from xml.sax.saxutils import quoteattr
+
+# Output files compared besides csv/*.csv, with how rows are matched
+infoFiles = [(os.path.join('info', 'replacement_counts.csv'), 'keyed'),
+             (os.path.join('info', 'word_list.csv'), 'unordered')]
+
+# Runs dpa_script.runConversion() of the tree in argv[1]
+runnerCode = """
+import os, sys
+treeDir, xlsDir, outDir = sys.argv[1:4]
+sys.path.insert(0, treeDir)
+sys.argv[0] = os.path.join(treeDir, 'dpa_script.py')
+import dpa_script
+dpa_script.runConversion(xlsDir, outDir = outDir)
+"""
+
+# Runs one step of a sharded or resumed run of the tree in argv[1]: argv[4]
+# is a shard 'index/count', 'reduce' to merge the shard directories in
+# argv[5:], 'interrupt' to stop (exit status 3) as workbook argv[5] + 1
+# starts, or 'resume'
+stepCode = """
+import os, sys
+treeDir, xlsDir, outDir, step = sys.argv[1:5]
+sys.path.insert(0, treeDir)
+sys.argv[0] = os.path.join(treeDir, 'dpa_script.py')
+import dpa_script
+if step == 'reduce':
+    dpa_script.reduceShards(sys.argv[5:], outDir, xlsDir)
+elif step == 'interrupt':
+    convertWorkbook = dpa_script.convertWorkbook
+    calls = []
+    def interrupted(*args, **kwargs):
+        calls.append(args[0])
+        if len(calls) > int(sys.argv[5]):
+            raise KeyboardInterrupt
+        return convertWorkbook(*args, **kwargs)
+    dpa_script.convertWorkbook = interrupted
+    try:
+        dpa_script.runConversion(xlsDir, outDir = outDir)
+    except KeyboardInterrupt:
+        sys.exit(3)
+elif step == 'resume':
+    dpa_script.resume_run = True
+    dpa_script.runConversion(xlsDir, outDir = outDir)
+else:
+    shard = tuple(int(n) for n in step.split('/'))
+    dpa_script.runConversion(xlsDir, outDir = outDir, shard = shard)
+"""
+
+# Runs it with validate_fail_fast and the ipa.xml in argv[4]. Exit status 3
+# if the run stopped with IllegalCharsError
+failFastCode = """
+import os, sys
+treeDir, xlsDir, outDir, ipaPath = sys.argv[1:5]
+sys.path.insert(0, treeDir)
+sys.argv[0] = os.path.join(treeDir, 'dpa_script.py')
+import dpa_script
+dpa_script.validate_ipa = True
+dpa_script.validate_fail_fast = True
+dpa_script.ipa_xml_path = ipaPath
+try:
+    dpa_script.runConversion(xlsDir, outDir = outDir)
+except dpa_script.IllegalCharsError as e:
+    print(e)
+    sys.exit(3)
+"""
+
+
+def fileDigest(fpath, blockSize=1 << 20):
+
+    """
+    Returns BLAKE2 hex digest of a file, read in blocks.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    with io.open(fpath, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def readRows(fpath):
+
+    """
+    Returns tuple(header, list of (row hash, row)) of a csv file.
+    """
+
+    with io.open(fpath, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        rows = [(hashlib.blake2b('\x1f'.join(row).encode('utf-8'),
+                                 digest_size=8).digest(), row)
+                for row in reader]
+    return header, rows
+
+
+def _cell(row, i):
+    return row[i] if i is not None and i < len(row) else None
+
+
+def diffCSV(goldenPath, candidatePath, match='ordered', maxCells=10):
+
+    """
+    Compares two csv files row by row using per-row hashes.
+
+    Parameters:
+        goldenPath, candidatePath : str paths
+        match : str. How rows are matched
+            'ordered' : by position
+            'keyed' : by the value of the first column
+            'unordered' : as sets of rows
+        maxCells : int. Maximum number of differences reported
+
+    Returns list of (row, column, golden value, candidate value). Rows are
+    numbered from 1 after the header (or the key, for 'keyed'); a missing
+    row or cell is None.
+    """
+
+    goldenHeader, goldenRows = readRows(goldenPath)
+    candidateHeader, candidateRows = readRows(candidatePath)
+    diffs = []
+    if goldenHeader != candidateHeader:
+        for col in goldenHeader + candidateHeader:
+            if (col in goldenHeader) != (col in candidateHeader):
+                diffs.append(('header', col,
+                              col if col in goldenHeader else None,
+                              col if col in candidateHeader else None))
+    # Align candidate columns to golden columns by name
+    position = {col: i for i, col in enumerate(candidateHeader)}
+    columns = [(col, i, position.get(col))
+               for i, col in enumerate(goldenHeader)]
+    sameLayout = goldenHeader == candidateHeader
+
+    def rowDiffs(label, goldenRow, candidateRow):
+        for col, i, j in columns:
+            if _cell(goldenRow, i) != _cell(candidateRow, j):
+                diffs.append((label, col, _cell(goldenRow, i),
+                              _cell(candidateRow, j)))
+                if len(diffs) >= maxCells:
+                    return
+
+    if match == 'unordered':
+        goldenSet = {h for h, row in goldenRows}
+        candidateSet = {h for h, row in candidateRows}
+        for h, row in goldenRows:
+            if h not in candidateSet:
+                diffs.append(('only golden', goldenHeader[0], row[0], None))
+        for h, row in candidateRows:
+            if h not in goldenSet:
+                diffs.append(('only candidate', goldenHeader[0], None, row[0]))
+        return diffs[:maxCells]
+    if match == 'keyed':
+        candidateByKey = {row[0]: (h, row) for h, row in candidateRows if row}
+        goldenKeys = set()
+        for h, row in goldenRows:
+            key = row[0] if row else ''
+            goldenKeys.add(key)
+            other = candidateByKey.get(key)
+            if other is None:
+                diffs.append((key, goldenHeader[0], key, None))
+            elif not sameLayout or other[0] != h:
+                rowDiffs(key, row, other[1])
+            if len(diffs) >= maxCells:
+                return diffs[:maxCells]
+        for key in candidateByKey:
+            if key not in goldenKeys:
+                diffs.append((key, goldenHeader[0], None, key))
+        return diffs[:maxCells]
+    for n in range(max(len(goldenRows), len(candidateRows))):
+        golden = goldenRows[n] if n < len(goldenRows) else (None, [])
+        candidate = candidateRows[n] if n < len(candidateRows) else (None, [])
+        if sameLayout and golden[0] == candidate[0]:
+            continue
+        rowDiffs(n + 1, golden[1], candidate[1])
+        if len(diffs) >= maxCells:
+            break
+    return diffs[:maxCells]
+
+
+def compareOutputs(goldenDir, candidateDir, maxCells=10, verbose=True):
+
+    """
+    Compares the csv directory and info files of two conversion outputs.
+
+    Parameters:
+        goldenDir, candidateDir : str. Output directories (containing 'csv'
+            and 'info')
+        maxCells : int. Maximum number of differences reported per file
+        verbose : bool. default True. Print the first difference of each file
+
+    Returns DataFrame of differences with columns File, Row, Column,
+    Golden, Candidate (empty if the outputs match)
+    """
+
+    files = []
+    csvFiles = set()
+    for outDir in [goldenDir, candidateDir]:
+        csvDir = os.path.join(outDir, 'csv')
+        if os.path.isdir(csvDir):
+            csvFiles.update(fname for fname in os.listdir(csvDir)
+                            if fname.endswith('.csv'))
+    files += [(os.path.join('csv', fname), 'ordered')
+              for fname in sorted(csvFiles)]
+    files += infoFiles
+
+    rows = []
+    identical = 0
+    for relPath, match in files:
+        goldenPath = os.path.join(goldenDir, relPath)
+        candidatePath = os.path.join(candidateDir, relPath)
+        goldenExists = os.path.isfile(goldenPath)
+        candidateExists = os.path.isfile(candidatePath)
+        if not goldenExists or not candidateExists:
+            rows.append([relPath, 'file', None,
+                         relPath if goldenExists else None,
+                         relPath if candidateExists else None])
+            continue
+        if os.path.getsize(goldenPath) == os.path.getsize(candidatePath) and \
+                fileDigest(goldenPath) == fileDigest(candidatePath):
+            identical += 1
+            continue
+        fileDiffs = diffCSV(goldenPath, candidatePath, match, maxCells)
+        if not fileDiffs:
+            # Same content, e.g. word list in another order
+            identical += 1
+        rows.extend([relPath] + list(diff) for diff in fileDiffs)
+    df = pd.DataFrame(rows, columns=['File', 'Row', 'Column', 'Golden',
+                                     'Candidate'])
+    differing = df['File'].nunique()
+    print('{} files identical, {} differ'.format(identical, differing))
+    if not verbose:
+        return df
+    for relPath, dfFile in df.groupby('File', sort=False):
+        first = dfFile.iloc[0]
+        print('  {}: row {}, column {}: {!r} -> {!r}'.format(
+                relPath, first['Row'], first['Column'], first['Golden'],
+                first['Candidate']))
+    return df
+
+
+def runPipeline(treeDir, xlsDir, outDir):
+
+    """
+    Runs dpa_script.runConversion() of the source tree treeDir on xlsDir in a
+    separate process, writing to outDir. Python's hash seed is fixed so that
+    both pipelines list words in the same order.
+    """
+
+    os.makedirs(outDir, exist_ok=True)
+    env = dict(os.environ, PYTHONHASHSEED='0')
+    subprocess.run([sys.executable, '-c', runnerCode, os.path.abspath(treeDir),
+                    os.path.abspath(xlsDir), os.path.abspath(outDir)],
+                   check=True, env=env, stdout=subprocess.DEVNULL)
+
+
+def runStep(treeDir, xlsDir, outDir, step, *args):
+
+    """
+    Runs one step of stepCode (see above) of the source tree treeDir in a
+    separate process, as runPipeline(). Returns the exit status.
+    """
+
+    os.makedirs(outDir, exist_ok=True)
+    env = dict(os.environ, PYTHONHASHSEED='0')
+    return subprocess.run([sys.executable, '-c', stepCode,
+                           os.path.abspath(treeDir), os.path.abspath(xlsDir),
+                           os.path.abspath(outDir), step] + list(args),
+                          env=env, stdout=subprocess.DEVNULL).returncode
+
+
+def checkReduce(xlsDir, shards=2, candidateDir=None):
+
+    """
+    Runs the candidate pipeline on xlsDir once, and again as shards merged
+    with reduceShards(), and compares the two outputs. Use workbooks whose
+    session labels repeat across sheets (syntheticDPA.py does by default),
+    so that replacement counts with repeated column labels are covered.
+
+    Parameters:
+        xlsDir : str. Directory of xls files
+        shards : int. Number of shards
+        candidateDir : str. Source tree. Default: this directory
+
+    Returns DataFrame of differences (empty if the outputs match)
+    """
+
+    if candidateDir is None:
+        candidateDir = os.path.dirname(os.path.abspath(__file__))
+    workDir = tempfile.mkdtemp(prefix='dpa_reduce_')
+    try:
+        singleDir = os.path.join(workDir, 'single')
+        runPipeline(candidateDir, xlsDir, singleDir)
+        shardDirs = [os.path.join(workDir, 'shard{}'.format(i))
+                     for i in range(shards)]
+        for i, shardDir in enumerate(shardDirs):
+            runStep(candidateDir, xlsDir, shardDir, '{}/{}'.format(i, shards))
+        reducedDir = os.path.join(workDir, 'reduced')
+        runStep(candidateDir, xlsDir, reducedDir, 'reduce', *shardDirs)
+        df = compareOutputs(singleDir, reducedDir)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    print('PASS' if df.empty else 'FAIL: reduced output differs from a '
+          'single run')
+    return df
+
+
+def checkResume(xlsDir, completed=2, candidateDir=None):
+
+    """
+    Runs the candidate pipeline on xlsDir once, and again stopped after
+    completed workbooks and resumed from its journal, and compares the two
+    outputs. As for checkReduce(), use workbooks whose session labels repeat
+    across sheets.
+
+    Parameters:
+        xlsDir : str. Directory of xls files, with more than completed
+            workbooks
+        completed : int. Workbooks converted before the run is stopped
+        candidateDir : str. Source tree. Default: this directory
+
+    Returns DataFrame of differences (empty if the outputs match)
+    """
+
+    if candidateDir is None:
+        candidateDir = os.path.dirname(os.path.abspath(__file__))
+    workDir = tempfile.mkdtemp(prefix='dpa_resume_')
+    try:
+        singleDir = os.path.join(workDir, 'single')
+        runPipeline(candidateDir, xlsDir, singleDir)
+        resumedDir = os.path.join(workDir, 'resumed')
+        stopped = runStep(candidateDir, xlsDir, resumedDir, 'interrupt',
+                          str(completed)) == 3
+        runStep(candidateDir, xlsDir, resumedDir, 'resume')
+        df = compareOutputs(singleDir, resumedDir)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    if not stopped:
+        print('FAIL: the run was not interrupted')
+        return df
+    print('PASS' if df.empty else 'FAIL: resumed output differs from a '
+          'single run')
+    return df
+
+
+def regressionCheck(xlsDir, goldenRevision='HEAD', candidateDir=None,
+                    goldenDir=None, maxCells=10, keep=False):
+
+    """
+    Runs the golden and candidate pipelines on xlsDir and compares their
+    output. The report is saved as info/regression_report.csv.
+
+    Parameters:
+        xlsDir : str. Directory of xls files
+        goldenRevision : str. git revision of the golden pipeline, checked
+            out in a temporary worktree. Ignored if goldenDir is given
+        candidateDir : str. Source tree of the candidate pipeline. Default:
+            this directory (working tree)
+        goldenDir : str. Existing golden output directory, instead of
+            running goldenRevision
+        maxCells : int. Maximum number of differences reported per file
+        keep : bool. default False. Keep the temporary output directories
+
+    Returns DataFrame of differences (empty if the outputs match)
+    """
+
+    repoDir = os.path.dirname(os.path.abspath(__file__))
+    if candidateDir is None:
+        candidateDir = repoDir
+    workDir = tempfile.mkdtemp(prefix='dpa_regression_')
+    worktree = None
+    try:
+        if goldenDir is None:
+            worktree = os.path.join(workDir, 'golden_tree')
+            subprocess.run(['git', '-C', repoDir, 'worktree', 'add',
+                            '--detach', worktree, goldenRevision], check=True,
+                           stdout=subprocess.DEVNULL)
+            goldenDir = os.path.join(workDir, 'golden')
+            print('Running golden pipeline ({})...'.format(goldenRevision))
+            runPipeline(worktree, xlsDir, goldenDir)
+        candidateOut = os.path.join(workDir, 'candidate')
+        print('Running candidate pipeline ({})...'.format(candidateDir))
+        runPipeline(candidateDir, xlsDir, candidateOut)
+        df = compareOutputs(goldenDir, candidateOut, maxCells)
+    finally:
+        if worktree is not None:
+            subprocess.run(['git', '-C', repoDir, 'worktree', 'remove',
+                            '--force', worktree])
+        if keep:
+            print('Regression outputs kept in', workDir)
+        else:
+            shutil.rmtree(workDir, ignore_errors=True)
+    os.makedirs('info', exist_ok=True)
+    df.to_csv(os.path.join('info', 'regression_report.csv'), encoding='utf-8',
+              index=False)
+    print('PASS' if df.empty else 'FAIL: report saved to '
+          'info/regression_report.csv')
+    return df
+
+
+def checkFailFast(xlsDir, candidateDir=None, legalChars='abcdefghijklmnopqrstuvwxyz'):
+
+    """
+    Runs the candidate pipeline on xlsDir with validate_fail_fast and an
+    ipa.xml of legalChars only, so that the first transcription is illegal,
+    and checks that the run stops there: IllegalCharsError is raised, only
+    the failing workbook is journaled (as an error), its csv files are
+    removed and no info files are written.
+
+    Parameters:
+        xlsDir : str. Directory of xls files, with at least two workbooks
+        candidateDir : str. Source tree. Default: this directory
+        legalChars : str. Characters written to the ipa.xml used
+
+    Returns bool, True if the run stopped at the first workbook
+    """
+
+    if candidateDir is None:
+        candidateDir = os.path.dirname(os.path.abspath(__file__))
+    workDir = tempfile.mkdtemp(prefix='dpa_failfast_')
+    try:
+        ipaPath = os.path.join(workDir, 'ipa.xml')
+        with io.open(ipaPath, 'w', encoding='utf-8') as f:
+            f.write(u'<ipa>\n' + u''.join(u'<char value={}/>\n'.format(
+                    quoteattr(char)) for char in legalChars) + u'</ipa>\n')
+        outDir = os.path.join(workDir, 'out')
+        os.makedirs(outDir)
+        env = dict(os.environ, PYTHONHASHSEED='0')
+        result = subprocess.run([sys.executable, '-c', failFastCode,
+                                 os.path.abspath(candidateDir),
+                                 os.path.abspath(xlsDir), outDir, ipaPath],
+                                env=env, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        with io.open(os.path.join(outDir, 'info', 'run_journal.jsonl'),
+                     encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f][1:]
+        csvDir = os.path.join(outDir, 'csv')
+        checks = [('stopped with IllegalCharsError', result.returncode == 3),
+                  ('one workbook journaled, as an error',
+                   [entry.get('status') for entry in entries] == ['error']),
+                  ('csv files of the workbook removed',
+                   not os.path.isdir(csvDir) or not os.listdir(csvDir)),
+                  ('no info files written', not os.path.isfile(
+                   os.path.join(outDir, 'info', 'workbook_errors.csv')))]
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    for check, passed in checks:
+        print('  {}: {}'.format(check, 'ok' if passed else 'FAILED'))
+    passed = all(passed for check, passed in checks)
+    print('PASS' if passed else 'FAIL:\n' +
+          result.stdout.decode('utf-8', 'replace')[-2000:])
+    return passed
+
+
+if __name__ == '__main__':
+    regressionCheck(os.path.normpath(input('Input xls directory: ')))
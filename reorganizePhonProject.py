@@ -28,10 +28,17 @@ The purpose of the post_select option is to handle scenarios where there are mul
 """
 
 import fnmatch
+import hashlib
+import json
 import os
 import os.path
 import re
 import shutil
+import stat
+import tempfile
+import warnings
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
 # ------------------------------------------------------------------------------
@@ -56,6 +63,152 @@ def enter_dir(newdir):
         os.chdir(prevdir)
 
 
+# Finds every 4-digit number in a file name; group 1 is its leading digit.
+# Matches the same files as re.search(keyword + r"\d{3}") for keywords 1-9.
+bucket_pattern = re.compile(r"(?=([1-9])\d{3})")
+
+# ioctl request to clone a file (reflink) on Linux filesystems that support it
+FICLONE = 0x40049409
+
+# Name of the content-addressed session store created by link="store"
+store_name = ".session_store"
+
+# Permissions of store blobs, shared by every derived session linking to them
+blob_mode = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+
+def default_store(session_directory):
+    """Return the store shared by every project derived from a corpus.
+
+    The store is ".session_store" in the project folder of the source corpus,
+    so all derived projects and corpora of one source share their blobs, and
+    the store is on the same device as the sessions it links to.
+
+    Args:
+        session_directory (str): Directory path of the source corpus.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(session_directory)), store_name)
+
+
+def hash_file(path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def store_session(src, store_directory):
+    """Add a session file to the content-addressed store.
+
+    Blobs are named by the SHA-256 hash of their content, in subfolders named
+    by the first two hex digits, and keep the file extension. A blob is a
+    full copy of src, so later edits of src never change the store.
+
+    Blobs are read-only. Derived sessions are hard links to their blob, so
+    writing into one would change it in every derived project and leave the
+    blob's name no longer matching its content. To edit a derived session,
+    replace the file (copy it, delete the link and rename the copy) rather
+    than writing into it.
+
+    Args:
+        src (str): Path of the session file.
+        store_directory (str): Directory of the store. Created if needed.
+
+    Returns:
+        str: Path of the blob.
+    """
+    digest = hash_file(src)
+    blob = os.path.join(store_directory, digest[:2], digest + os.path.splitext(src)[1])
+    if not os.path.exists(blob):
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        # Copy to a temporary file first so a blob is never left incomplete
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(blob), suffix=".tmp")
+        os.close(fd)
+        shutil.copy2(src, tmp_path)
+        os.chmod(tmp_path, blob_mode)
+        os.replace(tmp_path, blob)
+    else:
+        # Set again in case remove_file() cleared it through another link
+        os.chmod(blob, blob_mode)
+    return blob
+
+
+def remove_file(path):
+    """Remove a file, including a read-only one.
+
+    Windows does not remove read-only files, so the read-only flag is cleared
+    first. The flag belongs to the file rather than the link, so this also
+    clears it on a store blob that path links to. store_session() sets it
+    again the next time the blob is linked.
+    """
+    try:
+        os.remove(path)
+    except PermissionError:
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        os.remove(path)
+
+
+def link_or_copy(src, dst, link=None, store_directory=None):
+    """Copy a session file, or link it instead of making a full copy.
+
+    Args:
+        src (str): Path of the file to copy.
+        dst (str): Destination file path. Replaced if it exists.
+        link (str, optional): None for a full copy, "hardlink" for a hard link,
+            "reflink" for a copy-on-write clone (Linux, e.g. Btrfs or XFS), or
+            "store" for a read-only hard link to a blob in the
+            content-addressed store (see store_session()). Falls back to a
+            full copy if the link cannot be made, with a warning for
+            "store" since the session is then not shared.
+        store_directory (str, optional): Store used by link="store". Defaults
+            to the store of the source corpus, see default_store().
+
+    Raises:
+        shutil.SameFileError: Raised when dst is already the same file as src.
+    """
+    session = src
+    if link == "store":
+        src = store_session(src, store_directory or default_store(os.path.dirname(src)))
+    if os.path.exists(dst):
+        if os.path.samefile(src, dst):
+            raise shutil.SameFileError(f"{src} and {dst} are the same file")
+        # Never write through an existing link into another file
+        remove_file(dst)
+    if link in ("hardlink", "store"):
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            # e.g. the store is on another device than dst
+            if link == "store":
+                warnings.warn(f"{dst} copied instead of linked to the session store: {e}")
+    if link == "reflink":
+        try:
+            import fcntl
+
+            with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            # Keep the modification time, as copy2() does, for is_up_to_date()
+            shutil.copystat(src, dst)
+            return
+        except (ImportError, OSError):
+            pass
+    shutil.copy2(session, dst)
+
+
+# Helper function for organize_corpus()
+def copy_session(src, dst, link=None, store_directory=None):
+    """Copy one session file into a corpus folder, reporting the result."""
+    File = os.path.basename(src)
+    try:
+        link_or_copy(src, dst, link, store_directory)
+        print(f"{File} Copied to {os.path.basename(os.path.dirname(dst))} Directory")
+    except shutil.SameFileError:
+        print(f"{File} already exists. Not copied")
+
+
 # Helper function for organize_corpus()
 def organize_files_by_regex(project_directory, keyword):
     """Create a new corpus filtered to one of 1000s, 2000s, 3000s, etc.
@@ -116,108 +269,447 @@ def organize():
 
 
 # Use this function to organize a corpusby 1000s, 2000s, etc.
-def organize_corpus(corpus_directory):
-    corpusNames = []
-    for keyword in range(1, 10):
-        keyword = str(keyword)
-        corpusNames.append(organize_files_by_regex(corpus_directory, keyword))
-    return
+def organize_corpus(corpus_directory, link=None, max_workers=8, store_directory=None):
+    """Create new corpora filtered to 1000s, 2000s, 3000s, etc.
+
+    The corpus directory is listed once, and each session file is assigned to
+    every bucket matching a 4-digit number in its name. Copies run in a
+    thread pool.
+
+    Args:
+        corpus_directory (str): Directory path of the corpus (Phon sessions inside).
+        link (str, optional): None for full copies, "hardlink", "reflink" or
+            "store". See link_or_copy().
+        max_workers (int, optional): Number of copy threads. Defaults to 8.
+        store_directory (str, optional): Store used by link="store". Defaults
+            to the store of corpus_directory, see default_store().
+
+    Returns:
+        list: Corpus names created.
+    """
+    if link == "store" and store_directory is None:
+        store_directory = default_store(corpus_directory)
+    corpusNames = [str(keyword) + "000s" for keyword in range(1, 10)]
+    for newCorpusName in corpusNames:
+        try:
+            os.mkdir(os.path.join(corpus_directory, newCorpusName))
+        except FileExistsError:
+            print(f"{newCorpusName} directory already exists. Adding to folder")
+
+    # Single scan of the corpus directory
+    copies = []
+    with os.scandir(corpus_directory) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            for keyword in sorted(set(bucket_pattern.findall(entry.name))):
+                dst = os.path.join(corpus_directory, keyword + "000s", entry.name)
+                copies.append((entry.path, dst))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(
+            executor.map(lambda c: copy_session(c[0], c[1], link, store_directory), copies)
+        )
+    return corpusNames
+
+
+def compile_filter(keywords):
+    """Compile keywords into one matcher for file names containing any keyword.
+
+    Equivalent to any(fnmatch.fnmatch(name, "*" + key + "*") for key in keywords),
+    including case-insensitive matching on Windows. Match os.path.normcase(name).
+
+    Args:
+        keywords (list): Keywords, which may contain fnmatch wildcards.
+
+    Returns:
+        re.Pattern: Compiled pattern. Use pattern.match().
+    """
+    return re.compile(
+        "|".join(fnmatch.translate(os.path.normcase("*" + key + "*")) for key in keywords)
+    )
+
+
+def plan_derive_project(
+    session_directory, corpus_filter, session_filter, pre_select=1, post_select=0
+):
+    """
+    Plans the copies for derive_project() without copying anything.
+
+    Args:
+        session_directory (str): The directory path of the session.
+        corpus_filter (list): A list of corpus filters. Sessions will be organized into these corpora folders.
+        session_filter (list): A list of session filters. Only filtered sessions will be included.
+        pre_select (int, optional): The pre-select option. Defaults to 1.
+        post_select (int, optional): The post-select option. Defaults to 0.
+
+    Raises:
+        FileNotFoundError: Raised when 'project.xml' is not found in the parent project directory.
+
+    Returns:
+        list: Copy plan of (source path, destination path) tuples.
+    """
+    session_directory = os.path.normpath(session_directory)
+    # Get the parent directory of the session directory
+    parent_directory = os.path.dirname(session_directory)
+
+    # Check if 'project.xml' exists in the parent directory
+    if not os.path.isfile(os.path.join(parent_directory, "project.xml")):
+        raise FileNotFoundError("project.xml not found in parent project directory")
+
+    # Single listing of the session directory
+    session_files = sorted(os.listdir(session_directory))
+
+    # Determine excluded 'Pre' files based on the pre-select option
+    exclude = set()
+    multi_pre_list = [e for e in session_files if re.search(r"Pre\s?\d", e)]
+    if pre_select == 1:
+        # Exclude 'Pre' files with a single digit
+        exclude.update(multi_pre_list)
+    if pre_select == 2:
+        # Exclude 'Pre' files replaced by files with ' 2' suffix
+        exclude.update(e.replace(" 2", "") for e in multi_pre_list)
+
+    # Determine excluded 'Post' files based on the post-select option
+    multi_post_list = [e for e in session_files if re.search(r"Post\s?II", e)]
+    if post_select == 1:
+        # Exclude 'Post II' files
+        exclude.update(multi_post_list)
+    if post_select == 2:
+        # Exclude 'Post' files replaced by files with ' II' suffix
+        exclude.update(e.replace(" II", "") for e in multi_post_list)
+
+    # Compile filters once
+    corpus_matchers = [(corpus, compile_filter([corpus])) for corpus in corpus_filter]
+    session_matcher = compile_filter(session_filter)
+
+    plan = []
+    for e in session_files:
+        src = os.path.join(session_directory, e)
+        assert os.path.isfile(src), "Error: Subdirectory found."
+        # Don't include excluded Pre and Post files specified by select options
+        if e in exclude:
+            continue
+        name = os.path.normcase(e)
+        if not session_matcher.match(name):
+            continue
+        # Copy the file to each corpus folder matching the filters
+        for corpus, corpus_matcher in corpus_matchers:
+            if corpus_matcher.match(name):
+                plan.append((src, os.path.join(parent_directory, corpus, e)))
+    return plan
+
+
+def report_plan(plan):
+    """Print a dry-run report of a copy plan.
+
+    Args:
+        plan (list): Copy plan of (source path, destination path) tuples.
+
+    Returns:
+        dict: Number of files planned per destination folder.
+    """
+    counts = {}
+    for src, dst in plan:
+        folder = os.path.dirname(dst)
+        counts[folder] = counts.get(folder, 0) + 1
+        status = "up to date" if is_up_to_date(src, dst) else "copy"
+        print(f"{status}: {os.path.basename(src)} -> {folder}")
+    for folder, count in counts.items():
+        print(f"{count} files planned for {folder}")
+    return counts
+
+
+def is_up_to_date(src, dst):
+    """Return True if dst exists with the same size and modification time as src."""
+    try:
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    return (src_stat.st_size, src_stat.st_mtime) == (dst_stat.st_size, dst_stat.st_mtime)
+
+
+def execute_plan(plan, link=None, max_workers=8, store_directory=None):
+    """Carry out a copy plan in a thread pool, skipping files already up to date.
+
+    Args:
+        plan (list): Copy plan of (source path, destination path) tuples.
+        link (str, optional): None for full copies, "hardlink", "reflink" or
+            "store". See link_or_copy().
+        max_workers (int, optional): Number of copy threads. Defaults to 8.
+        store_directory (str, optional): Store used by link="store".
+
+    Returns:
+        dict: Number of files "copied" and "skipped".
+    """
+
+    def execute(copy):
+        src, dst = copy
+        if is_up_to_date(src, dst):
+            return "skipped"
+        link_or_copy(src, dst, link, store_directory)
+        return "copied"
+
+    for folder in sorted(set(os.path.dirname(dst) for src, dst in plan)):
+        try:
+            os.mkdir(folder)
+        except FileExistsError:
+            print(f"{os.path.basename(folder)} directory already exists. Adding to folder")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(execute, plan))
+    summary = {"copied": results.count("copied"), "skipped": results.count("skipped")}
+    print(f"{summary['copied']} files copied, {summary['skipped']} already up to date")
+    return summary
 
 
 # Use this function to filter and organize an entire project by keyword lists
 def derive_project(
-    session_directory, corpus_filter, session_filter, pre_select=1, post_select=0
+    session_directory,
+    corpus_filter,
+    session_filter,
+    pre_select=1,
+    post_select=0,
+    dry_run=False,
+    link=None,
+    max_workers=8,
+    store_directory=None,
 ):
     """
     Derives a project based on the given filters.
 
+    Planning (plan_derive_project) and copying (execute_plan) are separate, so
+    a dry run reports the plan without copying, and files whose size and
+    modification time already match are not copied again.
+
     Args:
         session_directory (str): The directory path of the session.
         corpus_filter (list): A list of corpus filters. Sessions will be organized into these corpora folders.
         session_filter (list): A list of session filters. Only filtered sessions will be included.
         pre_select (int, optional): The pre-select option. Defaults to 1.
         post_select (int, optional): The post-select option. Defaults to 0.
+        dry_run (bool, optional): Only report the copy plan. Defaults to False.
+        link (str, optional): None for full copies, "hardlink", "reflink" or "store".
+        max_workers (int, optional): Number of copy threads. Defaults to 8.
+        store_directory (str, optional): Store used by link="store". Defaults
+            to the store of session_directory, see default_store().
 
     Raises:
         FileNotFoundError: Raised when 'project.xml' is not found in the parent project directory.
+
+    Returns:
+        list: Copy plan of (source path, destination path) tuples.
     """
-    # Change to the session directory
-    with change_dir(session_directory):
-        # Get the parent directory of the session directory
-        parent_directory = os.path.dirname(session_directory)
-
-        # Check if 'project.xml' exists in the parent directory
-        if "project.xml" not in os.listdir(parent_directory):
-            raise FileNotFoundError("project.xml not found in parent project directory")
-
-        # Determine excluded 'Pre' files based on the pre-select option
-        if pre_select == 1:
-            # Exclude 'Pre' files with a single digit
-            exclude_pre_list = [
-                e for e in os.listdir(session_directory) if re.search(r"Pre\s?\d", e)
-            ]
-        if pre_select == 2:
-            # Exclude 'Pre' files with a single digit and rename files with ' 2' suffix
-            multi_pre_list = [
-                e for e in os.listdir(session_directory) if re.search(r"Pre\s?\d", e)
-            ]
-            exclude_pre_list = [e.replace(" 2", "") for e in multi_pre_list]
-
-        # Determine excluded 'Post' files based on the post-select option
-        if post_select == 1:
-            # Exclude 'Post II' files
-            exclude_post_list = [
-                e for e in os.listdir(session_directory) if re.search(r"Post\s?II", e)
-            ]
-        if post_select == 2:
-            # Exclude 'Post II' files and remove ' II' suffix
-            multi_post_list = [
-                e for e in os.listdir(session_directory) if re.search(r"Post\s?II", e)
-            ]
-            exclude_post_list = [e.replace(" II", "") for e in multi_post_list]
-        # Create corpus folders
-        for corpus in corpus_filter:
-            try:
-                os.mkdir(os.path.join(parent_directory, corpus))
-            except FileExistsError:
-                print(f"{corpus} directory already exists. Adding to folder")
-        # Organize all files
-        for e in os.listdir(session_directory):
-            assert os.path.isfile(e), "Error: Subdirectory found."
-            for corpus in corpus_filter:
-                # Don't include excluded Pre files specified by pre-select option
-                if pre_select > 0:
-                    if e in exclude_pre_list:
-                        continue
-                # Don't include excluded Post files specified by pre-select option
-                if post_select > 0:
-                    if e in exclude_post_list:
-                        continue
-                # Copy the file to the appropriate corpus folder if it matches the filters
-                if fnmatch.fnmatch(e, "*" + corpus + "*"):
-                    for key in session_filter:
-                        if fnmatch.fnmatch(e, "*" + key + "*"):
-                            shutil.copy(e, os.path.join(parent_directory, corpus, e))
-
-                        else:
-                            continue
-                else:
-                    continue
+    if link == "store" and store_directory is None:
+        store_directory = default_store(session_directory)
+    plan = plan_derive_project(
+        session_directory, corpus_filter, session_filter, pre_select, post_select
+    )
+    if dry_run:
+        report_plan(plan)
+    else:
+        execute_plan(plan, link, max_workers, store_directory)
+    return plan
+
+
+def read_session_metadata(session_path):
+    """Read the metadata of a Phon session file with a streaming XML parser.
+
+    Records are counted and discarded as they are parsed, so memory use does
+    not grow with the size of the session.
 
-    return
+    Args:
+        session_path (str): Path of a Phon session (.xml) file.
 
+    Returns:
+        dict: "session", "corpus", "date", "participants" (list of dicts with
+        "id", "role" and "name") and "records" (number of records).
+    """
+    metadata = {
+        "session": os.path.splitext(os.path.basename(session_path))[0],
+        "corpus": None,
+        "date": None,
+        "participants": [],
+        "records": 0,
+    }
+    for event, elem in ET.iterparse(session_path, events=("start", "end")):
+        # Remove XML namespace
+        tag = elem.tag.rsplit("}", 1)[-1]
+        if event == "start":
+            if tag == "session":
+                metadata["session"] = elem.get("name") or elem.get("id") or metadata["session"]
+                metadata["corpus"] = elem.get("corpus")
+            continue
+        if tag == "date" and metadata["date"] is None:
+            metadata["date"] = (elem.text or "").strip()
+        elif tag == "participant":
+            name = next((child.text for child in elem if child.tag.rsplit("}", 1)[-1] == "name"), None)
+            metadata["participants"].append(
+                {"id": elem.get("id"), "role": elem.get("role"), "name": name}
+            )
+        elif tag in ("u", "record"):
+            metadata["records"] += 1
+            elem.clear()
+    return metadata
+
+
+def session_index(session_directory, index_path=None):
+    """Return metadata of every session in a corpus folder, using a cached index.
+
+    The index is a json file keyed by file name, holding each session's size,
+    modification time and metadata. Only new or modified sessions are parsed.
 
-## Input must be a PROJECT folder
-# derive_project(
-#     r"R:\Admin\Alt Workspace\DPA v1_4 all - Copy",
-#     ["Pre", "Post"],
-#     ["PKP", "OCP", "CCP", "GFTA"],
-#     pre_select=1,
-#     post_select=0,
-# )
+    Args:
+        session_directory (str): Directory path of the corpus (Phon sessions inside).
+        index_path (str, optional): Path of the index file. Defaults to
+            ".session_index.json" in the parent project directory.
 
-## The directory path given here must a CORPUS directory (Phon sessions inside)
-organize_corpus(r"R:\Admin\Alt Workspace\DPA v1_6_PrePost\Pre")
+    Returns:
+        dict: {file name: metadata dict} for every .xml session file.
+    """
+    session_directory = os.path.normpath(session_directory)
+    if index_path is None:
+        index_path = os.path.join(
+            os.path.dirname(session_directory),
+            ".session_index.json",
+        )
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        index = {}
+    corpus_index = index.get(os.path.basename(session_directory), {})
+
+    updated = {}
+    parsed = 0
+    with os.scandir(session_directory) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith(".xml"):
+                continue
+            stat = entry.stat()
+            cached = corpus_index.get(entry.name)
+            if cached and (cached["size"], cached["mtime"]) == (stat.st_size, stat.st_mtime):
+                updated[entry.name] = cached
+                continue
+            updated[entry.name] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "metadata": read_session_metadata(entry.path),
+            }
+            parsed += 1
+
+    if parsed or len(updated) != len(corpus_index):
+        index[os.path.basename(session_directory)] = updated
+        # Write to a temporary file first so the index is never left incomplete
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), suffix=".tmp")
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+    print(f"{len(updated)} sessions indexed, {parsed} parsed")
+    return {name: entry["metadata"] for name, entry in updated.items()}
+
+
+def plan_derive_by_metadata(session_directory, corpus_queries, index_path=None):
+    """Plan copies into corpora selected by session metadata instead of file names.
+
+    Args:
+        session_directory (str): Directory path of the corpus (Phon sessions inside).
+        corpus_queries (dict): {corpus name: function(metadata) -> bool}.
+            See read_session_metadata() for the metadata fields. Example:
+            {"Pre": lambda m: m["session"].endswith("Pre") and m["records"] > 0}
+        index_path (str, optional): Path of the index file. See session_index().
+
+    Returns:
+        list: Copy plan of (source path, destination path) tuples.
+    """
+    session_directory = os.path.normpath(session_directory)
+    parent_directory = os.path.dirname(session_directory)
+    sessions = session_index(session_directory, index_path)
+    plan = []
+    for name in sorted(sessions):
+        for corpus, query in corpus_queries.items():
+            if query(sessions[name]):
+                plan.append(
+                    (os.path.join(session_directory, name), os.path.join(parent_directory, corpus, name))
+                )
+    return plan
+
+
+# Use this function to derive a project from session metadata queries
+def derive_project_by_metadata(
+    session_directory,
+    corpus_queries,
+    index_path=None,
+    dry_run=False,
+    link=None,
+    max_workers=8,
+    store_directory=None,
+):
+    """
+    Derives a project from session metadata (participant, date, session name,
+    record count) rather than file names. See plan_derive_by_metadata().
+    With link="store", the store defaults to that of session_directory, see
+    default_store().
+
+    Returns:
+        list: Copy plan of (source path, destination path) tuples.
+    """
+    if link == "store" and store_directory is None:
+        store_directory = default_store(session_directory)
+    plan = plan_derive_by_metadata(session_directory, corpus_queries, index_path)
+    if dry_run:
+        report_plan(plan)
+    else:
+        execute_plan(plan, link, max_workers, store_directory)
+    return plan
+
+
+# Use this function to remove sessions no derived project links to any more
+def collect_garbage(store_directory, dry_run=False):
+    """Remove blobs of the content-addressed store that are not referenced.
+
+    A blob with a single link is no longer part of any derived project, since
+    derived session files are hard links to their blob.
+
+    Args:
+        store_directory (str): Directory of the store.
+        dry_run (bool, optional): Only report unreferenced blobs. Defaults to False.
+
+    Returns:
+        dict: Number of "removed" blobs, "kept" blobs and "bytes" freed.
+    """
+    summary = {"removed": 0, "kept": 0, "bytes": 0}
+    for root, dirs, files in os.walk(store_directory, topdown=False):
+        for name in files:
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            # Leftover temporary files of interrupted copies are never referenced
+            if stat.st_nlink > 1 and not name.endswith(".tmp"):
+                summary["kept"] += 1
+                continue
+            summary["removed"] += 1
+            summary["bytes"] += stat.st_size
+            if not dry_run:
+                remove_file(path)
+        if not dry_run and root != store_directory and not os.listdir(root):
+            os.rmdir(root)
+    action = "unreferenced" if dry_run else "removed"
+    print(f"{summary['removed']} blobs {action} ({summary['bytes']} bytes), {summary['kept']} kept")
+    return summary
+
+
+if __name__ == "__main__":
+    ## Input must be a PROJECT folder
+    # derive_project(
+    #     r"R:\Admin\Alt Workspace\DPA v1_4 all - Copy",
+    #     ["Pre", "Post"],
+    #     ["PKP", "OCP", "CCP", "GFTA"],
+    #     pre_select=1,
+    #     post_select=0,
+    # )
+
+    ## The directory path given here must a CORPUS directory (Phon sessions inside)
+    organize_corpus(r"R:\Admin\Alt Workspace\DPA v1_6_PrePost\Pre")
 
 ### ToDo
 # Output to a new Phon project, rather than inside the same directory
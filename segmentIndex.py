@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent character and segment index of the DPA transcriptions.
+
+Maps every character (code point) and every whitespace-delimited segment in
+the transcription columns to its frequency and its postings
+(participant, probe, session, row). The index is stored as a SQLite database
+in the 'info' directory and is updated incrementally: only files added,
+modified or removed since the last update are scanned again.
+
+Intended to replace full-archive scans (extractSegments(), illegalChars.py)
+during dictionary maintenance.
+
+Usage:
+    updateIndex('processed')    # index Phon-ready csv files in 'csv'
+    updateIndex('raw')          # index original xls files in 'excel'
+    frequency('ʧ')
+    where('ʧ')
+    items('segment')
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import io
+import csv
+import sqlite3
+from collections import Counter
+import pandas as pd
+# May also require xlrd install as dependency for pandas
+from auxiliar import participantID, selectCSV
+
+indexPath = os.path.join('info', 'segment_index.sqlite')
+
+# Columns searched in processed csv files
+processedColumns = ['IPA Target', 'IPA Actual']
+# Columns never searched in raw xls sheets (see extractSegments())
+rawSkipColumns = ['Word', 'Target']
+rawSkipSheets = ['Copyright', 'Probe Schedule']
+
+
+def _connect(indexPath=indexPath):
+
+    """
+    Open the index database, creating tables if needed.
+
+    Returns sqlite3.Connection
+    """
+
+    indexDir = os.path.dirname(indexPath)
+    if indexDir:
+        os.makedirs(indexDir, exist_ok=True)
+    con = sqlite3.connect(indexPath)
+    con.executescript("""
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            source TEXT,
+            mtime REAL,
+            size INTEGER);
+        CREATE TABLE IF NOT EXISTS postings (
+            kind TEXT,
+            item TEXT,
+            path TEXT,
+            participant TEXT,
+            probe TEXT,
+            session TEXT,
+            tier TEXT,
+            row INTEGER,
+            count INTEGER);
+        CREATE INDEX IF NOT EXISTS postings_item ON postings (item, kind);
+        CREATE INDEX IF NOT EXISTS postings_path ON postings (path);
+        """)
+    return con
+
+
+def _cellPostings(value, path, participant, probe, session, tier, row):
+
+    """
+    Generator. Yields one posting per distinct character and segment in a
+    transcription cell.
+    """
+
+    if not isinstance(value, str):
+        return
+    for char, count in Counter(value).items():
+        if char.isspace():
+            continue
+        yield ('character', char, path, participant, probe, session, tier,
+               row, count)
+    for segment, count in Counter(value.split()).items():
+        yield ('segment', segment, path, participant, probe, session, tier,
+               row, count)
+
+
+def _processedPostings(fpath, relPath):
+
+    """
+    Generator. Yields postings for a Phon-ready csv file generated by
+    dpa_script.py. Rows are numbered from 0, excluding the header.
+    """
+
+    with io.open(fpath, mode='r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        for row, record in enumerate(reader):
+            for tier in processedColumns:
+                for posting in _cellPostings(record.get(tier), relPath,
+                                             record.get('Speaker'),
+                                             record.get('Probe'),
+                                             record.get('Session'),
+                                             tier, row):
+                    yield posting
+
+
+def _rawPostings(fpath, relPath):
+
+    """
+    Generator. Yields postings for a DPA xls file named '####_PHON.xls'.
+    Every column except 'Word' and 'Target' of every probe sheet is treated
+    as a session. Rows are numbered from 0, excluding the header.
+    """
+
+    fname = os.path.basename(fpath)
+    participant = fname[:fname.find('_')]
+    data_xls = pd.read_excel(fpath, None)
+    for probe, dfSheet in data_xls.items():
+        if probe in rawSkipSheets:
+            continue
+        for session in dfSheet.columns:
+            if session in rawSkipColumns:
+                continue
+            for row, value in enumerate(dfSheet[session].tolist()):
+                for posting in _cellPostings(value, relPath, participant,
+                                             probe, str(session),
+                                             str(session), row):
+                    yield posting
+
+
+def _sourceFiles(csvType):
+
+    """
+    Returns (source directory, file extensions, postings generator) for
+    csvType 'processed' or 'raw'.
+    """
+
+    assert csvType in ['raw', 'processed'], """
+    csvType must specify the data indexed. Specify:
+        'raw' for unmodified data in the 'excel' directory
+        'processed' for Phon-ready csv generated by the main script"""
+    if csvType == 'raw':
+        return 'excel', ('.xls', '.xlsx'), _rawPostings
+    return 'csv', ('.csv',), _processedPostings
+
+
+def updateIndex(csvType='processed', indexPath=indexPath, sourceDir=None,
+                participants=None, probes=None, sessions=None):
+
+    """
+    Brings the index up to date with a directory of csv or xls files. Files
+    are compared with the index by modification time and size; only new or
+    changed files are scanned and postings of removed files are deleted.
+
+    Parameters:
+        csvType : str
+            'processed' (default) for Phon-ready csv files in 'csv'
+            'raw' for unmodified xls files in 'excel'
+        indexPath : str. Path of the index database.
+            Default 'info/segment_index.sqlite'
+        sourceDir : str. Overrides default directory for csvType
+        participants, probes, sessions : default None (all). Update only the
+            files of these participants, probe sheets and session column
+            patterns (see auxiliar.selectCSV()). Other files are neither
+            scanned nor removed from the index. Probes and sessions select
+            whole files, so they apply to 'processed' only
+
+    Returns Counter of files 'added', 'updated', 'removed', 'unchanged'
+    """
+
+    defaultDir, exts, postings = _sourceFiles(csvType)
+    if csvType == 'raw':
+        if probes is not None or sessions is not None:
+            raise ValueError('probes and sessions select processed csv files '
+                             'only: an xls file holds every session')
+        participants = None if participants is None else \
+            set(str(participant) for participant in participants)
+
+        def selected(relPath):
+            return participants is None or participantID(relPath) in \
+                participants
+    else:
+        def selected(relPath):
+            return selectCSV(relPath, participants, probes, sessions)
+    if sourceDir is None:
+        sourceDir = defaultDir
+    source = '{}:{}'.format(csvType, os.path.abspath(sourceDir))
+    status = Counter()
+
+    con = _connect(indexPath)
+    try:
+        indexed = {path: (mtime, size) for path, mtime, size in con.execute(
+                'SELECT path, mtime, size FROM files WHERE source = ?',
+                (source,))}
+        current = {}
+        for root, dirs, files in os.walk(sourceDir):
+            for fname in files:
+                if fname.endswith(exts) and not fname.startswith('~$') \
+                        and selected(fname):
+                    fpath = os.path.join(root, fname)
+                    relPath = os.path.relpath(fpath, sourceDir)
+                    current[relPath] = fpath
+
+        print('Updating index of {} files...'.format(len(current)))
+        for relPath in set(filter(selected, indexed)) - set(current):
+            with con:
+                con.execute('DELETE FROM postings WHERE path = ?', (relPath,))
+                con.execute('DELETE FROM files WHERE path = ?', (relPath,))
+            status['removed'] += 1
+        for relPath in sorted(current):
+            st = os.stat(current[relPath])
+            if indexed.get(relPath) == (st.st_mtime, st.st_size):
+                status['unchanged'] += 1
+                continue
+            # One transaction per file, so an interrupted update only
+            # loses the file in progress
+            with con:
+                con.execute('DELETE FROM postings WHERE path = ?', (relPath,))
+                con.executemany(
+                        'INSERT INTO postings VALUES (?,?,?,?,?,?,?,?,?)',
+                        postings(current[relPath], relPath))
+                con.execute('INSERT OR REPLACE INTO files VALUES (?,?,?,?)',
+                            (relPath, source, st.st_mtime, st.st_size))
+            status['updated' if relPath in indexed else 'added'] += 1
+    finally:
+        con.close()
+    print('Index updated: {}'.format(dict(status)))
+    return status
+
+
+def where(item, kind=None, indexPath=indexPath):
+
+    """
+    Returns the postings of a character or segment.
+
+    Parameters:
+        item : str. Character or whitespace-delimited segment
+        kind : str. default None. 'character' or 'segment' to restrict search
+        indexPath : str. Path of the index database
+
+    Returns list of tuples
+        (participant, probe, session, tier, row, count, path)
+    """
+
+    query = ('SELECT participant, probe, session, tier, row, count, path '
+             'FROM postings WHERE item = ?')
+    args = [item]
+    if kind is not None:
+        query += ' AND kind = ?'
+        args.append(kind)
+    con = _connect(indexPath)
+    try:
+        return con.execute(query + ' ORDER BY path, row', args).fetchall()
+    finally:
+        con.close()
+
+
+def frequency(item, kind=None, indexPath=indexPath):
+
+    """
+    Returns number of occurrences of a character or segment as int.
+    """
+
+    query = 'SELECT COALESCE(SUM(count), 0) FROM postings WHERE item = ?'
+    args = [item]
+    if kind is not None:
+        query += ' AND kind = ?'
+        args.append(kind)
+    con = _connect(indexPath)
+    try:
+        return con.execute(query, args).fetchone()[0]
+    finally:
+        con.close()
+
+
+def items(kind='segment', indexPath=indexPath):
+
+    """
+    Returns list of (item, frequency) for every indexed character or
+    segment, sorted by length as in extractSegments().
+
+    Parameters:
+        kind : str. 'segment' (default) or 'character'
+    """
+
+    con = _connect(indexPath)
+    try:
+        result = con.execute('SELECT item, SUM(count) FROM postings '
+                             'WHERE kind = ? GROUP BY item',
+                             (kind,)).fetchall()
+    finally:
+        con.close()
+    return sorted(result, key=lambda x: len(x[0]))
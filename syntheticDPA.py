@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic DPA workbook generator.
+
+Writes '####_PHON.xlsx' (or .xls) workbooks shaped like the archival DPA
+files, so conversion throughput can be measured and shared without the
+archival data. Every workbook has a Copyright sheet, a Probe Schedule sheet
+with CA values, and probe sheets with Word, Target and one column per
+session. As in some archival files, session labels may repeat across sheets
+('Pre' on several probe sheets). Words and transcriptions are drawn from the dictionaries in 'dicts':
+raw orthography from word_dict.csv, transcriptions from target_dict.csv with
+superscripts, characters from other_chars_translate_dict.csv, spaces,
+multiple productions, [] delayed imitations, NR and exclude-list items added
+at random.
+
+Output is fully determined by the seed.
+
+Usage:
+    generateCorpus('synthetic/excel', participants = 20, rows = 100)
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import io
+import csv
+import random
+import unicodedata
+import pandas as pd
+from auxiliar import excludeListSpaces
+
+# Probe sheets and their session column suffixes, as in the archival files
+probeSessions = [
+        ('GFTA', ['Pre', 'Post', 'PS']),
+        ('OCP', ['Pre', '2wk', '2mo', 'Post', 'PS']),
+        ('CCP', ['Pre', 'Post', '2mo']),
+        ('PKP', ['Pre', 'Post']),
+        ('TP', ['1', '2', '3', '4', '5', '6'])]
+
+# Probability of each feature per transcription cell
+defaultRates = {'superscript': 0.15,     # raised segment written ̂X
+                'modifier': 0.05,        # initial modifier letter, e.g. ʰ
+                'other_char': 0.10,      # character from other_chars dict
+                'space': 0.20,           # spaces between segments
+                'multiple': 0.10,        # multiple productions
+                'di': 0.05,              # [] delayed imitation
+                'nr': 0.03,              # NR no response
+                'blank': 0.02}           # empty cell
+
+
+def _readDictRows(fpath):
+
+    """
+    Returns (keys, values) rows of a dictionary csv file.
+    """
+
+    with io.open(fpath, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        keys = next(reader)
+        values = next(reader, [])
+    return keys, values
+
+
+def loadVocabulary(dictsDir='dicts'):
+
+    """
+    Collects the material synthetic transcriptions are drawn from.
+
+    Returns dict with keys
+        'words' : list of (raw orthography, IPA target)
+        'superscripts' : list of raised segments written as ̂X
+        'modifiers' : list of initial modifier letters
+        'other_chars' : list of literal keys of other_chars_translate_dict
+    """
+
+    targets, ipa = _readDictRows(os.path.join(dictsDir, 'target_dict.csv'))
+    target_dict = dict(zip(targets, ipa))
+    # word_dict.csv is the raw orthography (e.g. 'back i' for 'back-i')
+    raw, values = _readDictRows(os.path.join(dictsDir, 'word_dict.csv'))
+    words = [(word, target_dict[word.replace(' i', '-i')]) for word in raw
+             if target_dict.get(word.replace(' i', '-i'))]
+    keys, values = _readDictRows(
+            os.path.join(dictsDir, 'superscript_dict_noninitial.csv'))
+    superscripts = [key for key in keys
+                    if len(key) == 2 and key[0] == u'̂']
+    keys, values = _readDictRows(
+            os.path.join(dictsDir, 'superscript_dict_initial.csv'))
+    modifiers = sorted({char for key in keys for char in key
+                        if unicodedata.category(char) == 'Lm'})
+    keys, values = _readDictRows(
+            os.path.join(dictsDir, 'other_chars_translate_dict.csv'))
+    other_chars = [key for key in keys
+                   if key and len(key) <= 2 and key.isprintable()
+                   and not set(key) & set('\\()[]|?*+.^$ ')]
+    return {'words': words, 'superscripts': superscripts,
+            'modifiers': modifiers, 'other_chars': other_chars}
+
+
+def syntheticTranscription(rng, target, vocab, rates=defaultRates):
+
+    """
+    Returns a raw DPA-style transcription of target (IPA str) for one cell,
+    or None for an empty cell.
+
+    Parameters:
+        rng : random.Random
+        target : str IPA target transcription
+        vocab : dict from loadVocabulary()
+        rates : dict of feature probabilities, see defaultRates
+    """
+
+    if rng.random() < rates['blank']:
+        return None
+    if rng.random() < rates['nr']:
+        return rng.choice(['NR', u'ɴʀ'])
+
+    def production():
+        segments = list(target.replace(u'ˈ', '').replace(u'ˌ', ''))
+        if rng.random() < rates['other_char'] and segments:
+            segments[rng.randrange(len(segments))] = rng.choice(
+                    vocab['other_chars'])
+        if rng.random() < rates['superscript'] and vocab['superscripts']:
+            segments.insert(rng.randrange(len(segments) + 1),
+                            rng.choice(vocab['superscripts']))
+        if rng.random() < rates['modifier'] and vocab['modifiers']:
+            segments.insert(0, rng.choice(vocab['modifiers']))
+        if rng.random() < rates['space']:
+            return ' '.join(segments)
+        return ''.join(segments)
+
+    transcription = production()
+    if rng.random() < rates['multiple']:
+        # Productions are separated by 4 or more spaces
+        for i in range(rng.randint(1, 3)):
+            transcription += ' ' * rng.randint(4, 6) + production()
+    if rng.random() < rates['di']:
+        transcription += rng.choice(['[]', u'□'])
+    return transcription
+
+
+def generateWorkbook(fpath, rng, vocab, probes=4, sessions=3, rows=60,
+                     rates=defaultRates, repeatLabels=True):
+
+    """
+    Writes one synthetic DPA workbook.
+
+    Parameters:
+        fpath : str path ending in '.xlsx' or '.xls' (requires xlwt)
+        rng : random.Random
+        vocab : dict from loadVocabulary()
+        probes : int. Number of probe sheets (at most 5)
+        sessions : int. Maximum number of session columns per probe sheet
+        rows : int. Words per probe sheet
+        rates : dict of feature probabilities, see defaultRates
+        repeatLabels : bool. default True. Label the sessions of every probe
+            sheet after the first by suffix alone ('Pre', 'Post'), so that
+            labels repeat across sheets. Otherwise 'OCP Pre', etc.
+
+    Returns int number of transcription cells written
+    """
+
+    sheets = {'Copyright': pd.DataFrame({'Copyright': [
+            'Synthetic data generated by syntheticDPA.py']})}
+    schedule = []
+    cells = 0
+    age = rng.randint(36, 72)
+    for n, (probe, suffixes) in enumerate(probeSessions[:probes]):
+        words = rng.sample(vocab['words'], min(rows, len(vocab['words'])))
+        sheet = pd.DataFrame({
+                'Word': [word for word, target in words],
+                # Target segments, e.g. 's m'
+                'Target': [' '.join([c for c in target if c.isalpha()
+                                     and c not in u'ˈˌ'][:2])
+                           for word, target in words]})
+        for suffix in suffixes[:sessions]:
+            col = suffix if repeatLabels and n > 0 else probe + ' ' + suffix
+            column = [syntheticTranscription(rng, target, vocab, rates)
+                      for word, target in words]
+            # One exclude-list item per session, as in the archival files
+            if rng.random() < 0.3:
+                i = rng.randrange(len(column))
+                column[i] = (column[i] or '') + rng.choice(excludeListSpaces)
+            sheet[col] = column
+            cells += len(column)
+            age += rng.randint(0, 3)
+            # A repeated label has one row in the schedule
+            if col not in [label for label, ca in schedule]:
+                schedule.append((col, '{};{};{}'.format(
+                        age // 12, age % 12, rng.randint(1, 28))))
+        sheets[probe] = sheet
+    sheets['Probe Schedule'] = pd.DataFrame(schedule, columns=['Probe', 'CA'])
+    with pd.ExcelWriter(fpath) as writer:
+        for name in ['Copyright', 'Probe Schedule'] + \
+                [probe for probe, suffixes in probeSessions[:probes]]:
+            sheets[name].to_excel(writer, sheet_name=name, index=False)
+    return cells
+
+
+def generateCorpus(outDir, participants=10, probes=4, sessions=3, rows=60,
+                   seed=0, ext='.xlsx', dictsDir='dicts', rates=defaultRates,
+                   repeatLabels=True):
+
+    """
+    Writes synthetic '####_PHON.xlsx' workbooks with distinct participant
+    numbers to outDir.
+
+    Parameters:
+        outDir : str. Output directory, created if needed
+        participants : int. Number of workbooks
+        probes, sessions, rows, rates, repeatLabels : see generateWorkbook()
+        seed : int. Random seed
+        ext : str. '.xlsx' (default) or '.xls'
+        dictsDir : str. Dictionary directory
+
+    Returns tuple(list of workbook paths, int number of transcription cells)
+    """
+
+    rng = random.Random(seed)
+    vocab = loadVocabulary(dictsDir)
+    os.makedirs(outDir, exist_ok=True)
+    fpaths = []
+    cells = 0
+    for participant in sorted(rng.sample(range(1000, 10000), participants)):
+        fpath = os.path.join(outDir, '{}_PHON{}'.format(participant, ext))
+        cells += generateWorkbook(fpath, rng, vocab, probes, sessions, rows,
+                                  rates, repeatLabels)
+        fpaths.append(fpath)
+    print('{} synthetic workbooks with {} transcriptions written to {}'
+          .format(len(fpaths), cells, outDir))
+    return fpaths, cells
+
+
+if __name__ == '__main__':
+    generateCorpus(os.path.join('synthetic', 'excel'))